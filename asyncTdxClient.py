@@ -0,0 +1,365 @@
+import asyncio
+from datetime import date
+import itertools
+import math
+import time
+import zlib
+
+from baseStockClient import CONNECT_TIMEOUT, RSP_HEADER_LEN, ZIPPED, unpack_rsp_header
+from const import BLOCK_FILE_TYPE, CATEGORY, KLINE_TYPE, MARKET, tdx_hosts
+from parser import stock, server, company_info, block
+from parser.baseparser import BaseParser
+from utils.block_reader import BlockReader, BlockReader_TYPE_FLAT
+from utils.heartbeat import DEFAULT_HEARTBEAT_INTERVAL
+from utils.log import log
+from utils.paging import aiter_pages, join_pages
+from utils.response_cache import ResponseCache
+from tdxClient import MAX_HISTORY_TRANSACTION_COUNT, MAX_KLINE_COUNT, MAX_TRANSACTION_COUNT
+
+
+# 请求收发中途出现这些错误时, 流里可能还留着没读完的响应, 连接不能再用
+DESYNC_ERRORS = (asyncio.CancelledError, asyncio.TimeoutError, asyncio.IncompleteReadError, OSError)
+
+
+class AsyncConnection():
+    """
+    一条 asyncio 连接, 同一时刻只有一个请求在途
+
+    响应头和响应体分两次读取, 中途被取消(例如外面套了 asyncio.wait_for)或者超时时, 没读完的响应体会留在流里,
+    下一个请求会把它当成响应头解析. 所以收发中途出错的连接直接关闭并标记为 dead, 不再借出,
+    AsyncTdxClient 在下一次请求前重新建立这条连接
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, ip: str, port: int):
+        self.reader = reader
+        self.writer = writer
+        self.ip = ip
+        self.port = port
+        self.lock = asyncio.Lock()
+        self.last_ack_time = time.time()
+        self.dead = False
+
+    @classmethod
+    async def open(cls, ip, port=7709, time_out=CONNECT_TIMEOUT):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), time_out)
+        return cls(reader, writer, ip, port)
+
+    async def send(self, data):
+        async with self.lock:
+            if self.dead:
+                raise Exception("connection closed")
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+
+                head_buf = await self.reader.readexactly(RSP_HEADER_LEN)
+                zipped, customize, msg_id, zipsize, unzip_size = unpack_rsp_header(head_buf)
+                body_buf = await self.reader.readexactly(zipsize)
+            except DESYNC_ERRORS:
+                self.abort()
+                raise
+            if zipped == ZIPPED:
+                body_buf = zlib.decompress(body_buf)
+
+            self.last_ack_time = time.time()
+            return body_buf
+
+    def abort(self):
+        """
+        不等待地关闭连接; 在被取消的协程里也可以调用
+        """
+        self.dead = True
+        try:
+            self.writer.close()
+        except Exception as e:
+            log.debug(str(e))
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception as e:
+            log.debug(str(e))
+
+
+class AsyncTdxClient():
+    """
+    基于 asyncio 的客户端, 方法与 TdxClient 一一对应, 均为协程
+
+    可以同时持有多条连接, 并发的请求会分摊到空闲的连接上:
+
+        async with AsyncTdxClient(connections=8) as client:
+            bars = await asyncio.gather(*[client.get_security_bars(MARKET.SZ, code, KLINE_TYPE.DAY_K, 0, 800) for code in codes])
+    """
+
+    def __init__(self, connections=1, heartbeat=False, time_out=CONNECT_TIMEOUT, cache: ResponseCache = None):
+        """
+        :param cache: 响应缓存, 同 TdxClient
+        """
+        self.connection_count = connections
+        self.cache = cache
+        self.heartbeat = heartbeat
+        self.time_out = time_out
+        self.connections = []
+        self.ip = None
+        self.port = None
+        self.heartbeat_task = None
+        self._round_robin = itertools.count()
+
+    async def __aenter__(self):
+        await self.connect()
+        await self.login()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    @staticmethod
+    async def rank_hosts(hosts=tdx_hosts, timeout=1):
+        """
+        在一个事件循环里并发连接所有服务器, 按连接耗时从快到慢返回
+        """
+        async def get_latency(ip, port):
+            start_time = time.time()
+            conn = await AsyncConnection.open(ip, port, timeout)
+            cost = time.time() - start_time
+            await conn.close()
+            return {
+                'ip': ip,
+                'port': port,
+                'time': cost,
+            }
+
+        results = await asyncio.gather(*[get_latency(host[1], host[2]) for host in hosts], return_exceptions=True)
+        infos = [info for info in results if isinstance(info, dict)]
+        infos.sort(key=lambda x: x['time'])
+        return infos
+
+    async def connect(self, ip=None, port=7709):
+        if ip is None:
+            # 选择延迟最低的服务器连接
+            infos = await self.rank_hosts(tdx_hosts, 1)
+            if len(infos) == 0:
+                raise Exception("no available server")
+            ip, port = infos[0]['ip'], infos[0]['port']
+
+        self.ip = ip
+        self.port = port
+        log.debug("connecting to server : %s on port :%d" % (ip, port))
+        self.connections = list(await asyncio.gather(*[
+            AsyncConnection.open(ip, port, self.time_out) for _ in range(self.connection_count)
+        ]))
+        log.debug("connected!")
+
+        if self.heartbeat:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        return self
+
+    async def disconnect(self):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*[conn.close() for conn in connections])
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(DEFAULT_HEARTBEAT_INTERVAL)
+            for conn in self.connections:
+                if not conn.dead and not conn.lock.locked() and time.time() - conn.last_ack_time > DEFAULT_HEARTBEAT_INTERVAL:
+                    try:
+                        await conn.send(server.HeartBeat().serialize())
+                    except Exception as e:
+                        log.debug(str(e))
+
+    async def _reopen_dead(self):
+        """
+        重新建立已经关闭的连接并登录
+        """
+        for i, conn in enumerate(self.connections):
+            if not conn.dead:
+                continue
+            new_conn = await AsyncConnection.open(self.ip, self.port, self.time_out)
+            await new_conn.send(server.Login().serialize())
+            # 等待期间别的协程可能已经换过这条连接
+            if i < len(self.connections) and self.connections[i] is conn:
+                self.connections[i] = new_conn
+            else:
+                await new_conn.close()
+
+    async def _connection(self) -> AsyncConnection:
+        if any(conn.dead for conn in self.connections):
+            await self._reopen_dead()
+        return self._pick_connection()
+
+    def _pick_connection(self) -> AsyncConnection:
+        if not self.connections:
+            raise Exception("not connected")
+        # 收发中途出错而关闭的连接不再借出
+        connections = [conn for conn in self.connections if not conn.dead]
+        if not connections:
+            raise Exception("no available connection")
+        for conn in connections:
+            if not conn.lock.locked():
+                return conn
+        return connections[next(self._round_robin) % len(connections)]
+
+    async def call(self, parser: BaseParser):
+        ttl = self.cache.ttl(parser) if self.cache is not None else 0
+        if ttl <= 0:
+            return parser.deserialize(await (await self._connection()).send(parser.serialize()))
+
+        key = self.cache.key(parser)
+        resp = self.cache.get(key)
+        if resp is None:
+            resp = await (await self._connection()).send(parser.serialize())
+            self.cache.put(key, resp, ttl)
+        return parser.deserialize(resp)
+
+    async def _fetch_pages(self, parsers: list[BaseParser]):
+        """
+        aiter_pages 的 fetch: 一个窗口内的分页并发请求
+        """
+        return await asyncio.gather(*[self.call(parser) for parser in parsers])
+
+    async def _collect_pages(self, pages, columnar):
+        return join_pages([part async for part in pages], columnar)
+
+    async def login(self, show_info=False):
+        try:
+            # 每条连接都需要登录
+            infos = await asyncio.gather(*[conn.send(server.Login().serialize()) for conn in self.connections])
+            if show_info:
+                print(server.Login().deserialize(infos[0]))
+            return True
+        except Exception as e:
+            log.error("login failed: %s", e)
+            return False
+
+    async def get_security_bars(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start, count, columnar=False, window=1):
+        return await self._collect_pages(self.iter_security_bars(market, code, kline_type, start, count, columnar, window), columnar)
+
+    def iter_security_bars(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start, count, columnar=False, window=1):
+        """
+        逐页产出 K 线的异步生成器, 从最新的一页开始
+        :param window: 同时请求的分页数, 连接数多时可以调大
+        """
+        return aiter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.Bars(market, code, kline_type, offset, size, columnar=columnar),
+            MAX_KLINE_COUNT, start, count, window)
+
+    async def get_security_quotes(self, all_stock, code=None):
+        """
+        参数形式同 TdxClient.get_security_quotes
+        """
+        if code is not None:
+            all_stock = [(all_stock, code)]
+        elif (isinstance(all_stock, list) or isinstance(all_stock, tuple))\
+                and len(all_stock) == 2 and type(all_stock[0]) is int:
+            all_stock = [all_stock]
+
+        return await self.call(stock.Quotes(all_stock))
+
+    async def get_security_quotes_by_category(self, category: CATEGORY, start: int = 0, count: int = 0x50):
+        return await self.call(stock.QuotesList(category, start, count))
+
+    async def get_security_count(self, market: MARKET):
+        return await self.call(stock.Count(market))
+
+    async def get_security_list(self, market: MARKET, start, count = 1600, columnar=False):
+        return await self.call(stock.List(market, start, count, columnar=columnar))
+
+    async def get_orders(self, market: MARKET, code: str, columnar=False):
+        return await self.call(stock.Orders(market, code, columnar=columnar))
+
+    async def get_history_orders(self, market: MARKET, code: str, date: date):
+        return await self.call(stock.HistoryOrders(market, code, date))
+
+    async def get_transaction(self, market: MARKET, code: str, columnar=False, as_arrays=False):
+        return await self._collect_pages(self.iter_transaction(market, code, columnar, as_arrays), columnar)
+
+    def iter_transaction(self, market: MARKET, code: str, columnar=False, as_arrays=False):
+        return aiter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.Transaction(market, code, offset, size, columnar=columnar, as_arrays=as_arrays),
+            MAX_TRANSACTION_COUNT)
+
+    async def get_history_transaction(self, market: MARKET, code: str, date: date, columnar=False, as_arrays=False):
+        return await self._collect_pages(self.iter_history_transaction(market, code, date, columnar, as_arrays), columnar)
+
+    def iter_history_transaction(self, market: MARKET, code: str, date: date, columnar=False, as_arrays=False):
+        return aiter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.HistoryTransaction(market, code, date, offset, size, columnar=columnar, as_arrays=as_arrays),
+            MAX_HISTORY_TRANSACTION_COUNT)
+
+    async def get_company_info(self, market: MARKET, code: str):
+        category = await self.call(company_info.Category(market, code))
+
+        # 各个栏目互不依赖, 并发获取
+        contents = await asyncio.gather(*[
+            self.call(company_info.Content(market, code, part['filename'], part['start'], part['length'])) for part in category
+        ])
+        info = [{
+            'name': part['name'],
+            'content': content['content'],
+        } for part, content in zip(category, contents)]
+
+        xdxr, finance = await asyncio.gather(self.call(company_info.XDXR(market, code)), self.call(company_info.Finance(market, code)))
+        if xdxr:
+            info.append({
+                'name': '除权分红',
+                'content': xdxr,
+            })
+        if finance:
+            info.append({
+                'name': '财报',
+                'content': finance,
+            })
+        return info
+
+    async def get_block_info(self, block_file_type: BLOCK_FILE_TYPE):
+        try:
+            meta = await self.call(block.Meta(block_file_type))
+        except Exception as e:
+            log.error(e)
+            return None
+
+        if not meta:
+            return None
+
+        size = meta['size']
+        one_chunk = 0x7530
+
+        pieces = await asyncio.gather(*[
+            self.call(block.Info(block_file_type, seg * one_chunk, one_chunk)) for seg in range(math.ceil(size / one_chunk))
+        ])
+        file_content = bytearray()
+        for piece in pieces:
+            file_content.extend(piece["data"])
+
+        return BlockReader().get_data(file_content, BlockReader_TYPE_FLAT)
+
+    async def get_report_file(self, filename: str, filesize=0, reporthook=None):
+        """
+        参数同 TdxClient.get_report_file
+        """
+        filecontent = bytearray()
+        current_downloaded_size = 0
+        get_zero_length_package_times = 0
+        while current_downloaded_size < filesize or filesize == 0:
+            response = await self.call(block.Report(filename, current_downloaded_size))
+            if response["size"] > 0:
+                current_downloaded_size = current_downloaded_size + response["size"]
+                filecontent.extend(response["data"])
+                if reporthook is not None:
+                    reporthook(current_downloaded_size, filesize)
+            else:
+                get_zero_length_package_times = get_zero_length_package_times + 1
+                if filesize == 0:
+                    break
+                elif get_zero_length_package_times > 2:
+                    break
+
+        return filecontent.decode("gbk")
@@ -12,6 +12,23 @@ import functools
 CONNECT_TIMEOUT = 5.000
 RECV_HEADER_LEN = 0x10
 RSP_HEADER_LEN = 0x10
+# prefix: b1 cb 74 00 固定响应头
+RSP_HEADER = struct.Struct('<IBIBHHH')
+# zipped: 0x1c 表示压缩，0xc 表示不压缩
+ZIPPED = 0x1c
+# 流水线模式下同时在途的请求数
+DEFAULT_PIPELINE_WINDOW = 8
+# 每个连接复用的接收缓冲区初始大小, 不够时按需扩大
+RECV_BUFFER_SIZE = 0x10000
+
+def unpack_rsp_header(head_buf):
+    """
+    解析 16 字节的响应头
+    :return: (zipped, customize, msg_id, zipsize, unzip_size)
+    """
+    prefix, zipped, customize, unknown, msg_id, zipsize, unzip_size = RSP_HEADER.unpack(head_buf)
+    # log.debug("recv Header: zipped: %s, customize: %s, control: %s, msg_id: %s, zipsize: %d, unzip_size: %d" % (hex(zipped), hex(customize), hex(unknown), hex(msg_id), zipsize, unzip_size))
+    return zipped, customize, msg_id, zipsize, unzip_size
 
 def update_last_ack_time(func):
     @functools.wraps(func)
@@ -91,6 +108,11 @@ class BaseStockClient():
         # 是否在函数调用出错的时候抛出异常
         self.raise_exception = raise_exception
 
+        # 复用的接收缓冲区: 压缩的响应体和解压后的响应体
+        self._head_buf = bytearray(RSP_HEADER_LEN)
+        self._recv_buf = bytearray(RECV_BUFFER_SIZE)
+        self._unzip_buf = bytearray(RECV_BUFFER_SIZE)
+
     def connect(self, ip='202.100.166.21', port=7709, time_out=CONNECT_TIMEOUT, bindport=None, bindip='0.0.0.0'):
         """
 
@@ -154,17 +176,27 @@ class BaseStockClient():
                     raise Exception("disconnect err")
             log.debug("disconnected")
 
-    def send(self, data):
+    def send(self, data, callback=None):
         """
         发送数据
         :param data:  要发送的数据
-        :return:  发送成功返回True，否则返回False
+        :param callback: 响应体的处理函数, 在锁内以 memoryview 调用并返回其结果;
+                         这个 memoryview 指向连接复用的接收缓冲区, 下一个请求时会被覆盖, 不能保留
+        :return:  不传 callback 时返回响应体的副本, 出错返回 None
         """
         if self.lock:
             with self.lock:
-                return self._send(data)
+                return self._send_and_handle(data, callback)
         else:
-            return self._send(data)
+            return self._send_and_handle(data, callback)
+
+    def _send_and_handle(self, data, callback):
+        body_buf = self._send(data)
+        if body_buf is None:
+            return None
+        if callback is None:
+            return bytes(body_buf)
+        return callback(body_buf)
 
     def _send(self, data):
         """
@@ -188,22 +220,110 @@ class BaseStockClient():
                 if self.raise_exception:
                     raise Exception("send data error")
             else:
-                head_buf = self.client.recv(RSP_HEADER_LEN)
-                
-                # prefix: b1 cb 74 00 固定响应头
-                prefix, zipped, customize, unknown, msg_id, zipsize, unzip_size = struct.unpack('<IBIBHHH', head_buf)
-                # log.debug("recv Header: zipped: %s, customize: %s, control: %s, msg_id: %s, zipsize: %d, unzip_size: %d" % (hex(zipped), hex(customize), hex(unknown), hex(msg_id), zipsize, unzip_size))
-
-                need_unzip_size = zipped == 0x1c
-                body_buf = bytearray()
-                while zipsize > 0:
-                    data_buf = self.client.recv(zipsize)
-                    body_buf.extend(data_buf)
-                    zipsize -= len(data_buf)
-                if need_unzip_size:
-                    body_buf = zlib.decompress(body_buf)
-
+                customize, body_buf = self._recv()
                 return body_buf
+        except Exception as e:
+            log.debug(str(e))
+            if self.raise_exception:
+                raise Exception("send error")
+
+    def _recv_exactly(self, view):
+        """
+        用 recv_into 把 view 填满
+        """
+        while len(view) > 0:
+            size = self.client.recv_into(view)
+            if size == 0:
+                raise Exception("connection closed")
+            view = view[size:]
+
+    def _buffer(self, name, size):
+        """
+        取出至少 size 字节的复用缓冲区; 不够时换一块更大的, 而不是原地扩容,
+        这样之前交出去的 memoryview 仍然有效
+        """
+        buf = getattr(self, name)
+        if len(buf) < size:
+            buf = bytearray(max(size, len(buf) * 2))
+            setattr(self, name, buf)
+        return buf
+
+    def _recv(self, reuse=True):
+        """
+        读取一个完整的响应
+        :param reuse: 是否把响应体放在复用的缓冲区里; 需要同时保留多个响应时传 False
+        :return: (customize, 解压后的响应体的 memoryview)
+        """
+        self._recv_exactly(memoryview(self._head_buf))
+        zipped, customize, msg_id, zipsize, unzip_size = unpack_rsp_header(self._head_buf)
+
+        if zipped != ZIPPED:
+            body_buf = self._buffer('_recv_buf', zipsize) if reuse else bytearray(zipsize)
+            body_view = memoryview(body_buf)[:zipsize]
+            self._recv_exactly(body_view)
+            return customize, body_view
+
+        # 压缩的响应边收边解压, 解压结果直接写入预先按 unzip_size 分配好的缓冲区
+        zip_view = memoryview(self._buffer('_recv_buf', zipsize))[:zipsize]
+        unzip_buf = self._buffer('_unzip_buf', unzip_size) if reuse else bytearray(unzip_size)
+        decompressor = zlib.decompressobj()
+        received = 0
+        unzipped = 0
+        while received < zipsize:
+            size = self.client.recv_into(zip_view[received:])
+            if size == 0:
+                raise Exception("connection closed")
+            piece = decompressor.decompress(zip_view[received: received + size])
+            if unzipped + len(piece) > unzip_size:
+                raise Exception("unzip size mismatch")
+            unzip_buf[unzipped: unzipped + len(piece)] = piece
+            unzipped += len(piece)
+            received += size
+        if not decompressor.eof or unzipped != unzip_size:
+            raise Exception("unzip size mismatch")
+
+        return customize, memoryview(unzip_buf)[:unzipped]
+
+    def send_many(self, datas, window=DEFAULT_PIPELINE_WINDOW):
+        """
+        流水线发送: 连续发出最多 window 个请求后再读取响应, 按请求头里的 customize 把响应对应回请求
+        :param datas: 要发送的数据, 每个请求的 customize 必须互不相同
+        :param window: 同时在途的请求数
+        :return: 与 datas 顺序一致的响应体列表, 出错时返回 None
+        """
+        if self.lock:
+            with self.lock:
+                return self._send_many(datas, window)
+        else:
+            return self._send_many(datas, window)
+
+    def _send_many(self, datas, window):
+        if not self.client:
+            log.debug("not connected")
+            if self.raise_exception:
+                raise Exception("not connected")
+
+        try:
+            results = [None] * len(datas)
+            pending = {}
+            next_index = 0
+            while next_index < len(datas) or pending:
+                while next_index < len(datas) and len(pending) < window:
+                    data = datas[next_index]
+                    (customize,) = struct.unpack('<I', data[1:5])
+                    if customize in pending:
+                        raise Exception("duplicate customize %d" % customize)
+                    pending[customize] = next_index
+                    self.client.sendall(data)
+                    next_index += 1
+
+                customize, body_buf = self._recv(reuse=False)
+                if customize not in pending:
+                    log.debug("unexpected response customize: %d" % customize)
+                    continue
+                results[pending.pop(customize)] = body_buf
+
+            return results
         except Exception as e:
             log.debug(str(e))
             if self.raise_exception:
@@ -0,0 +1,368 @@
+# coding=utf-8
+
+"""
+离线基准测试
+
+    python -m benchmarks.bench                       # 全部
+    python -m benchmarks.bench -k bars -k block      # 名字包含 bars 或 block 的用例
+    python -m benchmarks.bench --save before.json
+    python -m benchmarks.bench --compare before.json # 和上次保存的结果对比
+
+解析器用例把 fixtures 里的响应体直接交给 deserialize; 客户端用例连本地的 MockServer, 测的是
+收发、解压和分页的整个过程; net 用例给 MockServer 加上延迟和断线, 比较串行、流水线、连接池和重试. 每个用例报告 ops/s, 以及用 tracemalloc 测出的一次调用的内存峰值和
+调用返回后仍被结果占用的内存块数.
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import numpy as np
+
+from benchmarks import fixtures
+from benchmarks.mock_server import MockServer
+from const import ADJUST, BLOCK_FILE_TYPE, CATEGORY, KLINE_TYPE, MARKET
+from parser import block, company_info, server, stock
+from utils.adjust import AdjustEngine, adjust_bars
+from utils.bar_reader import DailyBarReader
+from utils.block_index import BlockIndex
+from utils.block_reader import BlockReader, BlockReader_TYPE_FLAT, BlockReader_TYPE_GROUP
+from utils.resample import resample, resample_many
+
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_REPEAT = 3
+
+
+class Case():
+
+    def __init__(self, name: str, func, setup=None, teardown=None):
+        """
+        :param func: 被测的调用, 无参数
+        :param setup: 测量前调用, 例如启动服务器、建立连接, 需要自己保证重复调用无副作用
+        :param teardown: 全部用例结束后调用一次, 多个用例可以共用
+        """
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+
+
+def parser_case(name: str, parser, payload: bytes):
+    return Case('parser.' + name, lambda: parser.deserialize(payload))
+
+
+def parser_cases():
+    codes = fixtures.gen_codes(1600)
+    day_bars = fixtures.encode_bars(fixtures.gen_bars(800))
+    minute_bars = fixtures.encode_bars(fixtures.gen_bars(800, minute=True))
+    transactions = fixtures.encode_transactions(1800)
+    history_transactions = fixtures.encode_transactions(2000, history=True)
+    quotes = fixtures.encode_quotes(80)
+    list_payload = fixtures.encode_list(codes)
+    block_content = fixtures.block_file(10)
+    report = fixtures.report_file(0x7530)
+
+    # ChartSampling 和 TODO547 的 deserialize 里有调试输出, 不测
+    return [
+        parser_case('login', server.Login(), fixtures.RECORDED[0xd]),
+        parser_case('server_info', server.Info(), fixtures.RECORDED[0x15]),
+        parser_case('heartbeat', server.HeartBeat(), bytes(6) + b'\xa2\xff\x34\x01'),
+        parser_case('exchange_announcement', server.ExchangeAnnouncement(), fixtures.RECORDED[0x2]),
+        parser_case('bars_day', stock.Bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 800), day_bars),
+        parser_case('bars_day_columnar', stock.Bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 800, columnar=True), day_bars),
+        parser_case('bars_day_arrays', stock.Bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 800, as_arrays=True), day_bars),
+        parser_case('bars_5min', stock.Bars(MARKET.SH, '600000', KLINE_TYPE.FIVE_MIN, 0, 800), minute_bars),
+        parser_case('count', stock.Count(MARKET.SH), fixtures.RECORDED[0x44e]),
+        parser_case('list', stock.List(MARKET.SH), list_payload),
+        parser_case('list_columnar', stock.List(MARKET.SH, columnar=True), list_payload),
+        parser_case('list_b', stock.ListB(MARKET.SH, 0), fixtures.encode_list(codes[:1000], stock.ListB.RECORD)),
+        parser_case('orders', stock.Orders(MARKET.SH, '600000'), fixtures.encode_orders(200)),
+        parser_case('orders_columnar', stock.Orders(MARKET.SH, '600000', columnar=True), fixtures.encode_orders(200)),
+        parser_case('history_orders', stock.HistoryOrders(MARKET.SH, '600000', date(2024, 1, 2)), fixtures.encode_orders(200, history=True)),
+        parser_case('transaction', stock.Transaction(MARKET.SH, '600000', 0, 1800), transactions),
+        parser_case('transaction_columnar', stock.Transaction(MARKET.SH, '600000', 0, 1800, columnar=True), transactions),
+        parser_case('transaction_arrays', stock.Transaction(MARKET.SH, '600000', 0, 1800, as_arrays=True), transactions),
+        parser_case('history_transaction', stock.HistoryTransaction(MARKET.SH, '600000', date(2024, 1, 2), 0, 2000), history_transactions),
+        parser_case('history_transaction_columnar',
+                    stock.HistoryTransaction(MARKET.SH, '600000', date(2024, 1, 2), 0, 2000, columnar=True), history_transactions),
+        parser_case('history_transaction_arrays',
+                    stock.HistoryTransaction(MARKET.SH, '600000', date(2024, 1, 2), 0, 2000, as_arrays=True), history_transactions),
+        parser_case('quotes_detail', stock.QuotesDetail([(MARKET.SH, '600000')]), fixtures.encode_quotes_detail(80)),
+        parser_case('quotes_list', stock.QuotesList(CATEGORY.SH), quotes),
+        parser_case('quotes_list_columnar', stock.QuotesList(CATEGORY.SH, columnar=True), quotes),
+        parser_case('quotes_recorded', stock.Quotes([(MARKET.SZ, '000001')]), fixtures.RECORDED[0x54c]),
+        parser_case('unusual', stock.Unusual(MARKET.SH, 0), fixtures.encode_unusual(600)),
+        parser_case('company_category', company_info.Category(MARKET.SH, '600000'), fixtures.encode_category(16)),
+        parser_case('company_content', company_info.Content(MARKET.SH, '600000', '600000.txt', 0, 30000),
+                    fixtures.encode_content('公司概况' * 7500)),
+        parser_case('finance', company_info.Finance(MARKET.SH, '600000'), fixtures.encode_finance()),
+        parser_case('xdxr', company_info.XDXR(MARKET.SH, '600000'), fixtures.encode_xdxr(60)),
+        parser_case('block_meta', block.Meta(BLOCK_FILE_TYPE.GN), fixtures.encode_meta(block_content)),
+        parser_case('block_report', block.Report('tdxfin/gpcw.txt'), fixtures.encode_report(report)),
+    ]
+
+
+def block_cases():
+    content = fixtures.block_file(600)
+    # 沪深 A 股大约 5500 只, 各个板块文件的成分股都在其中
+    contents = {kind: fixtures.block_file(150, seed=i, universe=5500) for i, kind in enumerate(
+        (BLOCK_FILE_TYPE.DEFAULT, BLOCK_FILE_TYPE.ZS, BLOCK_FILE_TYPE.FG, BLOCK_FILE_TYPE.GN))}
+    index = BlockIndex.from_contents(contents)
+    names = list(index.blocks)[:3]
+    code = next(iter(index.blocks[names[0]]))
+    return [
+        Case('block.reader_flat', lambda: BlockReader().get_data(content, BlockReader_TYPE_FLAT)),
+        Case('block.reader_group', lambda: BlockReader().get_data(content, BlockReader_TYPE_GROUP)),
+        Case('block.reader_columnar', lambda: BlockReader().get_columnar(content)),
+        Case('block.index_build', lambda: BlockIndex.from_contents(contents)),
+        Case('block.index_blocks_of', lambda: index.blocks_of(code)),
+        Case('block.index_intersection', lambda: index.intersection(*names)),
+    ]
+
+
+def adjust_cases():
+    bars = stock.Bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, as_arrays=True).deserialize(
+        fixtures.encode_bars(fixtures.gen_bars(8000)))
+    xdxrs = company_info.XDXR(MARKET.SH, '600000').deserialize(fixtures.encode_xdxr(60))
+    factors = AdjustEngine().update(MARKET.SH, '600000', xdxrs, bars)
+    return [
+        Case('adjust.factors', lambda: AdjustEngine().update(MARKET.SH, '600000', xdxrs, bars)),
+        Case('adjust.qfq', lambda: adjust_bars(bars, factors, ADJUST.QFQ)),
+        Case('adjust.hfq', lambda: adjust_bars(bars, factors, ADJUST.HFQ)),
+    ]
+
+
+def resample_cases():
+    minute_bars = stock.Bars(MARKET.SH, '600000', KLINE_TYPE.ONE_MIN, 0, 800, as_arrays=True).deserialize(
+        fixtures.encode_bars(fixtures.gen_bars(800, minute=True)))
+    day_bars = stock.Bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, as_arrays=True).deserialize(
+        fixtures.encode_bars(fixtures.gen_bars(8000)))
+    targets = [KLINE_TYPE.FIVE_MIN, KLINE_TYPE.FIFTEEN_MIN, KLINE_TYPE.THIRTY_MIN, KLINE_TYPE.ONE_HOUR,
+               KLINE_TYPE.DAY_K, KLINE_TYPE.WEEKLY, KLINE_TYPE.MONTHLY]
+    return [
+        Case('resample.minute_to_hour', lambda: resample(minute_bars, KLINE_TYPE.ONE_MIN, KLINE_TYPE.ONE_HOUR)),
+        Case('resample.minute_to_all', lambda: resample_many(minute_bars, KLINE_TYPE.ONE_MIN, targets)),
+        Case('resample.day_to_week', lambda: resample(day_bars, KLINE_TYPE.DAY_K, KLINE_TYPE.WEEKLY)),
+    ]
+
+
+def reader_cases(files=3000, days=100):
+    """
+    本地 vipdoc 文件; 目录里的文件数比常见的文件描述符上限(1024)多, read_dir 不能同时打开全部文件
+    """
+    state = {}
+
+    def setup():
+        if 'root' in state:
+            return
+        root = state['root'] = tempfile.mkdtemp(prefix='pytdx2_vipdoc_')
+        directory = os.path.join(root, 'sh', DailyBarReader.SUBDIR)
+        os.makedirs(directory)
+        bars = np.zeros(days, dtype=DailyBarReader.DTYPE)
+        bars['date'] = 20240102 + np.arange(days)
+        for code in fixtures.gen_codes(files):
+            bars.tofile(os.path.join(directory, 'sh' + code + DailyBarReader.EXT))
+
+    def teardown():
+        if 'root' in state:
+            shutil.rmtree(state.pop('root'), ignore_errors=True)
+
+    return [
+        Case('reader.read_dir_%d' % files, lambda: DailyBarReader(state['root']).read_dir(), setup=setup, teardown=teardown),
+    ]
+
+
+def client_cases():
+    """
+    连本地 MockServer 的用例, 共用一个服务器和一个连接
+    """
+    from tdxClient import TdxClient
+
+    state = {}
+
+    def setup():
+        if 'client' in state:
+            return
+        state['server'] = MockServer().start()
+        client = TdxClient()
+        client.connect(*state['server'].address)
+        client.login()
+        state['client'] = client
+
+    def teardown():
+        if 'client' not in state:
+            return
+        state.pop('client').disconnect()
+        state.pop('server').stop()
+
+    def case(name, func):
+        return Case('client.' + name, lambda: func(state['client']), setup=setup, teardown=teardown)
+
+    return [
+        case('heartbeat', lambda client: client.call(server.HeartBeat())),
+        case('bars_8000_serial', lambda client: client.get_security_bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, columnar=True, window=1)),
+        case('bars_8000_pipelined', lambda client: client.get_security_bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000)),
+        case('bars_8000_columnar', lambda client: client.get_security_bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, columnar=True)),
+        case('transaction_paged', lambda client: client.get_transaction(MARKET.SH, '600000')),
+        case('transaction_paged_columnar', lambda client: client.get_transaction(MARKET.SH, '600000', columnar=True)),
+        case('transaction_paged_arrays', lambda client: client.get_transaction(MARKET.SH, '600000', as_arrays=True)),
+    ]
+
+
+def network_cases(latency=0.01):
+    """
+    MockServer 模拟网络延迟和故障: 比较串行、流水线和连接池, 以及断线重试的开销; 都用列式结果, 让耗时以网络为主
+    """
+    from tdxClient import TdxClient
+    from tdxClientPool import TdxClientPool
+
+    stocks = [(MARKET.SH, code) for code in fixtures.gen_codes(16)]
+    state = {}
+
+    def setup():
+        if 'client' in state:
+            return
+        state['server'] = MockServer(latency=latency).start()
+        state['faulty_server'] = MockServer(latency=latency, disconnect_rate=0.02, seed=1).start()
+        hosts = [('mock', *state['server'].address)]
+        state['client'] = TdxClient()
+        state['client'].connect(*state['server'].address)
+        state['client'].login()
+        state['pool'] = TdxClientPool(4, hosts=hosts, health_check_interval=0).open()
+        state['faulty_pool'] = TdxClientPool(4, hosts=[('faulty', *state['faulty_server'].address)], retries=3,
+                                             health_check_interval=0).open()
+
+    def teardown():
+        if 'client' not in state:
+            return
+        state.pop('client').disconnect()
+        state.pop('pool').close()
+        state.pop('faulty_pool').close()
+        state.pop('server').stop()
+        state.pop('faulty_server').stop()
+
+    def case(name, func):
+        return Case('net.' + name, lambda: func(state), setup=setup, teardown=teardown)
+
+    def serial_stocks(state):
+        return [state['client'].get_security_bars(market, code, KLINE_TYPE.DAY_K, 0, 800, columnar=True) for market, code in stocks]
+
+    return [
+        case('bars_8000_serial', lambda state: state['client'].get_security_bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, columnar=True, window=1)),
+        case('bars_8000_pipelined', lambda state: state['client'].get_security_bars(MARKET.SH, '600000', KLINE_TYPE.DAY_K, 0, 8000, columnar=True)),
+        case('bars_16_stocks_serial', serial_stocks),
+        case('bars_16_stocks_pool4', lambda state: state['pool'].get_security_bars(stocks, KLINE_TYPE.DAY_K, 0, 800, columnar=True)),
+        case('bars_16_stocks_pool4_faulty', lambda state: state['faulty_pool'].get_security_bars(stocks, KLINE_TYPE.DAY_K, 0, 800, columnar=True)),
+    ]
+
+
+def all_cases():
+    return parser_cases() + block_cases() + adjust_cases() + resample_cases() + reader_cases() + client_cases() + network_cases()
+
+
+def measure_time(func, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT):
+    """
+    :return: 最好一轮的每秒调用次数
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 2
+    # 每轮大约 min_time 秒
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return 1 / best
+
+
+def measure_memory(func):
+    """
+    :return: (一次调用的内存峰值字节数, 结果占用的字节数, 结果占用的内存块数)
+    """
+    func()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        blocks = sys.getallocatedblocks()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        kept_blocks = sys.getallocatedblocks() - blocks
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak - base, current - base, kept_blocks
+
+
+def run(cases, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT, memory=True, out=sys.stdout):
+    results = {}
+    teardowns = []
+    out.write("%-40s %12s %12s %10s %10s %10s\n" % ('case', 'ops/s', 'us/op', 'peak KiB', 'kept KiB', 'blocks'))
+    try:
+        for case in cases:
+            if case.teardown is not None and case.teardown not in teardowns:
+                teardowns.append(case.teardown)
+            if case.setup is not None:
+                case.setup()
+            ops = measure_time(case.func, min_time, repeat)
+            peak, kept, blocks = measure_memory(case.func) if memory else (0, 0, 0)
+            results[case.name] = {'ops': ops, 'peak': peak, 'kept': kept, 'blocks': blocks}
+            out.write("%-40s %12.1f %12.1f %10.1f %10.1f %10d\n" % (case.name, ops, 1e6 / ops, peak / 1024, kept / 1024, blocks))
+            out.flush()
+    finally:
+        for teardown in teardowns:
+            teardown()
+    return results
+
+
+def compare(results, baseline, out=sys.stdout):
+    out.write("\n%-40s %12s %12s %8s\n" % ('case', 'before', 'after', 'change'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['ops']
+        out.write("%-40s %12.1f %12.1f %+7.1f%%\n" % (name, before, result['ops'], (result['ops'] / before - 1) * 100))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='pytdx2 offline benchmarks')
+    arg_parser.add_argument('-k', dest='keywords', action='append', default=[], help='只运行名字包含该关键字的用例')
+    arg_parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help='每轮测量的最少秒数')
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='测量轮数, 取最好的一轮')
+    arg_parser.add_argument('--no-memory', action='store_true', help='不测内存')
+    arg_parser.add_argument('--save', help='把结果保存为 json')
+    arg_parser.add_argument('--compare', help='和之前保存的 json 结果对比')
+    args = arg_parser.parse_args(argv)
+
+    cases = all_cases()
+    if args.keywords:
+        cases = [case for case in cases if any(keyword in case.name for keyword in args.keywords)]
+    results = run(cases, args.min_time, args.repeat, not args.no_memory)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# coding=utf-8
+
+"""
+基准测试用的响应体
+
+RECORDED 是从解析器注释里抓包的十六进制记录中提取的完整响应(解压后的响应体), 按 msg_id 索引;
+注释里被截断的记录会被跳过. 没有完整抓包的接口用下面的编码函数按协议格式生成, 数据是固定种子的随机数.
+"""
+
+import hashlib
+import os
+import random
+import re
+import struct
+import zlib
+
+from parser import company_info, stock
+
+PARSER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parser')
+# 注释里的响应记录: <b1cb7400 压缩标志 序号 控制位 msg_id 压缩后长度 解压后长度 |响应体
+RECORD_PATTERN = re.compile(r'#\s*<b1cb7400\s+(\w{2})\s+\w{8}\s+\w{2}\s+(\w{4})\s+(\w{4})\s+(\w{4})\s*\|?\s*([0-9a-f]*)')
+
+
+def _le16(hex_str):
+    return int.from_bytes(bytes.fromhex(hex_str), 'little')
+
+
+def load_recorded(parser_dir=PARSER_DIR):
+    """
+    :return: {msg_id: 解压后的响应体}
+    """
+    recorded = {}
+    for filename in sorted(os.listdir(parser_dir)):
+        if not filename.endswith('.py'):
+            continue
+        with open(os.path.join(parser_dir, filename), encoding='utf-8') as f:
+            for line in f:
+                match = RECORD_PATTERN.match(line)
+                if match is None:
+                    continue
+                zipped, msg_id, zip_size, unzip_size, body = match.groups()
+                body = bytes.fromhex(body)
+                if len(body) != _le16(zip_size):
+                    continue
+                if zipped == '1c':
+                    try:
+                        body = zlib.decompress(body)
+                    except zlib.error:
+                        continue
+                # 同一接口有多条记录时保留最长的一条
+                msg_id = _le16(msg_id)
+                if len(body) == _le16(unzip_size) and len(body) > len(recorded.get(msg_id, b'')):
+                    recorded[msg_id] = body
+    return recorded
+
+
+RECORDED = load_recorded()
+
+
+def put_price(value: int) -> bytes:
+    """
+    utils.help.get_price 的逆过程
+    """
+    sign = value < 0
+    value = abs(value)
+    first = (value & 0x3f) | (0x40 if sign else 0)
+    value >>= 6
+    out = bytearray([first | (0x80 if value else 0)])
+    while value:
+        byte = value & 0x7f
+        value >>= 7
+        out.append(byte | (0x80 if value else 0))
+    return bytes(out)
+
+
+def gen_bars(count: int, seed=1, minute=False):
+    """
+    :return: [(date, open, close, high, low, vol, amount), ...], 价格为整数(厘)
+    """
+    rnd = random.Random(seed)
+    rows = []
+    price = 10000
+    # 分钟线的日期从 2004 年起算
+    year, month, day = (2020 if minute else 2000), 1, 1
+    for i in range(count):
+        day += 1
+        if day > 28:
+            day, month = 1, month + 1
+        if month > 12:
+            month, year = 1, year + 1
+        if minute:
+            date = ((year - 2004) << 11 | (month * 100 + day)) | ((9 * 60 + 30 + i % 240) << 16)
+        else:
+            date = year * 10000 + month * 100 + day
+        open = price + rnd.randint(-300, 300)
+        close = open + rnd.randint(-500, 500)
+        high = max(open, close) + rnd.randint(0, 100)
+        low = min(open, close) - rnd.randint(0, 100)
+        rows.append((date, open, close, high, low, rnd.random() * 1e6, rnd.random() * 1e9))
+        price = close
+    return rows
+
+
+def encode_bars(rows) -> bytes:
+    out = bytearray(struct.pack('<H', len(rows)))
+    pre_close = 0
+    for (date, open, close, high, low, vol, amount) in rows:
+        out += struct.pack('<I', date)
+        out += put_price(open - pre_close) + put_price(close - open) + put_price(high - open) + put_price(low - open)
+        out += struct.pack('<ff', vol, amount)
+        pre_close = close
+    return bytes(out)
+
+
+def encode_transactions(count: int, history=False, seed=2) -> bytes:
+    rnd = random.Random(seed)
+    out = bytearray(struct.pack('<H', count))
+    if history:
+        out += bytes(4)
+    for i in range(count):
+        out += struct.pack('<H', 9 * 60 + 30 + i // 20)
+        out += put_price(rnd.randint(-20, 20) if i else 10000) + put_price(rnd.randint(1, 5000))
+        if not history:
+            out += put_price(rnd.randint(1, 50))
+        out += put_price(rnd.randint(0, 2)) + put_price(rnd.randint(0, 100))
+    return bytes(out)
+
+
+def encode_orders(count: int, history=False, seed=3) -> bytes:
+    rnd = random.Random(seed)
+    out = bytearray(struct.pack('<H', count))
+    if history:
+        out += bytes(4)
+    for i in range(count):
+        out += put_price(rnd.randint(1, 10) if i else 9000) + put_price(rnd.randint(0, 10)) + put_price(rnd.randint(1, 10000))
+    return bytes(out)
+
+
+def encode_quotes(count: int, start=0, seed=4, stocks=None) -> bytes:
+    """
+    stock.QuotesList/stock.Quotes 的响应体
+    :param stocks: [(market, code), ...], 为 None 时按序号生成代码
+    """
+    rnd = random.Random(seed + start)
+    if stocks is None:
+        stocks = [(i % 2, b'%06d' % i) for i in range(start, start + count)]
+    out = bytearray(struct.pack('<HH', 0, len(stocks)))
+    for market, code in stocks:
+        out += struct.pack('<B6sH', market, code, 7)
+        for value in [rnd.randint(1000, 90000)] + [rnd.randint(-500, 500) for _ in range(4)]:
+            out += put_price(value)
+        for value in (rnd.randint(9000000, 15000000), 0, rnd.randint(0, 10 ** 7), rnd.randint(0, 100)):
+            out += put_price(value)
+        out += struct.pack('<f', rnd.random() * 1e8)
+        for _ in range(4):
+            out += put_price(rnd.randint(0, 10 ** 6))
+        for _ in range(4):
+            out += put_price(rnd.randint(-100, 100))
+        out += struct.pack('<Hh8s10s', 1, -2, bytes(8), bytes(10)) + bytes(32) + struct.pack('<H', 7)
+    return bytes(out)
+
+
+def encode_quotes_detail(count: int, seed=6) -> bytes:
+    """
+    stock.QuotesDetail 的响应体, 带五档盘口
+    """
+    rnd = random.Random(seed)
+    out = bytearray(struct.pack('<HH', 0, count))
+    for i in range(count):
+        out += struct.pack('<B6sH', i % 2, b'%06d' % (600000 + i), 7)
+        for value in [rnd.randint(1000, 90000)] + [rnd.randint(-500, 500) for _ in range(4)]:
+            out += put_price(value)
+        for value in (rnd.randint(9000000, 15000000), 0, rnd.randint(0, 10 ** 7), rnd.randint(0, 100)):
+            out += put_price(value)
+        out += struct.pack('<f', rnd.random() * 1e8)
+        for _ in range(4):
+            out += put_price(rnd.randint(0, 10 ** 6))
+        for level in range(5):
+            out += put_price(-level - 1) + put_price(level + 1) + put_price(rnd.randint(1, 10 ** 4)) + put_price(rnd.randint(1, 10 ** 4))
+        out += struct.pack('<H4shH', 1, bytes(4), -2, 7)
+    return bytes(out)
+
+
+def gen_codes(count: int):
+    return ['%06d' % (600000 + i) for i in range(count)]
+
+
+def encode_list(codes, layout=stock.List.RECORD) -> bytes:
+    names = layout.names
+    records = []
+    for code in codes:
+        values = {
+            'code': code.encode(), 'vol': 100, 'name': ('股票' + code[-2:]).encode('gbk'),
+            'unknown1': b'\x05\x00\x00\x00', 'decimal_point': 2, 'pre_close': 10.5, 'unknown2': 0, 'unknown3': 0,
+        }
+        records.append(tuple(values.get(name, b'') for name in names))
+    return struct.pack('<H', len(records)) + layout.pack_records(records)
+
+
+def encode_category(count: int) -> bytes:
+    records = [(('分类%d' % i).encode('gbk'), b'600000.txt', i * 1000, 1000) for i in range(count)]
+    return struct.pack('<H', count) + company_info.Category.RECORD.pack_records(records)
+
+
+def encode_content(text: str, code=b'600000') -> bytes:
+    content = text.encode('gbk')
+    return struct.pack('<H6sHH', 1, code, 1, len(content)) + content
+
+
+def encode_finance(code=b'600000') -> bytes:
+    return struct.pack("<HB6sfHHII" + 'f' * 30, 1, 1, code, 1e9, 1, 2, 20240430, 19991110, *([1.5e9] * 30))
+
+
+def encode_xdxr(count: int, code=b'600000') -> bytes:
+    records = [(1, code, 0, 20000101 + (i % 20) * 10000 + 601, 1 + i % 6, 1.0, 2.0, 3.0, 4.0) for i in range(count)]
+    return company_info.XDXR.HEADER.pack(1, 1, code, count) + company_info.XDXR.RECORD.pack_records(records)
+
+
+def encode_unusual(count: int) -> bytes:
+    layout = stock.Unusual.RECORD
+    records = []
+    for i in range(count):
+        detail = struct.pack('<Bfff', 0, 0.05, 1.5, 2.0)
+        records.append((1, b'%06d' % (600000 + i), 0, (0x03, 0x04, 0x0a, 0x0b)[i % 4], 0, i, 0, detail, 0, 9, 3000 + i % 60))
+    return struct.pack('<H', count) + layout.pack_records(records)
+
+
+def encode_meta(content: bytes) -> bytes:
+    return struct.pack('<I1s32s1s', len(content), b'', hashlib.md5(content).hexdigest().encode(), b'')
+
+
+def encode_report(content: bytes, start=0, size=0x7530) -> bytes:
+    chunk = content[start: start + size]
+    return struct.pack('<I', len(chunk)) + chunk
+
+
+def block_file(block_count: int, seed=5, universe: int = None) -> bytearray:
+    """
+    板块文件: 384 字节文件头, 板块数, 每个板块 9 字节名字 + 个数 + 类型 + 400 个 7 字节代码位
+    :param universe: 代码从这么多只股票里抽取(各板块共用, 和真实的板块文件一样); None 表示在全部 6 位代码里随机
+    """
+    rnd = random.Random(seed)
+    pool = [b'%06d' % code for code in random.Random(universe).sample(range(1000000), universe)] if universe else None
+    out = bytearray(384) + struct.pack('<H', block_count)
+    for i in range(block_count):
+        count = rnd.randrange(10, 400)
+        if pool:
+            codes = rnd.sample(pool, count)
+        else:
+            codes = [b'%06d' % rnd.randrange(1000000) for _ in range(count)]
+        out += ('板块%d' % i).encode('gbk').ljust(9, b'\x00') + struct.pack('<HH', len(codes), 2)
+        out += b''.join(code.ljust(7, b'\x00') for code in codes).ljust(2800, b'\x00')
+    return out
+
+
+def report_file(size: int) -> bytes:
+    line = '600000|浦发银行|20240430|1.23|4.56\r\n'.encode('gbk')
+    return (line * (size // len(line) + 1))[:size]
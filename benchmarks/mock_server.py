@@ -0,0 +1,340 @@
+# coding=utf-8
+
+"""
+本地的 TDX 协议模拟服务器
+
+按 BaseStockClient 的帧格式应答: 请求头 <BIBHH + msg_id, 响应头 b1cb7400 + 压缩标志(0x1c/0x0c) + 序号 +
+msg_id + zipsize + unzip_size, 响应体超过 COMPRESS_THRESHOLD 时按 zlib 压缩.
+
+支持 Login、心跳、K 线、行情、证券列表、分笔、板块文件和研报文件. 所有证券共用同一组生成的 K 线和分笔,
+按请求里的 start/count 切片后编码, 编码结果按分页缓存; recorded 可以用抓包记录替换任意接口的响应.
+
+latency 和 bandwidth 模拟网络: 每个响应在收到请求 latency 秒之后才发出, 同一连接上流水线发来的请求
+各自计时, 不会串行累加; 发送速度限制在 bandwidth 字节/秒. 故障按比例随机注入(seed 固定时可复现),
+Login 不注入故障, 保证连接总能建立:
+
+    with MockServer(latency=0.005, disconnect_rate=0.01) as server:
+        client = TdxClient()
+        client.connect(*server.address).login()
+"""
+
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from benchmarks import fixtures
+from const import BLOCK_FILE_TYPE
+from utils.log import log
+
+REQ_HEADER = struct.Struct('<BIBHHH')
+RSP_HEADER = struct.Struct('<IBIBHHH')
+RSP_PREFIX = 0x0074cbb1
+ZIPPED = 0x1c
+UNZIPPED = 0x0c
+COMPRESS_THRESHOLD = 0x100
+# 限速时每次发送的字节数
+SEND_CHUNK_SIZE = 0x4000
+
+# 故障类型
+FAULT_DISCONNECT = 'disconnect'
+FAULT_STALL = 'stall'
+FAULT_CORRUPT = 'corrupt'
+
+
+def _recv_exactly(conn, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _c_string(data: bytes) -> str:
+    return data.split(b'\x00', 1)[0].decode('utf-8', 'ignore')
+
+
+class MockServer():
+
+    def __init__(self, host='127.0.0.1', port=0, bar_count=8000, bar_counts: dict = None, transaction_count=4800,
+                 security_count=5000, files: dict = None, recorded: dict = None,
+                 latency=0.0, jitter=0.0, bandwidth=None,
+                 disconnect_rate=0.0, stall_rate=0.0, corrupt_rate=0.0, seed=None):
+        """
+        :param port: 0 表示由系统分配
+        :param bar_count: 每个证券的 K 线条数
+        :param bar_counts: {code: K 线条数}, 覆盖 bar_count
+        :param transaction_count: 每个证券每天的分笔条数
+        :param security_count: 每个市场的证券数, 决定 Count/List/QuotesList 的结果
+        :param files: {文件名: 内容}, 板块文件和研报文件; 默认生成四个板块文件
+        :param recorded: {msg_id: 响应体}, 这些接口总是返回给定的响应体
+        :param latency: 每个响应的延迟(秒)
+        :param jitter: 延迟的随机波动(秒)
+        :param bandwidth: 每条连接的发送速度(字节/秒), None 表示不限
+        :param disconnect_rate: 收到请求后直接断开连接的比例
+        :param stall_rate: 收到请求后不应答的比例, 客户端只能等到超时
+        :param corrupt_rate: 应答损坏的压缩数据的比例
+        """
+        self.host = host
+        self.port = port
+        self.bars = fixtures.gen_bars(bar_count)
+        self.bar_count = bar_count
+        self.bar_counts = bar_counts or {}
+        self.transaction_count = transaction_count
+        self.security_count = security_count
+        self.recorded = recorded or {}
+        if files is None:
+            files = {kind.value: bytes(fixtures.block_file(150, seed=i)) for i, kind in enumerate(
+                (BLOCK_FILE_TYPE.DEFAULT, BLOCK_FILE_TYPE.ZS, BLOCK_FILE_TYPE.FG, BLOCK_FILE_TYPE.GN))}
+        self.files = files
+
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.faults = [(FAULT_DISCONNECT, disconnect_rate), (FAULT_STALL, stall_rate), (FAULT_CORRUPT, corrupt_rate)]
+        self.random = random.Random(seed)
+
+        self.pages = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.fault_counts = {name: 0 for name, _ in self.faults}
+
+        self.handlers = {
+            0x4: self.on_heartbeat,
+            0xd: self.on_login,
+            0x52d: self.on_bars,
+            0x54b: self.on_quotes_list,
+            0x54c: self.on_quotes,
+            0x44e: self.on_count,
+            0x44d: self.on_list,
+            0xfc5: self.on_transaction,
+            0xfb5: self.on_history_transaction,
+            0x2c5: self.on_file_meta,
+            0x6b9: self.on_file_chunk,
+        }
+
+        self.sock = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.connections = set()
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        self.closed.clear()
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.closed.set()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        with self.lock:
+            connections, self.connections = self.connections, set()
+        for conn in connections:
+            self._close(conn)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'bytes_sent': self.bytes_sent,
+                'connections': len(self.connections),
+                **self.fault_counts,
+            }
+
+    def _close(self, conn):
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        conn.close()
+
+    def _accept(self):
+        while not self.closed.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.connections.add(conn)
+            outbox = queue.Queue()
+            threading.Thread(target=self._serve, args=(conn, outbox), daemon=True).start()
+            threading.Thread(target=self._write, args=(conn, outbox), daemon=True).start()
+
+    def _serve(self, conn, outbox):
+        """
+        读请求并生成响应, 响应连同应该发出的时间交给 _write, 所以流水线请求的延迟是重叠的
+        """
+        try:
+            while not self.closed.is_set():
+                head = _recv_exactly(conn, REQ_HEADER.size)
+                if head is None:
+                    break
+                _, customize, _, zip_size, _, msg_id = REQ_HEADER.unpack(head)
+                body = _recv_exactly(conn, zip_size - 2)
+                if body is None:
+                    break
+                received = time.time()
+
+                fault = self._pick_fault(msg_id)
+                if fault == FAULT_STALL:
+                    continue
+                if fault == FAULT_DISCONNECT:
+                    break
+                packet = self.respond(msg_id, customize, body, corrupt=fault == FAULT_CORRUPT)
+                delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+                outbox.put((received + max(delay, 0), packet))
+        except OSError as e:
+            log.debug("mock server connection closed: %s" % e)
+        finally:
+            outbox.put(None)
+
+    def _write(self, conn, outbox):
+        try:
+            while True:
+                item = outbox.get()
+                if item is None:
+                    break
+                due, packet = item
+                wait = due - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self._send(conn, packet)
+        except OSError as e:
+            log.debug("mock server connection closed: %s" % e)
+        finally:
+            with self.lock:
+                self.connections.discard(conn)
+            self._close(conn)
+
+    def _send(self, conn, packet):
+        if self.bandwidth is None:
+            conn.sendall(packet)
+        else:
+            for offset in range(0, len(packet), SEND_CHUNK_SIZE):
+                start = time.time()
+                chunk = packet[offset: offset + SEND_CHUNK_SIZE]
+                conn.sendall(chunk)
+                wait = len(chunk) / self.bandwidth - (time.time() - start)
+                if wait > 0:
+                    time.sleep(wait)
+        with self.lock:
+            self.bytes_sent += len(packet)
+
+    def _pick_fault(self, msg_id):
+        if msg_id == 0xd:
+            return None
+        with self.lock:
+            value = self.random.random()
+            for name, rate in self.faults:
+                if value < rate:
+                    self.fault_counts[name] += 1
+                    return name
+                value -= rate
+        return None
+
+    def respond(self, msg_id: int, customize: int, body: bytes, corrupt=False) -> bytes:
+        """
+        :return: 完整的响应包
+        """
+        with self.lock:
+            self.requests += 1
+        if msg_id in self.recorded:
+            payload = self.recorded[msg_id]
+        else:
+            handler = self.handlers.get(msg_id)
+            payload = handler(body) if handler is not None else b''
+
+        if corrupt:
+            # 声称是压缩数据, 实际是无法解压的随机字节
+            data = bytes(self.random.getrandbits(8) for _ in range(max(len(payload) // 2, 16)))
+            return RSP_HEADER.pack(RSP_PREFIX, ZIPPED, customize, 0, msg_id, len(data), len(payload)) + data
+        if len(payload) > COMPRESS_THRESHOLD:
+            data = zlib.compress(payload)
+            return RSP_HEADER.pack(RSP_PREFIX, ZIPPED, customize, 0, msg_id, len(data), len(payload)) + data
+        return RSP_HEADER.pack(RSP_PREFIX, UNZIPPED, customize, 0, msg_id, len(payload), len(payload)) + payload
+
+    def _page(self, key, encode):
+        with self.lock:
+            page = self.pages.get(key)
+        if page is None:
+            page = encode()
+            with self.lock:
+                self.pages[key] = page
+        return page
+
+    def on_heartbeat(self, body):
+        return bytes(6) + struct.pack('<I', 20250605)
+
+    def on_login(self, body):
+        return fixtures.RECORDED[0xd]
+
+    def on_bars(self, body):
+        (code, ) = struct.unpack_from('<6s', body, 2)
+        (start, count) = struct.unpack_from('<HH', body, 12)
+        total = min(self.bar_counts.get(code.decode(), self.bar_count), len(self.bars))
+        end = max(total - start, 0)
+        return self._page(('bars', total, start, count), lambda: fixtures.encode_bars(self.bars[max(end - count, 0): end]))
+
+    def on_quotes_list(self, body):
+        (start, count) = struct.unpack_from('<HH', body, 4)
+        size = max(min(count, self.security_count - start), 0)
+        return fixtures.encode_quotes(size, start, seed=int(time.time()))
+
+    def on_quotes(self, body):
+        (count, ) = struct.unpack_from('<H', body, 8)
+        stocks = [struct.unpack_from('<B6s', body, 10 + i * 7) for i in range(count)]
+        return fixtures.encode_quotes(count, stocks=stocks, seed=int(time.time()))
+
+    def on_count(self, body):
+        return struct.pack('<H', self.security_count)
+
+    def on_list(self, body):
+        (start, count) = struct.unpack_from('<II', body, 2)
+        size = max(min(count, self.security_count - start), 0)
+        return self._page(('list', start, size), lambda: fixtures.encode_list(fixtures.gen_codes(start + size)[start:]))
+
+    def _transactions(self, body, offset, history):
+        (start, count) = struct.unpack_from('<HH', body, offset)
+        size = max(min(count, self.transaction_count - start), 0)
+        return self._page(('transaction', history, start, count), lambda: fixtures.encode_transactions(size, history, seed=start))
+
+    def on_transaction(self, body):
+        return self._transactions(body, 8, False)
+
+    def on_history_transaction(self, body):
+        return self._transactions(body, 12, True)
+
+    def on_file_meta(self, body):
+        content = self.files.get(_c_string(body[:40]))
+        if content is None:
+            return struct.pack('<I1s32s1s', 0, b'', b'', b'')
+        return fixtures.encode_meta(content)
+
+    def on_file_chunk(self, body):
+        (start, size) = struct.unpack_from('<II', body)
+        content = self.files.get(_c_string(body[8:108]), b'')
+        return fixtures.encode_report(content, start, size)
@@ -0,0 +1,269 @@
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable
+
+import numpy as np
+
+from const import KLINE_TYPE, MARKET
+from parser import stock
+from tdxClientPool import TdxClientPool
+from utils.bar_store import BarStore
+from utils.fast_decode import BAR_DTYPE
+from utils.log import log
+
+# 单页 K 线数, 服务器的上限
+MAX_KLINE_COUNT = 800
+# 单页证券列表数
+MAX_LIST_COUNT = 1600
+DEFAULT_PROGRESS_INTERVAL = 10.0
+JOURNAL_FILE = 'journal.jsonl'
+
+
+class BulkBarDownloader():
+    """
+    全市场 K 线批量下载
+
+    先用 stock.List 枚举各个市场的全部证券, 再把每只证券按页(800 根)拆成任务, 分摊到连接池的各条连接上.
+    每下载完一页先落盘到暂存目录, 再在日志(journal)里记一笔; 一只证券的分页全部下完后合并写入 BarStore.
+    进程中途退出后重新运行会跳过日志里已完成的证券和分页, 从断点继续.
+
+        with TdxClientPool(8) as pool:
+            stats = BulkBarDownloader(pool, BarStore('data'), [KLINE_TYPE.DAY_K]).run()
+
+    本地已有数据的证券只往前翻到已存的最后一根为止, 所以每天重复运行就是增量更新.
+    """
+
+    def __init__(self, pool: TdxClientPool, store: BarStore, kline_types: list[KLINE_TYPE] = (KLINE_TYPE.DAY_K,),
+                 markets: list[MARKET] = tuple(MARKET), stocks: Iterable[tuple[MARKET, str]] = None, symbol_filter=None,
+                 max_count=8000, journal_dir=None, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+        """
+        :param stocks: [(market, code), ...], 指定证券, 为 None 时枚举 markets 下的全部证券
+        :param symbol_filter: symbol_filter(market, code) 返回 False 的证券不下载
+        :param max_count: 本地没有数据时每只证券最多下载的数量
+        :param journal_dir: 日志和分页暂存目录, 默认在 store 目录下
+        :param progress_interval: 输出进度的间隔(秒)
+        """
+        self.pool = pool
+        self.store = store
+        self.kline_types = list(kline_types)
+        self.markets = list(markets)
+        self.stocks = None if stocks is None else list(stocks)
+        self.symbol_filter = symbol_filter
+        self.max_count = max_count
+        self.max_pages = max(math.ceil(max_count / MAX_KLINE_COUNT), 1)
+        self.journal_dir = journal_dir or os.path.join(store.root, '.journal')
+        self.progress_interval = progress_interval
+
+        self.failed = []
+        self.symbols_done = 0
+        self.symbols_total = 0
+        self.pages_done = 0
+        self.bars_done = 0
+        self.start_time = None
+
+    def list_symbols(self):
+        """
+        枚举 markets 下的全部证券
+        :return: [(market, code), ...]
+        """
+        symbols = []
+        for market in self.markets:
+            total = self.pool.call(stock.Count(market))['count']
+            starts = range(0, total, MAX_LIST_COUNT)
+            for part in self.pool.map(lambda start, market=market: stock.List(market, start, MAX_LIST_COUNT), starts):
+                symbols.extend((market, item['code']) for item in part)
+        if self.symbol_filter is not None:
+            symbols = [(market, code) for market, code in symbols if self.symbol_filter(market, code)]
+        return symbols
+
+    def _part_path(self, market: MARKET, code: str, kline_type: KLINE_TYPE, page: int):
+        return os.path.join(self.journal_dir, 'parts', kline_type.name, market.name, '%s.%d' % (code, page))
+
+    def _journal_path(self):
+        return os.path.join(self.journal_dir, JOURNAL_FILE)
+
+    def _load_journal(self):
+        """
+        :return: (已完成的证券集合, {未完成的证券: {已完成的分页: 是否整页}})
+        """
+        done = set()
+        pages = {}
+        if not os.path.exists(self._journal_path()):
+            return done, pages
+        with open(self._journal_path(), 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 最后一行可能在写入时被中断
+                    continue
+                key = (MARKET[entry['market']], entry['code'], KLINE_TYPE[entry['kline_type']])
+                if entry.get('done'):
+                    done.add(key)
+                    pages.pop(key, None)
+                else:
+                    pages.setdefault(key, {})[entry['page']] = entry['count'] == MAX_KLINE_COUNT
+        return done, pages
+
+    def _write_journal(self, market: MARKET, code: str, kline_type: KLINE_TYPE, **entry):
+        entry.update(market=market.name, code=code, kline_type=kline_type.name)
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+
+    def clear(self):
+        """
+        清空日志和暂存的分页, 下次运行从头开始
+        """
+        if os.path.exists(self._journal_path()):
+            os.remove(self._journal_path())
+        parts_dir = os.path.join(self.journal_dir, 'parts')
+        for root, _, files in os.walk(parts_dir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            os.rmdir(root)
+
+    def _save_page(self, key, page: int, bars: np.ndarray):
+        market, code, kline_type = key
+        path = self._part_path(market, code, kline_type, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        bars.tofile(path)
+        self._write_journal(market, code, kline_type, page=page, count=len(bars))
+
+    def _finish(self, key, pages: int):
+        """
+        合并一只证券暂存的分页, 写入 store
+        """
+        market, code, kline_type = key
+        paths = [self._part_path(market, code, kline_type, page) for page in range(pages)]
+        # 分页越往后越早, 倒序拼接
+        parts = [np.fromfile(path, dtype=BAR_DTYPE) for path in reversed(paths) if os.path.exists(path)]
+        bars = np.concatenate(parts) if parts else np.empty(0, dtype=BAR_DTYPE)
+        if len(bars) > 0:
+            # 续传时两次运行之间可能出了新 K 线, 分页整体后移, 相邻分页会有重叠; 重复的以较新的分页为准
+            reverse = bars[::-1]
+            _, index = np.unique(reverse['datetime'], return_index=True)
+            bars = reverse[index]
+        self.store.append(market, code, kline_type, bars)
+
+        self._write_journal(market, code, kline_type, done=True)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.symbols_done += 1
+
+    def _page_size(self, page: int):
+        return min(MAX_KLINE_COUNT, self.max_count - page * MAX_KLINE_COUNT)
+
+    def _fetch_page(self, key, page: int):
+        market, code, kline_type = key
+        return self.pool.call(stock.Bars(market, code, kline_type, page * MAX_KLINE_COUNT, self._page_size(page), as_arrays=True))
+
+    def run(self, resume=True):
+        """
+        :param resume: 为 False 时丢弃上次未完成的进度
+        :return: stats()
+        """
+        if not resume:
+            self.clear()
+        os.makedirs(self.journal_dir, exist_ok=True)
+
+        done, pages = self._load_journal()
+        symbols = self.stocks if self.stocks is not None else self.list_symbols()
+        todo = deque((market, code, kline_type) for kline_type in self.kline_types for market, code in symbols
+                     if (market, code, kline_type) not in done)
+
+        self.failed = []
+        self.symbols_done = 0
+        self.symbols_total = len(todo)
+        self.pages_done = 0
+        self.bars_done = 0
+        self.start_time = time.time()
+        last_report = self.start_time
+
+        # 每只证券同一时刻只有一页在途, 不同证券的分页分摊到各条连接上
+        inflight = {}
+        last_datetimes = {}
+        with open(self._journal_path(), 'a') as self.journal, ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            def submit(key, page):
+                inflight[executor.submit(self._fetch_page, key, page)] = (key, page)
+
+            def next_page(key):
+                """
+                续传时跳过已下完的分页, 返回下一个要下载的分页, 已经下完时返回 None
+                """
+                finished = pages.get(key, {})
+                page = 0
+                while page in finished:
+                    if not finished[page]:
+                        return None
+                    page += 1
+                return page if page < self.max_pages else None
+
+            while todo or inflight:
+                while todo and len(inflight) < self.pool.size * 2:
+                    key = todo.popleft()
+                    last_datetimes[key] = self.store.last_datetime(*key)
+                    page = next_page(key)
+                    if page is None:
+                        self._finish(key, len(pages.get(key, {})))
+                    else:
+                        submit(key, page)
+
+                if not inflight:
+                    continue
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, page = inflight.pop(future)
+                    try:
+                        bars = future.result()
+                    except Exception as e:
+                        log.error("download %s %s %s page %d failed: %s" % (key[0].name, key[1], key[2].name, page, e))
+                        self.failed.append(key)
+                        continue
+                    if bars is None:
+                        bars = np.empty(0, dtype=BAR_DTYPE)
+
+                    self._save_page(key, page, bars)
+                    self.pages_done += 1
+                    self.bars_done += len(bars)
+
+                    last = last_datetimes[key]
+                    reach_stored = last is not None and len(bars) > 0 and bars['datetime'][0] <= last
+                    if len(bars) == self._page_size(page) and not reach_stored and page + 1 < self.max_pages:
+                        submit(key, page + 1)
+                    else:
+                        self._finish(key, page + 1)
+
+                if time.time() - last_report >= self.progress_interval:
+                    last_report = time.time()
+                    self.report()
+
+        stats = self.stats()
+        self.report()
+        if not self.failed:
+            # 全部完成后清掉日志, 下次运行是一次新的增量更新
+            self.clear()
+        return stats
+
+    def stats(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return {
+            'symbols': self.symbols_done,
+            'symbols_total': self.symbols_total,
+            'pages': self.pages_done,
+            'bars': self.bars_done,
+            'failed': len(self.failed),
+            'elapsed': elapsed,
+            'symbols_per_sec': self.symbols_done / elapsed if elapsed > 0 else 0,
+            'bars_per_sec': self.bars_done / elapsed if elapsed > 0 else 0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        log.info("bulk download %d/%d symbols, %d bars, %d failed, %.1f symbols/s, %.0f bars/s" % (
+            stats['symbols'], stats['symbols_total'], stats['bars'], stats['failed'],
+            stats['symbols_per_sec'], stats['bars_per_sec']))
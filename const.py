@@ -190,6 +190,10 @@ class KLINE_TYPE(Enum):
     THREE_MONTH = 10
     YEARLY = 11
 
+class ADJUST(Enum):
+    QFQ = 'qfq'     # 前复权, 以最新价格为基准
+    HFQ = 'hfq'     # 后复权, 以最早的价格为基准
+
 class BLOCK_FILE_TYPE(Enum):
     DEFAULT = 'block.dat'   # 一般板块
     ZS = 'block_zs.dat'     # 指数板块
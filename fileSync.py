@@ -0,0 +1,120 @@
+import os
+import threading
+
+from const import BLOCK_FILE_TYPE
+from parser import block
+from tdxClient import TdxClient
+from tdxClientPool import TdxClientPool
+from utils.block_reader import BlockReader, BlockReader_TYPE_FLAT
+from utils.file_download import download_chunks, download_stream
+from utils.log import log
+
+HASH_EXT = '.hash'
+
+
+class FileSync():
+    """
+    在本地保存服务器上的板块文件和研报文件, 只在服务器上的文件变化时才重新下载
+
+    板块文件的 block.Meta 带有 32 字节的 hash, 与本地记录的相同时直接读本地文件; 不同时把各个分块
+    分摊到连接池的各条连接上并发下载(只有一条连接时走流水线), 写入本地后再记下新的 hash.
+
+        sync = FileSync('blocks', pool)
+        blocks = sync.get_block_info(BLOCK_FILE_TYPE.GN)
+    """
+
+    def __init__(self, root, client: TdxClientPool | TdxClient):
+        """
+        :param root: 本地目录
+        :param client: TdxClientPool 或者已连接的 TdxClient
+        """
+        self.root = root
+        self.client = client
+        self.lock = threading.Lock()
+        self.downloads = 0
+        self.skips = 0
+
+    def _fetch(self, parsers):
+        if isinstance(self.client, TdxClientPool):
+            return self.client.map(lambda parser: parser, parsers)
+        return self.client.call_many(parsers)
+
+    def path(self, filename: str):
+        return os.path.join(self.root, filename)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return bytearray(f.read())
+
+    def _write(self, path, content, hash_value: bytes = None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换, 中途退出不会留下半个文件; hash 最后写, 没写上的话下次会重新下载
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        if hash_value is not None:
+            with open(path + HASH_EXT, 'wb') as f:
+                f.write(hash_value)
+
+    def local_hash(self, filename: str):
+        path = self.path(filename)
+        if not os.path.exists(path) or not os.path.exists(path + HASH_EXT):
+            return None
+        with open(path + HASH_EXT, 'rb') as f:
+            return f.read()
+
+    def sync_block_file(self, block_file_type: BLOCK_FILE_TYPE) -> bytearray:
+        """
+        :return: 最新的文件内容, 服务器上没有这个文件时返回 None
+        """
+        filename = block_file_type.value
+        meta = self.client.call(block.Meta(block_file_type))
+        if not meta:
+            return None
+
+        path = self.path(filename)
+        with self.lock:
+            if self.local_hash(filename) == meta['hash_value'] and os.path.getsize(path) == meta['size']:
+                self.skips += 1
+                return self._read(path)
+
+        log.debug("downloading %s, %d bytes" % (filename, meta['size']))
+        content = download_chunks(self._fetch, lambda start, size: block.Info(block_file_type, start, size), meta['size'])
+        with self.lock:
+            self._write(path, content, meta['hash_value'])
+            self.downloads += 1
+        return content
+
+    def sync_all(self):
+        """
+        同步全部板块文件
+        :return: {BLOCK_FILE_TYPE: 文件内容}
+        """
+        return {block_file_type: self.sync_block_file(block_file_type) for block_file_type in BLOCK_FILE_TYPE}
+
+    def get_block_info(self, block_file_type: BLOCK_FILE_TYPE):
+        content = self.sync_block_file(block_file_type)
+        if content is None:
+            return None
+        return BlockReader().get_data(content, BlockReader_TYPE_FLAT)
+
+    def get_report_file(self, filename: str, filesize=0, reporthook=None, refresh=False):
+        """
+        研报文件没有 hash, 已经下载过的文件直接读本地, refresh=True 时重新下载
+        :param filesize: 文件大小, 已知时各分块并发下载
+        """
+        path = self.path(filename)
+        if not refresh and os.path.exists(path) and (filesize == 0 or os.path.getsize(path) == filesize):
+            self.skips += 1
+            return self._read(path).decode('gbk')
+
+        make_parser = lambda start, size: block.Report(filename, start, size)
+        if filesize > 0:
+            content = download_chunks(self._fetch, make_parser, filesize, reporthook=reporthook)
+        else:
+            content = download_stream(self.client.call, make_parser, reporthook=reporthook)
+        with self.lock:
+            self._write(path, content)
+            self.downloads += 1
+        return content.decode('gbk')
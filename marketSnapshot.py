@@ -0,0 +1,256 @@
+import queue
+import threading
+import time
+from typing import Iterable
+
+import numpy as np
+
+from const import CATEGORY, MARKET
+from parser import stock
+from tdxClient import MAX_QUOTES_COUNT
+from tdxClientPool import TdxClientPool
+from utils.columnar import Columnar
+from utils.log import log
+
+DEFAULT_SNAPSHOT_INTERVAL = 3.0
+# 这些字段有变化才算行情有更新: 最新价、成交量、买一卖一
+DIFF_FIELDS = ('price', 'vol', 'bid1', 'ask1', 'bid_vol1', 'ask_vol1')
+
+
+def diff_rows(new: Columnar, old: Columnar, fields=DIFF_FIELDS) -> np.ndarray:
+    """
+    比较两张按相同行号排列的表, 返回有变化的行号; new 比 old 多出来的行都算变化
+    """
+    size = len(new)
+    common = min(size, len(old))
+    changed = np.zeros(size, dtype=bool)
+    changed[common:] = True
+    for name in fields:
+        changed[:common] |= new[name][:common] != old[name][:common]
+    return np.flatnonzero(changed)
+
+
+class MarketSnapshot():
+    """
+    全市场行情快照
+
+    按固定周期通过连接池并行拉取整个股票池的行情, 每只股票的最新行情保存在预分配的列式表里,
+    用 (market, code) 索引, 读取时 O(1).
+
+    内部有两张表交替使用: 拉取时把本轮的行情写入后台表, 本轮没有拉到的行才从前台表补上(全市场刷新时
+    一行也不用补), 写完后两张表按引用互换. snapshot() 返回的表在下一轮拉取完成之前保持不变.
+    行号索引只在出现新股票时复制一份再追加, 与快照一起用一次赋值发布, 读取线程不需要加锁.
+
+        snapshot = MarketSnapshot(pool, CATEGORY.A).start()
+        snapshot.get(MARKET.SH, '600519')['price']
+
+    只关心变化的消费者可以用 on_change 注册回调, 或者迭代 changes(), 每轮只拿到
+    DIFF_FIELDS 有变化的股票. 不传 pool 时可以自己拉取行情, 再交给 update() 比较.
+    """
+
+    COLUMNS = stock.QuotesList.COLUMNS
+
+    def __init__(self, pool: TdxClientPool = None, category: CATEGORY = CATEGORY.A, stocks: Iterable[tuple[MARKET, str]] = None,
+                 interval=DEFAULT_SNAPSHOT_INTERVAL, batch_size=MAX_QUOTES_COUNT):
+        """
+        :param category: 按分类拉取(stock.QuotesList), stocks 不为空时忽略
+        :param stocks: [(market, code), ...], 指定股票池(stock.Quotes)
+        :param interval: 拉取周期(秒)
+        :param batch_size: 单次请求的股票数, 不能超过服务器的上限 MAX_QUOTES_COUNT
+        """
+        self.pool = pool
+        self.category = category
+        self.stocks = None if stocks is None else list(stocks)
+        self.interval = interval
+        self.batch_size = min(batch_size, MAX_QUOTES_COUNT)
+
+        self.capacity = 0
+        self._front = Columnar(self.COLUMNS, 0)
+        self._back = Columnar(self.COLUMNS, 0)
+        # (快照, {(market, code): 行号}), 总是整体替换
+        self._published = (self._front, {})
+        self.version = 0
+        self.updated_at = None
+        self.pages = 1
+
+        self.listeners = []
+        self.change_listeners = []
+        self.change_queues = []
+        self.diff_fields = DIFF_FIELDS
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            start_time = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                log.error("snapshot poll failed: %s", e)
+            self.stop_event.wait(max(self.interval - (time.time() - start_time), 0))
+
+    def _fetch(self):
+        """
+        拉取一轮行情, 返回列式结果的列表
+        """
+        if self.stocks:
+            batches = [self.stocks[i: i + self.batch_size] for i in range(0, len(self.stocks), self.batch_size)]
+            return self.pool.map(lambda batch: stock.Quotes(batch, columnar=True), batches)
+
+        # 按分类拉取时总数未知: 上一轮有多少页就并行拉多少页, 最后一页是满的就继续往后拉
+        parts = []
+        start = 0
+        pages = self.pages
+        while True:
+            results = self.pool.map(lambda start: stock.QuotesList(self.category, start, self.batch_size, columnar=True),
+                                    [start + i * self.batch_size for i in range(pages)])
+            parts.extend(results)
+            if any(len(part) < self.batch_size for part in results):
+                break
+            start += pages * self.batch_size
+            pages = self.pool.size
+        self.pages = max(len(parts), 1)
+        return parts
+
+    @property
+    def index(self) -> dict:
+        """
+        {(market, code): 行号}, 与 snapshot() 对应; 已发布的索引不会再被修改
+        """
+        return self._published[1]
+
+    def _reserve(self, size: int):
+        """
+        容量不够时两张表一起扩容
+        """
+        if size <= self.capacity:
+            return
+        capacity = max(size, self.capacity * 2)
+        for name in ('_front', '_back'):
+            old = getattr(self, name)
+            new = Columnar(self.COLUMNS, capacity)
+            for column in new.keys():
+                new[column][:old.size] = old[column]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def poll(self):
+        """
+        拉取一轮行情并切换快照
+        :return: 本轮拉取到的列式结果列表
+        """
+        parts = self._fetch()
+        self.update(parts)
+        return parts
+
+    def update(self, parts):
+        """
+        把一轮行情(stock.Quotes/QuotesList 的列式结果)写入快照并切换
+        :return: 与上一轮相比有变化的行, 没有人关心变化时返回 None
+        """
+        parts = [part for part in parts if part]
+        previous, index = self._published
+        keys = [list(zip(part['market'], part['code'])) for part in parts]
+
+        # 有新股票时在副本上分配行号, 已发布的索引保持不变
+        new_keys = [key for part_keys in keys for key in part_keys if key not in index]
+        if new_keys:
+            index = dict(index)
+            for key in new_keys:
+                index.setdefault(key, len(index))
+        size = len(index)
+        self._reserve(size)
+
+        back = self._back
+        covered = np.zeros(size, dtype=bool)
+        for part, part_keys in zip(parts, keys):
+            rows = np.fromiter((index[key] for key in part_keys), dtype=np.int64, count=len(part_keys))
+            for name in back.keys():
+                back[name][rows] = part[name]
+            covered[rows] = True
+        # 本轮没有拉到的行沿用上一轮的数据
+        stale = np.flatnonzero(~covered)
+        if len(stale):
+            for name in back.keys():
+                back[name][stale] = self._front[name][stale]
+
+        self._front, self._back = back, self._front
+        self._published = (Columnar.from_arrays({name: back[name][:size] for name in back.keys()}), index)
+        self.version += 1
+        self.updated_at = time.time()
+
+        for listener in self.listeners:
+            try:
+                listener(self, parts)
+            except Exception as e:
+                log.error("snapshot listener failed: %s", e)
+
+        if not self.change_listeners and not self.change_queues:
+            return None
+        changes = self.diff(previous)
+        for listener in self.change_listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                log.error("snapshot change listener failed: %s", e)
+        for q in self.change_queues:
+            q.put(changes)
+        return changes
+
+    def diff(self, previous: Columnar) -> Columnar:
+        """
+        当前快照中相对 previous 有变化的行
+        """
+        snapshot = self._published[0]
+        rows = diff_rows(snapshot, previous, self.diff_fields)
+        return Columnar.from_arrays({name: snapshot[name][rows] for name in snapshot.keys()})
+
+    def on_change(self, callback):
+        """
+        注册回调, 每轮以有变化的行(Columnar)调用一次
+        """
+        self.change_listeners.append(callback)
+        return callback
+
+    def changes(self, timeout=None):
+        """
+        变化流: 每轮产出一个只含有变化的行的 Columnar, 等待超时则结束
+        """
+        q = queue.Queue()
+        self.change_queues.append(q)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=timeout)
+                except queue.Empty:
+                    return
+        finally:
+            self.change_queues.remove(q)
+
+    def snapshot(self) -> Columnar:
+        """
+        当前快照, 在下一轮拉取完成前保持不变
+        """
+        return self._published[0]
+
+    def get(self, market: MARKET, code: str):
+        snapshot, index = self._published
+        row = index.get((market, code))
+        if row is None or row >= snapshot.size:
+            return None
+        return {name: snapshot[name][row] for name in snapshot.keys()}
+
+    def to_df(self):
+        return self._published[0].to_df()
@@ -1,20 +1,28 @@
 import struct
 
+# 一天最多变一次的参考数据(公司资料、除权除息、板块文件、证券列表等)在响应缓存里保存的秒数
+REFERENCE_DATA_TTL = 4 * 60 * 60
+
 class BaseParser:
     
     msg_id = 0
     body = bytearray()
+    # 响应可以在 ResponseCache 里缓存的秒数, 0 表示不缓存
+    CACHE_TTL = 0
     
     def __init__(self):
         super().__init__()
 
-    def serialize(self):
+    def serialize(self, customize: int = 0):
+        """
+        :param customize: 请求序号, 服务器会原样带回, 流水线模式下用来对应请求和响应
+        """
         body = struct.pack('<H', self.msg_id) + self.body
-        header = struct.pack('<BIBHH', 0xc, 0, 1, len(body), len(body))
+        header = struct.pack('<BIBHH', 0xc, customize, 1, len(body), len(body))
         return header + body
 
     def deserialize(self, data):
-        return data
+        return bytes(data)
 
 def register_parser(msg_id: int = 0):
     def decorator(cls):
@@ -1,12 +1,14 @@
 import struct
 from typing import override
 from const import BLOCK_FILE_TYPE
-from parser.baseparser import BaseParser, register_parser
+from parser.baseparser import REFERENCE_DATA_TTL, BaseParser, register_parser
 import six
 
 # iwshop/1_600009.htm
 @register_parser(0x6b9)
 class Report(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+
     def __init__(self, file_name: str, start: int = 0, size: int = 0x7530):
         if type(file_name) is six.text_type:
             file_name = file_name.encode("utf-8")
@@ -16,7 +18,7 @@ class Report(BaseParser):
     def deserialize(self, data):
         return {
             'size': struct.unpack('<I', data[:4])[0],
-            'data': data[4:]
+            'data': bytes(data[4:])
         }
 
 
@@ -31,6 +33,8 @@ class Report(BaseParser):
 # >00 00000000 00 2a00 2a00 |c502 62692f626967646174615f312e7a6970000000000000000000000000000000000000000000000000  bi/bigdata_1.zip
 @register_parser(0x2c5)
 class Meta(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+
     def __init__(self, block_file_type: BLOCK_FILE_TYPE):
         file_name = block_file_type.value.encode("utf-8") if type(block_file_type.value) is six.text_type else block_file_type.value
         self.body = struct.pack('<40s', file_name)
@@ -1,16 +1,21 @@
 import struct
 from typing import override
 from const import MARKET
-from parser.baseparser import BaseParser, register_parser
+from parser.baseparser import REFERENCE_DATA_TTL, BaseParser, register_parser
 import six
 from utils.help import to_datetime
+from utils.record_layout import RecordLayout
 
 @register_parser(0x2cf)
 class Category(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+    REQUEST = RecordLayout([('market', 'H'), ('code', '6s'), ('_', 'I')])
+    RECORD = RecordLayout([('name', '64s'), ('filename', '80s'), ('start', 'I'), ('length', 'I')])
+
     def __init__(self, market: MARKET, code: str):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
-        self.body = struct.pack("<H6sI", market.value, code, 0)
+        self.body = self.REQUEST.pack(market.value, code, 0)
 
     @override
     def deserialize(self, data):
@@ -27,10 +32,7 @@ class Category(BaseParser):
 
 
         categories = []
-        for i in range(count):
-            category_buf = data[2 + i * 152:2 + (i + 1) * 152]
-
-            (name, filename, start, length) = struct.unpack("<64s80sII", category_buf)
+        for (name, filename, start, length) in self.RECORD.iter_unpack(data, 2, count):
             categories.append({
                 'name': get_str(name),
                 'filename': get_str(filename),
@@ -42,6 +44,8 @@ class Category(BaseParser):
 
 @register_parser(0x2d0)
 class Content(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+
     def __init__(self, market: MARKET, code: str, filename: str, start: int, length: int):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
@@ -63,12 +67,14 @@ class Content(BaseParser):
             'code': code,
             'marketOR': marketOR,
             'length': length,
-            'content': data[12:12+length].decode('gbk', 'ignore').rstrip("\x00"),
+            'content': bytes(data[12:12+length]).decode('gbk', 'ignore').rstrip("\x00"),
         }
 
 
 @register_parser(0x10)
 class Finance(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+
     def __init__(self, market: MARKET, code: str):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
@@ -160,36 +166,42 @@ class Finance(BaseParser):
 
 @register_parser(0xf)
 class XDXR(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+    REQUEST = RecordLayout([('count', 'H'), ('market', 'B'), ('code', '6s')])
+    HEADER = RecordLayout([('market', 'H'), ('marketOR', 'B'), ('code', '6s'), ('count', 'H')])
+    # v1~v4 的含义取决于 category
+    RECORD = RecordLayout([
+        ('market', 'B'), ('code', '6s'), ('_', 'B'), ('date', 'I'), ('category', 'B'),
+        ('v1', 'f'), ('v2', 'f'), ('v3', 'f'), ('v4', 'f'),
+    ])
+
     def __init__(self, market: MARKET, code: str):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
-        self.body = struct.pack(u'<HB6s', 1, market.value, code)
+        self.body = self.REQUEST.pack(1, market.value, code)
 
     @override
     def deserialize(self, data):
-        (market, marketOR, code, count) = struct.unpack('<HB6sH', data[:11])
+        (market, marketOR, code, count) = self.HEADER.unpack(data)
 
         xdxrs = []
-        for i in range(count):
-            pos = 11 + i * 29
-            (market, code, unknown, date, category) = struct.unpack('<B6sBIB', data[pos: pos + 13])
+        for (market, code, unknown, date, category, v1, v2, v3, v4) in self.RECORD.iter_unpack(data, self.HEADER.size, count):
             date = to_datetime(date)
 
             name = XDXR_CATEGORY_MAPPING.get(category, category)
 
-            left_data = data[pos + 13: pos + 29]
             fenhong, peigujia, songzhuangu, peigu = None, None, None, None
             suogu = None
             xingquanjia, fenshu = None, None
             panqianliutong, qianzongguben, panhouliutong, houzongguben = None, None, None, None
             if category == 1:
-                fenhong, peigujia, songzhuangu, peigu  = struct.unpack("<ffff", left_data)
+                fenhong, peigujia, songzhuangu, peigu = v1, v2, v3, v4
             elif category in [11, 12]:
-                _, _, suogu, _ = struct.unpack("<ffff", left_data)
+                suogu = v3
             elif category in [13, 14]:
-                xingquanjia, _, fenshu, _ = struct.unpack("<ffff", left_data)
+                xingquanjia, fenshu = v1, v3
             else:
-                panqianliutong, qianzongguben, panhouliutong, houzongguben = struct.unpack("<ffff", left_data)
+                panqianliutong, qianzongguben, panhouliutong, houzongguben = v1, v2, v3, v4
 
             xdxrs.append({
                 'market': MARKET(market),
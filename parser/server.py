@@ -15,7 +15,7 @@ class ExchangeAnnouncement(BaseParser):
         v, = struct.unpack('<B', data[:1])
         return {
             'v': v,
-            'content': data[1:].decode('gbk')
+            'content': bytes(data[1:]).decode('gbk')
         }
 
 # >0c 07189500 01 0200 0200 |0400
@@ -57,7 +57,7 @@ class TodoB(BaseParser):
         self.body = bytearray()
     @override
     def deserialize(self, data):
-        return data
+        return bytes(data)
 
 # >0c 02189400 01 0300 0300 |0d00 01
 # <b1cb7400 1c 02189400 00 0d00 5000 bd00 |789c6378c9cec826c9c72069c5b4898987b9050ed1f90c8bfe9b304a7a3182692920fd9fe13903032323e37f8693e7772d3ebdfafcfd6bdfafee3364a016600421e5b32bb6bcbf701487120051371e55
@@ -158,7 +158,7 @@ class UpgradeTip(BaseParser):
         (had, unknow2, tips, unknow5, link) = struct.unpack('<BH50s5s120s', data[:178])
         tips = tips.decode('gbk').replace('\x00', '')
         link = link.decode('gbk').replace('\x00', '')
-        msg = data[178:].decode('gbk', 'ignore').replace('\x00', '') if had == 0x01 else None
+        msg = bytes(data[178:]).decode('gbk', 'ignore').replace('\x00', '') if had == 0x01 else None
         return {
             "had": had,
             "unknown": [unknow2, unknow5.hex()],
@@ -1,27 +1,46 @@
 from datetime import date
 from utils.log import log
 from const import CATEGORY, KLINE_TYPE, MARKET
-from parser.baseparser import BaseParser, register_parser
+from parser.baseparser import REFERENCE_DATA_TTL, BaseParser, register_parser
 import struct
 from typing import override
 import six
 from utils.help import to_datetime, get_price, get_time
+from utils.fast_decode import as_uint8, decode_bars, decode_bar_columns, decode_order_columns, decode_transactions, decode_transaction_columns, decode_varints, format_minutes, format_sides, gather_float32, gather_uint, varint_ends
+from utils.columnar import Columnar
+from utils.record_layout import RecordLayout, decode_strings
+import numpy as np
 
 @register_parser(0x52d)
 class Bars(BaseParser):
-    def __init__(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start: int, count: int):
+    def __init__(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start: int, count: int, as_arrays: bool = False, columnar: bool = False):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
         self.body = struct.pack(u'<H6sHHHH10s', market.value, code, kline_type.value, 1, start, count, b'')
 
         self.kline_type = kline_type
+        # as_arrays=True 时返回 fast_decode.BAR_DTYPE 结构化数组, 而不是 dict 列表
+        self.as_arrays = as_arrays
+        self.columnar = columnar
+
+    @property
+    def minute_category(self):
+        return self.kline_type.value < 4 or self.kline_type.value == 7 or self.kline_type.value == 8
+
+    def deserialize_numpy(self, data):
+        return decode_bars(data, self.minute_category)
 
     @override
     def deserialize(self, data):
+        if self.as_arrays:
+            return self.deserialize_numpy(data)
+        if self.columnar:
+            return Columnar.from_arrays(decode_bar_columns(data, self.minute_category))
+
         (count,) = struct.unpack('<H', data[:2])
         pos = 2
 
-        minute_category = self.kline_type.value < 4 or self.kline_type.value == 7 or self.kline_type.value == 8
+        minute_category = self.minute_category
 
         pre_diff_base = 0
         bars = []
@@ -92,25 +111,31 @@ class Count(BaseParser):
 # >0c 14186e00 01 1000 1000 |4d04 0000 4038 0000 4006 0000 0000 0000
 @register_parser(0x44d)
 class List(BaseParser):
-    def __init__(self, market: MARKET, start: int = 0, count: int = 1600):
-        self.body = struct.pack(u'<HIII', market.value, start, count, 0)
+    COLUMNS = [('code', object), ('vol', 'u2'), ('name', object), ('decimal_point', 'u1'), ('pre_close', 'f4'), ('unknown1', object)]
+    CACHE_TTL = REFERENCE_DATA_TTL
+    REQUEST = RecordLayout([('market', 'H'), ('start', 'I'), ('count', 'I'), ('_', 'I')])
+    RECORD = RecordLayout([
+        ('code', '6s'), ('vol', 'H'), ('name', '8s'), ('_', '8s'), ('unknown1', '4s'),
+        ('decimal_point', 'B'), ('pre_close', 'f'), ('unknown2', 'H'), ('unknown3', 'H'),
+    ])
+
+    def __init__(self, market: MARKET, start: int = 0, count: int = 1600, columnar: bool = False):
+        self.body = self.REQUEST.pack(market.value, start, count, 0)
+        self.columnar = columnar
 
     @override
     def deserialize(self, data):
         (count,) = struct.unpack('<H', data[:2])
-        
-        stocks = []
-        for i in range(count):
-            pos = 2 + i * 37
-            (code, vol, name, _, unknown1, decimal_point, pre_close, unknown2, unknown3) = struct.unpack("<6sH8s8s4sBfHH", data[pos: pos + 37])
-            code = code.decode('gbk', errors='ignore').rstrip('\x00')
-            name = name.decode('gbk', errors='ignore').rstrip('\x00')
 
-            # print(data[pos: pos + 37].hex())
+        if self.columnar:
+            return list_columns(self.RECORD.to_array(data, 2, count))
+
+        stocks = []
+        for (code, vol, name, _, unknown1, decimal_point, pre_close, unknown2, unknown3) in self.RECORD.iter_unpack(data, 2, count):
             stocks.append({
-                'code': code,
+                'code': code.decode('gbk', errors='ignore').rstrip('\x00'),
                 'vol': vol,
-                'name': name,
+                'name': name.decode('gbk', errors='ignore').rstrip('\x00'),
                 'decimal_point': decimal_point,
                 'pre_close': pre_close,
                 'unknown1': [unknown1.hex(), unknown2, unknown3],
@@ -118,26 +143,47 @@ class List(BaseParser):
 
         return stocks
 
+def list_columns(records: np.ndarray) -> Columnar:
+    """
+    List 的结构化数组转为列式结果
+    """
+    # unknown1 按原始的 4 个字节取十六进制, 不能走 S4 (会丢掉末尾的 \x00)
+    raw = np.ascontiguousarray(records['unknown1']).view('>u4')
+    unknown = np.empty(len(records), dtype=object)
+    for i, (value, unknown2, unknown3) in enumerate(zip(raw.tolist(), records['unknown2'].tolist(), records['unknown3'].tolist())):
+        unknown[i] = ['%08x' % value, unknown2, unknown3]
+
+    return Columnar.from_arrays({
+        'code': decode_strings(records['code']),
+        'vol': records['vol'],
+        'name': decode_strings(records['name']),
+        'decimal_point': records['decimal_point'],
+        'pre_close': records['pre_close'],
+        'unknown1': unknown,
+    })
+
 @register_parser(0x450)
 class ListB(BaseParser):
+    CACHE_TTL = REFERENCE_DATA_TTL
+    REQUEST = RecordLayout([('market', 'H'), ('start', 'H')])
+    RECORD = RecordLayout([
+        ('code', '6s'), ('vol', 'H'), ('name', '8s'), ('unknown1', '4s'),
+        ('decimal_point', 'B'), ('pre_close', 'f'), ('unknown2', 'H'), ('unknown3', 'H'),
+    ])
+
     def __init__(self, market: MARKET, start):
-        self.body = struct.pack(u'<HH', market.value, start)
+        self.body = self.REQUEST.pack(market.value, start)
 
     @override
     def deserialize(self, data):
         (count,) = struct.unpack('<H', data[:2])
 
         stocks = []
-        for i in range(count):
-            pos = 2 + i * 29
-            (code, vol, name, unknown1, decimal_point, pre_close, unknown2, unknown3) = struct.unpack("<6sH8s4sBfHH", data[pos: pos + 29])
-            code = code.decode('gbk', errors='ignore').rstrip('\x00')
-            name = name.decode('gbk', errors='ignore').rstrip('\x00')
-            
+        for (code, vol, name, unknown1, decimal_point, pre_close, unknown2, unknown3) in self.RECORD.iter_unpack(data, 2, count):
             stocks.append({
-                'code': code,
+                'code': code.decode('gbk', errors='ignore').rstrip('\x00'),
                 'vol': vol,
-                'name': name,
+                'name': name.decode('gbk', errors='ignore').rstrip('\x00'),
                 'decimal_point': decimal_point,
                 'pre_close': pre_close,
                 'unknown1': [unknown1.hex(), unknown2, unknown3],
@@ -147,19 +193,26 @@ class ListB(BaseParser):
 
 @register_parser(0x51d) # TODO: 不对
 class Orders(BaseParser):
-    def __init__(self, market: MARKET, code: str):
+    COLUMNS = [('price', 'i8'), ('vol', 'i8'), ('unknown', 'i8')]
+
+    def __init__(self, market: MARKET, code: str, columnar: bool = False):
         if type(code) is six.text_type:
             code = code.encode("gbk")
         self.body = struct.pack(u'<H6sI', market.value, code, 0)
+        self.columnar = columnar
 
     @override
     def deserialize(self, data):
+        if self.columnar:
+            # 三个字段都是变长整数, 整个响应体一次解码
+            return Columnar.from_arrays(decode_order_columns(data))
+
         (count,) = struct.unpack('<H', data[:2])
         pos = 2
 
         orders = []
         last_price = 0
-        for _ in range(count):
+        for i in range(count):
             price, pos = get_price(data, pos)
             unknown, pos = get_price(data, pos)
             vol, pos = get_price(data, pos)
@@ -209,72 +262,55 @@ class HistoryOrders(BaseParser):
 
 @register_parser(0xfc5)
 class Transaction(BaseParser):
-    def __init__(self, market: MARKET, code: str, start: int, count: int):
+    def __init__(self, market: MARKET, code: str, start: int, count: int, columnar: bool = False, as_arrays: bool = False):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
         self.body = struct.pack(u'<H6sHH', market.value, code, start, count)
+        self.columnar = columnar
+        # as_arrays=True 时返回 fast_decode.TRANSACTION_DTYPE 结构化数组, 时间和买卖方向不格式化成字符串
+        self.as_arrays = as_arrays
 
     @override
     def deserialize(self, data):
-        (count,) = struct.unpack('<H', data[:2])
-        pos = 2
-
-        last_price = 0
-        transactions = []
-        for _ in range(count):
-            hour, minute, pos = get_time(data, pos)
-
-            price, pos = get_price(data, pos)
-            vol, pos = get_price(data, pos)
-            trans, pos = get_price(data, pos)
-            buyorsell, pos = get_price(data, pos)
-            unknown, pos = get_price(data, pos)
-
-            last_price += price
-            transactions.append({
-                "time": "%02d:%02d" % (hour, minute),
-                'price': last_price,
-                'vol': vol,
-                'trans': trans,
-                'action': 'SELL' if buyorsell == 1 else 'BUY',
-                'unknown': unknown,
-            })
-
-        return transactions
+        if self.as_arrays:
+            return decode_transactions(data)
+        return transaction_result(decode_transaction_columns(data), self.columnar)
 
 @register_parser(0xfb5)
 class HistoryTransaction(BaseParser):
-    def __init__(self, market: MARKET, code: str, date: date, start: int, count: int):
+    def __init__(self, market: MARKET, code: str, date: date, start: int, count: int, columnar: bool = False, as_arrays: bool = False):
         if type(code) is six.text_type:
             code = code.encode("utf-8")
         date = date.year * 10000 + date.month * 100 + date.day
         self.body = struct.pack(u'<IH6sHH', date, market.value, code, start, count)
+        self.columnar = columnar
+        # as_arrays=True 时返回 fast_decode.HISTORY_TRANSACTION_DTYPE 结构化数组
+        self.as_arrays = as_arrays
 
     @override
     def deserialize(self, data):
-        (count, _) = struct.unpack('<H4s', data[:6])
-        pos = 6
-
-        last_price = 0
-        transactions = []
-        for _ in range(count):
-            hour, minute, pos = get_time(data, pos)
-
-            price, pos = get_price(data, pos)
-            vol, pos = get_price(data, pos)
-            buyorsell, pos = get_price(data, pos)
-            unknown, pos = get_price(data, pos)
+        if self.as_arrays:
+            return decode_transactions(data, history=True)
+        return transaction_result(decode_transaction_columns(data, history=True), self.columnar)
 
-            last_price += price
-            transactions.append({
-                "time": "%02d:%02d" % (hour, minute),
-                'price': last_price,
-                'vol': vol,
-                'action': 'SELL' if buyorsell == 1 else 'BUY',
-                'unknown': unknown,
-            })
-
-        return transactions
+def transaction_result(columns: dict, columnar: bool):
+    """
+    分笔的数组转为列式结果或者 dict 列表, 时间格式化为 "HH:MM", 买卖方向为 'BUY'/'SELL'
+    """
+    result = {
+        'time': format_minutes(columns['minute']),
+        'price': columns['price'],
+        'vol': columns['vol'],
+    }
+    if 'trans' in columns:
+        result['trans'] = columns['trans']
+    result['action'] = format_sides(columns['side'])
+    result['unknown'] = columns['unknown']
+
+    if columnar:
+        return Columnar.from_arrays(result)
+    names = list(result.keys())
+    return [dict(zip(names, row)) for row in zip(*(array.tolist() for array in result.values()))]
 
 
 #>0c 92034103 00 2700 2700 |d10f 0100 363033383933 0000000000000000000000000000000001001400000000010000000000
@@ -331,6 +367,72 @@ def _format_time(time_stamp):
         )
     return time
 
+# QuotesList 每条记录里的变长整数: 定长头之后 9 个, amount 之后 8 个(含一档盘口)
+_QUOTE_HEAD_VARINTS = ('price', 'last_close', 'open', 'high', 'low', 'server_time', 'after_hour', 'vol', 'cur_vol')
+_QUOTE_TAIL_VARINTS = ('s_vol', 'b_vol', 's_amount', 'b_amount', 'bid1', 'ask1', 'bid_vol1', 'ask_vol1')
+# 相对 price 的差值
+_QUOTE_RELATIVE = ('last_close', 'open', 'high', 'low', 'bid1', 'ask1')
+_MARKETS = {market.value: market for market in MARKET}
+
+
+def _hex_column(buf: np.ndarray, starts: np.ndarray, size: int) -> np.ndarray:
+    text = buf[starts[:, None] + np.arange(size)].tobytes().hex()
+    return np.array([text[i: i + size * 2] for i in range(0, len(text), size * 2)], dtype=object)
+
+
+def quotes_list_columns(data, count: int, offset: int = 4) -> Columnar:
+    """
+    QuotesList 的列式解码: 逐条只用 varint_ends 查表找出各个变长整数的起点, 数值和定长字段再整列解码
+    """
+    buf = as_uint8(data)
+    ends = varint_ends(buf)
+    next_end = ends.tolist()
+    head_count, tail_count = len(_QUOTE_HEAD_VARINTS), len(_QUOTE_TAIL_VARINTS)
+
+    record_starts, amount_starts, trailer_starts, varint_starts = [], [], [], []
+    pos = offset
+    for _ in range(count):
+        record_starts.append(pos)
+        # market(B) code(6s) active1(H)
+        pos += 9
+        for _ in range(head_count):
+            varint_starts.append(pos)
+            pos = next_end[pos]
+        amount_starts.append(pos)
+        pos += 4
+        for _ in range(tail_count):
+            varint_starts.append(pos)
+            pos = next_end[pos]
+        # v1(H) v2(h) unknown1(8s) 10s unknown2(8s) 24s active2(H)
+        trailer_starts.append(pos)
+        pos += 56
+    if pos > len(buf):
+        raise ValueError("truncated records")
+
+    record_starts = np.array(record_starts, dtype=np.int64)
+    amount_starts = np.array(amount_starts, dtype=np.int64)
+    trailer_starts = np.array(trailer_starts, dtype=np.int64)
+    values = decode_varints(buf, np.array(varint_starts, dtype=np.int64), ends).reshape(count, head_count + tail_count)
+    varints = dict(zip(_QUOTE_HEAD_VARINTS + _QUOTE_TAIL_VARINTS, values.T))
+    for name in _QUOTE_RELATIVE:
+        varints[name] = varints[name] + varints['price']
+
+    codes = buf[(record_starts + 1)[:, None] + np.arange(6)].copy().view('S6').ravel()
+    arrays = {
+        'market': np.array([_MARKETS[value] for value in buf[record_starts].tolist()], dtype=object),
+        'code': decode_strings(codes),
+        'server_time': np.array([_format_time(value) for value in varints['server_time'].tolist()], dtype=object),
+        'amount': gather_float32(buf, amount_starts),
+        'v1': gather_uint(buf, trailer_starts, 2).astype(np.uint16),
+        'v2': gather_uint(buf, trailer_starts + 2, 2).astype(np.uint16).view(np.int16),
+        'unknown1': _hex_column(buf, trailer_starts + 4, 8),
+        'unknown2': _hex_column(buf, trailer_starts + 22, 8),
+        'active1': gather_uint(buf, record_starts + 7, 2).astype(np.uint16),
+        'active2': gather_uint(buf, trailer_starts + 54, 2).astype(np.uint16),
+    }
+    return Columnar.from_arrays({name: arrays[name] if name in arrays else varints[name]
+                                 for name, _ in QuotesList.COLUMNS})
+
 @register_parser(0x53e)
 class QuotesDetail(BaseParser):
     def __init__(self, stocks: list[MARKET, str]):
@@ -459,7 +561,7 @@ class TODO547(BaseParser):
     def deserialize(self, data):
         print("data: ", data.hex())
             
-        return data
+        return bytes(data)
 
 # 00 00|00 00|00 00|50 00|00 00|05 00|00 00|01 00|00 00 # 上证A股
 # 02 00|00 00|00 00|50 00|00 00|05 00|00 00|01 00|00 00 # 深证A股
@@ -470,17 +572,28 @@ class TODO547(BaseParser):
 # 0e 00|00 00|00 00|50 00|00 00|05 00|00 00|01 00|00 00 # 创业
 @register_parser(0x54b)
 class QuotesList(BaseParser):
-    def __init__(self, category: CATEGORY, start: int = 0, count: int = 0x50):
+    COLUMNS = [
+        ('market', object), ('code', object), ('price', 'i8'), ('open', 'i8'), ('high', 'i8'), ('low', 'i8'),
+        ('last_close', 'i8'), ('server_time', object), ('after_hour', 'i8'), ('vol', 'i8'), ('cur_vol', 'i8'),
+        ('amount', 'f4'), ('s_vol', 'i8'), ('b_vol', 'i8'), ('s_amount', 'i8'), ('b_amount', 'i8'),
+        ('bid1', 'i8'), ('ask1', 'i8'), ('bid_vol1', 'i8'), ('ask_vol1', 'i8'),
+        ('v1', 'u2'), ('v2', 'i2'), ('unknown1', object), ('unknown2', object), ('active1', 'u2'), ('active2', 'u2'),
+    ]
+
+    def __init__(self, category: CATEGORY, start: int = 0, count: int = 0x50, columnar: bool = False):
         self.body = struct.pack('<HHHHHHHHH', category.value, 0, start, count, 0 ,5, 0, 1, 0)
+        self.columnar = columnar
     @override
     def deserialize(self, data):
         (block, count) = struct.unpack('<HH', data[:4])
         pos = 4
 
-        print("block: %d, count: %d" % (block, count))
-        
+        log.debug("block: %d, count: %d" % (block, count))
+        if self.columnar:
+            return quotes_list_columns(data, count, pos) if count else Columnar(self.COLUMNS, 0)
+
         stocks = []
-        for _ in range(count):
+        for i in range(count):
             (market, code, active1 ) = struct.unpack('<B6sH', data[pos: pos + 9])
             pos += 9
             price, pos = get_price(data, pos)
@@ -556,6 +669,10 @@ class QuotesList(BaseParser):
                 's_amount': s_amount,
                 'b_amount': b_amount,
                 # 'handi_cap': handi_cap,
+                'bid1': bid,
+                'ask1': ask,
+                'bid_vol1': bid_vol,
+                'ask_vol1': ask_vol,
                 'v1': v1,
                 'v2': v2,
                 'unknown1': unknown1.hex(),
@@ -569,10 +686,11 @@ class QuotesList(BaseParser):
 # <b1cb7400 1c ff2d8800 00 4c05 a304 df06 789c75946b4c53671cc6ffef29d07268cfa1078a06499529c36583f50eac5b4e41702ba5355ec6d06d06dd07972c448dbbbb0fb55ccbc5225044a86ca52d051c2a9d651d552a8439c7580ec6d9396288ec6296a84159b23042ec4edd87950fe73ddf9f5f9ee7f7be07400c208b1eb95b5c4395eab1326b9821a628676d23b2df89771fe831d55af21dd5bbc05e8d01aadf5f571ce62f4770a8bc602a839833f551a52edbface24701cb7189432599e465321f6ab43c88efad11b5d3e8670e87b1bb774bcf2d9dc31d3e074aa3f44c2375e1cd057d8304a03216482b9c464880d32fdf31bfd60f67c2117a8e23f50818c491a975a913a7fbbed7b8600f745a10337ddd1192fdfe60ffc1c078e4554085bfd2c64352200e875ea0391ff43bc171b68d144791117844962217285527330d9bdd38ddc6810550e7632c4657ce412657e4116d49abc37139b160410b0251442b24510a632810028ab34fc1dc3193dfe8c4e6b19e05ced6072b48c469d372f1acb6e47cdecb7abfd2a5be7eb3e4953bae3e14fc68bcbc286210138fcac9d1e891b8545a99004e6164b696ccef8cc197a75e3ab212ecebc28ca295068ecfca12cad5259ea9a6421b6ae3867fcbec5b365be5bd8d949042324a056bc0985e301f860f6edd0c7c56404b45d747be56ececdecfca75d64aa2ea15da7557d894c012f430c90b67ebc59a4edeb37facf2574aff0e0ca186b6610eb45e144009624d9531a8999acff5e1b7de434ce89e912228d4c995fa01491bd0ba88fe7c25cd83554eff510f30bc86f891f4cdff0a9c8e432f3da2c98d4729da7073e9e96940624803f68588d211dd95ba25bda7b7a828b2422a34f47ae5607052364711159ecb8cd108fc9b6135477fa8bfb09a3cf8c3bcd0268395e08b6cccec4cef5a9c0eeb575561f1bb270789a7e98d5cc799d8382e86a2aa52244546f50c9d5fac61f19a223c7f75dc6a92d39af4f1a5d36716b200942bfb0fef1b872c9efd1db9cffc11afb2d7f35d29b6f49396f5988602753ab0bf219deb94d14f55289e57e3f717f93e501aa4389b62543cdc7a16370663d207e575c5a2aceb6303f225e8b4d7836a3963ede769893c0f0d8a914aa3c45067941de82aa510d32f48e32c4a2bcd5233a4f9ebfeb315eea13382cf1f0c5095404025e38310178603eb2adf4498c11cdf0fbf46d9d8cd37d06c91691a955793d6420b74c2cdd7366be9f58cef505c481b79a6fcc18af581247fd82a2ee511ea0512cb7935a89c4c15dbc61cd0fc6932dd57dd2b8c4a9bd27aa5da1d0c80f5123396d48a5daed1863bde7b8e6b60fbddb609936d96f649fb46e045f3d5108766187b413e19002ba61fb1a8ceac359facfc81427e6101515cfbefda3d450c67d348169e630d70f0c11f0f0badba75053007bfbd8f33b4eac56749f7e0face30240d6dc9697d3a8bb9172d05d4b5af373ce5ab9498f38b339f51ca5a295342a5915e5e14b92538a9b7f65883ff8b5de792c38c77b5ce535390702c8f3c483c07972732154b720fbb758f93a0914003caa34ccc4643d97de43d70977723aaa7adaab40a3046a206798ef8e3f99b0c7c30ed89a1f9adfe67622d9beeba6dacfb38221299c5bdd0aa82da50e0baf5b8984e1ea9bf70c793149117a932e7cc0c94902ea5f8efca387
 @register_parser(0x54c)
 class Quotes(QuotesList):
-    def __init__(self, stocks: list[MARKET, str]):
+    def __init__(self, stocks: list[MARKET, str], columnar: bool = False):
         count = len(stocks)
         if count <= 0:
             raise Exception("stocks count must > 0")
+        self.columnar = columnar
         self.body = bytearray(struct.pack('<HIHH', 5, 0, 0, count))
         for (market, code) in stocks:
             self.body.extend(struct.pack('<B6s', market.value, code.encode('gbk')))
@@ -580,22 +698,23 @@ class Quotes(QuotesList):
 
 @register_parser(0x563)
 class Unusual(BaseParser): # 主力监控
+    REQUEST = RecordLayout([('market', 'H'), ('start', 'I'), ('count', 'I')])
+    # detail 的含义取决于 type, 由 unpack_by_type 解释
+    RECORD = RecordLayout([
+        ('market', 'H'), ('code', '6s'), ('_', 'B'), ('type', 'B'), ('_', 'B'), ('index', 'H'), ('z', 'H'),
+        ('detail', '13s'), ('_', 'B'), ('hour', 'B'), ('minute_sec', 'H'),
+    ])
+
     def __init__(self, market: MARKET, start: int, count: int = 600):
-        self.body = struct.pack('<HII', market.value, start, count)
+        self.body = self.REQUEST.pack(market.value, start, count)
     @override
     def deserialize(self, data):
         (count, ) = struct.unpack('<H', data[:2])
 
         stocks = []
-        for i in range(count):
-            pice_data = data[32 * i + 2: 32 * (i + 1) + 2]
-
-            market, code, _, type, _, index, z = struct.unpack('<H6sBBBHH', pice_data[:15])
-            hour, minute_sec = struct.unpack('<BH', pice_data[29: 32])
-
-            type, val = self.unpack_by_type(type, pice_data[15: 28])
+        for (market, code, _, type, _, index, z, detail, _, hour, minute_sec) in self.RECORD.iter_unpack(data, 2, count):
+            type, val = self.unpack_by_type(type, detail)
 
-            # print(pice_data.hex())
             stocks.append({
                 "index": index,
                 "market": MARKET(market),
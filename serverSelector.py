@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from baseStockClient import BaseStockClient
+from const import broker_hosts, tdx_hosts
+from parser import server
+from utils.log import log
+
+DEFAULT_SCORE_FILE = os.path.join(os.path.expanduser('~'), '.pytdx2', 'server_scores.json')
+DEFAULT_RERANK_INTERVAL = 300.0
+# EWMA 的平滑系数, 越大越看重最近的测量
+DEFAULT_ALPHA = 0.3
+# 评分比最好的服务器差这么多倍, 或者失败率超过 DEGRADED_FAILURE_RATE, 就认为这台服务器变差了
+DEGRADED_FACTOR = 3
+DEGRADED_FAILURE_RATE = 0.5
+# 连续失败这么多次的服务器不参与排名, 等评分过期后重新探测
+MAX_CONSECUTIVE_FAILURES = 3
+# 评分超过这么久(秒)没有更新就不再可信, 排名前重新探测
+DEFAULT_MAX_SCORE_AGE = 24 * 3600.0
+
+
+class ServerSelector():
+    """
+    按真实请求的延迟给服务器打分并排序
+
+    每台服务器保存延迟和失败率的指数加权平均(EWMA). 失败一次大致要白等一个超时, 所以
+    评分 = 延迟 + 失败率 * probe_timeout, 即一次请求的期望耗时, 越小越好.
+    评分保存在本地文件里, 下次启动直接按上次的评分挑选服务器, 不用再全部测一遍; start() 之后
+    后台线程定期重新探测, 连接池据此换掉变差的服务器.
+    评分有上限, 单靠它挂掉的服务器永远排不到最后, 所以最近连续失败 MAX_CONSECUTIVE_FAILURES 次的服务器
+    直接不参与排名; 超过 max_score_age 没有更新的评分在 rank() 时重新探测.
+
+        selector = ServerSelector().start()
+        client = TdxClient(selector=selector).connect()
+        pool = TdxClientPool(8, selector=selector)
+    """
+
+    def __init__(self, hosts=None, path=DEFAULT_SCORE_FILE, alpha=DEFAULT_ALPHA, probe_timeout=1, max_workers=16,
+                 rerank_interval=DEFAULT_RERANK_INTERVAL, max_score_age=DEFAULT_MAX_SCORE_AGE):
+        """
+        :param hosts: [(name, ip, port), ...], 默认为 tdx_hosts 加上 broker_hosts
+        :param path: 评分文件, 为 None 时不保存
+        :param max_workers: 同时探测的服务器数
+        :param rerank_interval: 后台重新探测的间隔(秒)
+        :param max_score_age: 评分的有效期(秒)
+        """
+        if hosts is None:
+            hosts = tdx_hosts + broker_hosts
+        self.hosts = {}
+        for host in hosts:
+            self.hosts.setdefault((host[1], host[2]), host)
+        self.path = path
+        self.alpha = alpha
+        self.probe_timeout = probe_timeout
+        self.max_workers = max_workers
+        self.rerank_interval = rerank_interval
+        self.max_score_age = max_score_age
+
+        # {(ip, port): {'latency': 秒或 None, 'failure': 失败率, 'streak': 连续失败次数, 'updated': 时间戳}}
+        self.scores = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            log.debug("load server scores failed: %s" % e)
+            return
+        with self.lock:
+            for item in saved:
+                key = (item['ip'], item['port'])
+                if key in self.hosts:
+                    self.scores[key] = {name: item[name] for name in ('latency', 'failure', 'updated')}
+                    # 旧版本的评分文件没有 streak
+                    self.scores[key]['streak'] = item.get('streak', 0)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            saved = [{'ip': ip, 'port': port, **score} for (ip, port), score in self.scores.items()]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # 先写临时文件再替换, 进程中途退出也不会留下半个文件
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.debug("save server scores failed: %s" % e)
+
+    def record(self, ip: str, port: int, latency: float = None):
+        """
+        记录一次请求的结果, latency 为 None 表示失败; 连接池和客户端也可以把真实请求的耗时报上来
+        """
+        with self.lock:
+            score = self.scores.setdefault((ip, port), {'latency': None, 'failure': 0.0, 'streak': 0, 'updated': None})
+            failed = 1.0 if latency is None else 0.0
+            score['failure'] = self.alpha * failed + (1 - self.alpha) * score['failure']
+            score['streak'] = score['streak'] + 1 if latency is None else 0
+            if latency is not None:
+                score['latency'] = latency if score['latency'] is None else self.alpha * latency + (1 - self.alpha) * score['latency']
+            score['updated'] = time.time()
+
+    def probe(self, ip: str, port: int):
+        """
+        连接后发一个心跳包, 按连接加请求的总耗时计分
+        :return: 耗时(秒), 失败返回 None
+        """
+        client = BaseStockClient(raise_exception=True)
+        latency = None
+        try:
+            start_time = time.time()
+            client.connect(ip, port, self.probe_timeout)
+            if client.send(server.HeartBeat().serialize()) is not None:
+                latency = time.time() - start_time
+        except Exception as e:
+            log.debug("probe %s:%d failed: %s" % (ip, port, e))
+        finally:
+            try:
+                client.disconnect()
+            except Exception as e:
+                log.debug(str(e))
+        self.record(ip, port, latency)
+        return latency
+
+    def probe_all(self, hosts=None):
+        """
+        并发探测全部服务器并保存评分
+        """
+        keys = list(self.hosts.keys()) if hosts is None else [(host[1], host[2]) for host in hosts]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda key: self.probe(*key), keys))
+        self.save()
+
+    def is_stale(self, ip: str, port: int):
+        """
+        还没有评分, 或者评分已经过期
+        """
+        score = self.scores.get((ip, port))
+        return score is None or score['updated'] is None or time.time() - score['updated'] > self.max_score_age
+
+    def score(self, ip: str, port: int):
+        """
+        :return: 评分, 没有测到过延迟、评分过期或者最近连续失败的服务器为 inf, 不参与排名
+        """
+        score = self.scores.get((ip, port))
+        if score is None or score['latency'] is None or score['streak'] >= MAX_CONSECUTIVE_FAILURES or \
+                self.is_stale(ip, port):
+            return float('inf')
+        return score['latency'] + score['failure'] * self.probe_timeout
+
+    def rank(self, count: int = None):
+        """
+        按评分从好到坏返回可用的服务器; 评分过期的服务器先同步重新探测, 没有任何可用的服务器时探测全部
+        :return: [(name, ip, port), ...]
+        """
+        with self.lock:
+            stale = [self.hosts[key] for key in self.hosts if self.is_stale(*key)]
+            usable = any(self.score(*key) != float('inf') for key in self.hosts)
+        if not usable:
+            self.probe_all()
+        elif stale:
+            self.probe_all(stale)
+        with self.lock:
+            keys = [key for key in self.hosts if self.score(*key) != float('inf')]
+            keys.sort(key=lambda key: self.score(*key))
+        hosts = [self.hosts[key] for key in keys]
+        return hosts if count is None else hosts[:count]
+
+    def best(self):
+        """
+        :return: (ip, port), 没有可用的服务器时抛出异常
+        """
+        hosts = self.rank(1)
+        if not hosts:
+            raise Exception("no available server")
+        return hosts[0][1], hosts[0][2]
+
+    def is_degraded(self, ip: str, port: int):
+        """
+        这台服务器的评分是否已经明显比最好的差
+        """
+        with self.lock:
+            score = self.scores.get((ip, port))
+            if score is None:
+                return False
+            if score['failure'] > DEGRADED_FAILURE_RATE:
+                return True
+            best = min((self.score(*key) for key in self.hosts), default=float('inf'))
+            return self.score(ip, port) > DEGRADED_FACTOR * best
+
+    def start(self):
+        """
+        启动后台线程定期重新探测
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.wait(self.rerank_interval):
+            try:
+                self.probe_all()
+            except Exception as e:
+                log.error("rerank servers failed: %s", e)
+
+
+_default_selector = None
+_default_selector_lock = threading.Lock()
+
+
+def default_selector() -> ServerSelector:
+    """
+    进程内共享的选择器, 第一次使用时从评分文件加载
+    """
+    global _default_selector
+    with _default_selector_lock:
+        if _default_selector is None:
+            _default_selector = ServerSelector()
+        return _default_selector
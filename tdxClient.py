@@ -1,27 +1,81 @@
 from datetime import date
-import math
+import itertools
 import threading
 from time import time
 from typing import override
-from baseStockClient import BaseStockClient, update_last_ack_time
+from baseStockClient import DEFAULT_PIPELINE_WINDOW, BaseStockClient, update_last_ack_time
+from serverSelector import ServerSelector, default_selector
+from utils.adjust import AdjustEngine, adjust_bars
+from utils.bar_store import BarStore
 from utils.block_reader import BlockReader, BlockReader_TYPE_FLAT
+from utils.columnar import Columnar
+from utils.file_download import download_chunks, download_stream
 from utils.log import log
-from const import BLOCK_FILE_TYPE, CATEGORY, KLINE_TYPE, MARKET, tdx_hosts
+from utils.paging import iter_pages, join_pages
+from utils.response_cache import ResponseCache
+from const import ADJUST, BLOCK_FILE_TYPE, CATEGORY, KLINE_TYPE, MARKET, tdx_hosts
 from parser import stock, server, company_info, block
 from parser.baseparser import BaseParser
 
+import numpy as np
 import pandas as pd
 
+# 单次行情请求最多的股票数
+MAX_QUOTES_COUNT = 0x50
+# k线数据单页最多800条
+MAX_KLINE_COUNT = 800
+# 当日分笔单页最多1800条
+MAX_TRANSACTION_COUNT = 1800
+# 历史分笔单页最多2000条
+MAX_HISTORY_TRANSACTION_COUNT = 2000
+
 class TdxClient(BaseStockClient):
-    def __init__(self, **kwargs):
+    def __init__(self, selector: ServerSelector = None, cache: ResponseCache = None, **kwargs):
+        """
+        :param selector: connect() 不指定 ip 时用来挑选服务器, 默认使用进程内共享的 default_selector()
+        :param cache: 响应缓存, 解析器 CACHE_TTL 不为 0 的请求优先从缓存读取
+        """
         super().__init__(**kwargs)
+        self.selector = selector
+        self.cache = cache
+        # 流水线请求的序号
+        self._customize = itertools.count(1)
+        # 复权因子的内存缓存
+        self.adjuster = AdjustEngine(self)
 
     def call(self, parser: BaseParser):
-        resp = super().send(parser.serialize())
-        if resp is None:
+        ttl = self.cache.ttl(parser) if self.cache is not None else 0
+        if ttl <= 0:
+            # 解析直接在接收缓冲区上进行, 不复制响应体
+            return super().send(parser.serialize(), parser.deserialize)
+
+        key = self.cache.key(parser)
+        data = self.cache.get(key)
+        if data is None:
+            data = super().send(parser.serialize())
+            if data is None:
+                return None
+            self.cache.put(key, data, ttl)
+        return parser.deserialize(data)
+
+    def call_many(self, parsers: list[BaseParser], window=DEFAULT_PIPELINE_WINDOW):
+        """
+        流水线方式发送一批请求, 不必每个请求都等一个来回
+        :return: 与 parsers 顺序一致的结果列表, 出错时返回 None
+        """
+        datas = [parser.serialize(next(self._customize) & 0xFFFFFFFF) for parser in parsers]
+        resps = super().send_many(datas, window)
+        if resps is None:
             return None
-        else:
-            return parser.deserialize(resp)
+        return [parser.deserialize(resp) for parser, resp in zip(parsers, resps)]
+
+    def _fetch_pages(self, parsers: list[BaseParser]):
+        """
+        iter_pages 的 fetch: 单个请求直接发送, 多个请求走流水线
+        """
+        if len(parsers) == 1:
+            return [self.call(parsers[0])]
+        return self.call_many(parsers, len(parsers))
 
     def login(self, show_info=False):
         try:
@@ -35,69 +89,122 @@ class TdxClient(BaseStockClient):
             log.error("login failed: %s", e)
             return False
 
+    @staticmethod
+    def rank_hosts(hosts=tdx_hosts, timeout=1):
+        """
+        多线程赛跑, 按连接耗时从快到慢返回可用的服务器
+        """
+        infos = []
+        def get_latency(ip, port, timeout):
+            try:
+                start_time = time()
+                c = TdxClient(raise_exception=True).connect(ip, port, timeout)
+                # info = c.call(server.Info())
+                infos.append({
+                    'ip': ip,
+                    'port': port,
+                    # 'delay': info['delay'],
+                    'time': time() - start_time,
+                })
+                c.disconnect()
+            except Exception as e:
+                pass
+        # 多线程赛跑
+        threads = []
+        for host in hosts:
+            t = threading.Thread(target=get_latency, args=(host[1], host[2], timeout))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+        
+        infos.sort(key=lambda x: x['time'])
+        return infos
+
     @override
     def connect(self, ip=None, port=7709, time_out=5, bindport=None, bindip='0.0.0.0'):
-        if ip is None:
-            # 选择延迟最低的服务器连接
-            infos = []
-            def get_latency(ip, port, timeout):
+        """
+        不指定 ip 时按评分从好到坏依次尝试, 连上第一台为止; 每次尝试的结果都报给 selector
+        """
+        if ip is not None:
+            return super().connect(ip, port, time_out, bindport, bindip)
+
+        # 评分来自上次保存的结果, 没有或者过期时才现场探测
+        selector = self.selector or default_selector()
+        hosts = selector.rank()
+        if not hosts:
+            raise Exception("no available server")
+        for host in hosts:
+            start_time = time()
+            try:
+                super().connect(host[1], host[2], time_out, bindport, bindip)
+                # raise_exception=False 时连接失败不会抛出异常, 用对端地址确认是否连上
+                self.client.getpeername()
+            except Exception as e:
+                log.debug("connect %s:%d failed: %s" % (host[1], host[2], e))
+                selector.record(host[1], host[2], None)
                 try:
-                    start_time = time()
-                    c = TdxClient().connect(ip, port, timeout)
-                    # info = c.call(server.Info())
-                    infos.append({
-                        'ip': ip,
-                        'port': port,
-                        # 'delay': info['delay'],
-                        'time': time() - start_time,
-                    })
+                    self.disconnect()
                 except Exception as e:
-                    pass
-            # 多线程赛跑
-            threads = []
-            for host in tdx_hosts:
-                t = threading.Thread(target=get_latency, args=(host[1], host[2], 1))
-                threads.append(t)
-                t.start()
-            for t in threads:
-                t.join()
-            
-            infos.sort(key=lambda x: x['time'])
-            if len(infos) == 0:
-                raise Exception("no available server")
-
-            return super().connect(infos[0]['ip'], infos[0]['port'], time_out, bindport, bindip)
-        else:
-            return super().connect(ip, port, time_out, bindport, bindip)
+                    log.debug(str(e))
+                continue
+            selector.record(host[1], host[2], time() - start_time)
+            return self
+        raise Exception("no available server")
 
     @override
     def doHeartBeat(self):
         self.call(server.HeartBeat())
 
     @update_last_ack_time
-    def get_security_bars(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start, count):
-        # k线数据最多800条
-        MAX_KLINE_COUNT = 800
-        bars = []
-        while len(bars) < count:
-            part = self.call(stock.Bars(market, code, kline_type, start, min(count - len(bars), MAX_KLINE_COUNT)))
-            if not part:
-                break
-            bars = [*part, *bars]
-            if len(part) < MAX_KLINE_COUNT:
-                break
-            start = start + len(part)
+    def get_security_bars(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start, count, columnar=False, window=DEFAULT_PIPELINE_WINDOW, store: BarStore = None):
+        """
+        :param store: 传入本地存储时, 先把存储补齐到最新, 再从存储里读取, 返回 BAR_DTYPE 结构化数组
+        """
+        if store is not None:
+            self.sync_security_bars(store, market, code, kline_type)
+            bars = store.read(market, code, kline_type)
+            end = max(len(bars) - start, 0)
+            bars = np.array(bars[max(end - count, 0): end])
+            if columnar:
+                return Columnar.from_arrays({name: bars[name] for name in bars.dtype.names})
+            return bars
+
+        return join_pages(self.iter_security_bars(market, code, kline_type, start, count, columnar=columnar, window=window), columnar)
+
+    def iter_security_bars(self, market: MARKET, code: str, kline_type: KLINE_TYPE, start, count, columnar=False, as_arrays=False,
+                           window=DEFAULT_PIPELINE_WINDOW, stop=None):
+        """
+        逐页产出 K 线, 从最新的一页开始, 每页最多 800 条
+        :param stop: stop(part) 返回 True 时在这一页之后停止
+        """
+        return iter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.Bars(market, code, kline_type, offset, size, as_arrays=as_arrays, columnar=columnar),
+            MAX_KLINE_COUNT, start, count, window, stop)
 
-        return bars
+    @update_last_ack_time
+    def sync_security_bars(self, store: BarStore, market: MARKET, code: str, kline_type: KLINE_TYPE, max_count=8000):
+        """
+        把本地存储补齐到最新: 从最新的 K 线往前翻页, 翻到已存的最后一根为止
+        :param max_count: 本地没有数据时最多下载的数量
+        :return: 新增的 K 线数量
+        """
+        last = store.last_datetime(market, code, kline_type)
+        stop = None if last is None else lambda part: part['datetime'][0] <= last
+        parts = list(self.iter_security_bars(market, code, kline_type, 0, max_count, as_arrays=True, window=1, stop=stop))
+        if not parts:
+            return 0
+        return store.append(market, code, kline_type, join_pages(parts))
 
     @update_last_ack_time
-    def get_security_quotes(self, all_stock, code=None):
+    def get_security_quotes(self, all_stock, code=None, window=DEFAULT_PIPELINE_WINDOW):
         """
         支持三种形式的参数
         get_security_quotes(market, code )
         get_security_quotes((market, code))
         get_security_quotes([(market1, code1), (market2, code2)] )
-        :param all_stock （market, code) 的数组
+        :param all_stock （market, code) 的数组, 超过单次请求上限时自动分批流水线发送
         :param code{optional} code to query
         :return:
         """
@@ -108,61 +215,96 @@ class TdxClient(BaseStockClient):
                 and len(all_stock) == 2 and type(all_stock[0]) is int:
             all_stock = [all_stock]
 
-        return self.call(stock.Quotes(all_stock))
+        if len(all_stock) <= MAX_QUOTES_COUNT:
+            return self.call(stock.Quotes(all_stock))
+
+        results = self.call_many([
+            stock.Quotes(all_stock[i: i + MAX_QUOTES_COUNT]) for i in range(0, len(all_stock), MAX_QUOTES_COUNT)
+        ], window)
+        if results is None:
+            return None
+        quotes = []
+        for part in results:
+            quotes.extend(part or [])
+        return quotes
 
     @update_last_ack_time
-    def get_security_quotes_by_category(self, category: CATEGORY, start:int = 0, count: int = 0x50):
-        return client.call(stock.QuotesList(category, start, count))
+    def get_security_quotes_by_category(self, category: CATEGORY, start:int = 0, count: int = 0x50, window=DEFAULT_PIPELINE_WINDOW):
+        """
+        count 超过单次请求上限时按 0x50 一页分页, 流水线发送
+        """
+        if count <= MAX_QUOTES_COUNT:
+            return self.call(stock.QuotesList(category, start, count))
+
+        quotes = []
+        finished = False
+        while count > 0 and not finished:
+            pages = []
+            sizes = []
+            while count > 0 and len(pages) < window:
+                size = min(count, MAX_QUOTES_COUNT)
+                pages.append(stock.QuotesList(category, start, size))
+                sizes.append(size)
+                start += size
+                count -= size
+            results = self.call_many(pages, window)
+            if results is None:
+                break
+            for part, size in zip(results, sizes):
+                quotes.extend(part or [])
+                if len(part or []) < size:
+                    finished = True
+                    break
+        return quotes
 
     @update_last_ack_time
     def get_security_count(self, market: MARKET):
         return self.call(stock.Count(market))
 
     @update_last_ack_time
-    def get_security_list(self, market: MARKET, start, count = 1600):
-        return self.call(stock.List(market, start, count))
+    def get_security_list(self, market: MARKET, start, count = 1600, columnar=False):
+        return self.call(stock.List(market, start, count, columnar=columnar))
 
     @update_last_ack_time
-    def get_orders(self, market: MARKET, code: str):
-        return self.call(stock.Orders(market, code))
+    def get_orders(self, market: MARKET, code: str, columnar=False):
+        return self.call(stock.Orders(market, code, columnar=columnar))
 
     @update_last_ack_time
     def get_history_orders(self, market: MARKET, code: str, date: date):
         return self.call(stock.HistoryOrders(market, code, date))
 
     @update_last_ack_time
-    def get_transaction(self, market: MARKET, code: str):
-        # 这里最多就1800条
-        MAX_TRANSACTION_COUNT = 1800
-        start = 0
-        transaction = []
-        while True:
-            part = self.call(stock.Transaction(market, code, start, MAX_TRANSACTION_COUNT))
-            if not part:
-                break
-            transaction = [*part, *transaction]
-            if len(part) < MAX_TRANSACTION_COUNT:
-                break
-            start = start + len(part)
-        return transaction
+    def get_transaction(self, market: MARKET, code: str, columnar=False, as_arrays=False):
+        """
+        :param as_arrays: 返回 fast_decode.TRANSACTION_DTYPE 的结构化数组, 时间和价格不做格式化
+        """
+        return join_pages(self.iter_transaction(market, code, columnar=columnar, as_arrays=as_arrays), columnar)
+
+    def iter_transaction(self, market: MARKET, code: str, columnar=False, as_arrays=False):
+        """
+        逐页产出当日分笔, 从最新的一页开始
+        """
+        return iter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.Transaction(market, code, offset, size, columnar=columnar, as_arrays=as_arrays),
+            MAX_TRANSACTION_COUNT)
 
     @update_last_ack_time
-    def get_history_transaction(self, market: MARKET, code: str, date: date):
+    def get_history_transaction(self, market: MARKET, code: str, date: date, columnar=False, as_arrays=False):
+        """
+        :param as_arrays: 返回 fast_decode.HISTORY_TRANSACTION_DTYPE 的结构化数组
+        """
+        return join_pages(self.iter_history_transaction(market, code, date, columnar=columnar, as_arrays=as_arrays), columnar)
+
+    def iter_history_transaction(self, market: MARKET, code: str, date: date, columnar=False, as_arrays=False):
+        """
+        逐页产出历史分笔, 从最新的一页开始
+        """
         # ref : https://github.com/rainx/pytdx/issues/7
-        # 分笔行情最多2000条
-        MAX_TRANSACTION_COUNT = 2000
-        start = 0
-        transaction = []
-        while True:
-            part = self.call(stock.HistoryTransaction(market, code, date, start, MAX_TRANSACTION_COUNT))
-            if not part:
-                break
-            transaction = [*part, *transaction]
-            if len(part) < MAX_TRANSACTION_COUNT:
-                break
-            start = start + len(part)
-            
-        return transaction
+        return iter_pages(
+            self._fetch_pages,
+            lambda offset, size: stock.HistoryTransaction(market, code, date, offset, size, columnar=columnar, as_arrays=as_arrays),
+            MAX_HISTORY_TRANSACTION_COUNT)
 
     @update_last_ack_time
     def get_company_info(self, market: MARKET, code: str):
@@ -193,55 +335,50 @@ class TdxClient(BaseStockClient):
 
     @update_last_ack_time
     def get_block_info(self, block_file_type: BLOCK_FILE_TYPE):
-        try:
-            meta = self.call(block.Meta(block_file_type))
-        except Exception as e:
-            log.error(e)
+        content = self.download_block_file(block_file_type)
+        if content is None:
             return None
+        return BlockReader().get_data(content, BlockReader_TYPE_FLAT)
 
+    def download_block_file(self, block_file_type: BLOCK_FILE_TYPE, meta=None, window=DEFAULT_PIPELINE_WINDOW):
+        """
+        下载板块文件, 各分块流水线发送
+        :param meta: 已经取到的 block.Meta 结果
+        :return: 文件内容, 取不到文件信息时返回 None
+        """
+        if meta is None:
+            try:
+                meta = self.call(block.Meta(block_file_type))
+            except Exception as e:
+                log.error(e)
+                return None
         if not meta:
             return None
 
-        size = meta['size']
-        one_chunk = 0x7530
-
-        file_content = bytearray()
-        for seg in range(math.ceil(size / one_chunk)):
-            start = seg * one_chunk
-            piece_data = self.call(block.Info(block_file_type, start, one_chunk))["data"]
-            file_content.extend(piece_data)
-
-        return BlockReader().get_data(file_content, BlockReader_TYPE_FLAT)
+        return download_chunks(lambda parsers: self.call_many(parsers, window),
+                               lambda start, size: block.Info(block_file_type, start, size), meta['size'])
 
     @update_last_ack_time
-    def get_report_file(self, filename: str, filesize=0, reporthook=None):
+    def get_report_file(self, filename: str, filesize=0, reporthook=None, window=DEFAULT_PIPELINE_WINDOW):
         """
         Download file from proxy server
 
         :param filename the filename to download
         :param filesize the filesize to download , if you do not known the actually filesize, leave this value 0
         """
-        filecontent = bytearray(filesize)
-        current_downloaded_size = 0
-        get_zero_length_package_times = 0
-        while current_downloaded_size < filesize or filesize == 0:
-            response = self.call(block.Report(filename, current_downloaded_size))
-            if response["size"] > 0:
-                current_downloaded_size = current_downloaded_size + \
-                    response["size"]
-                filecontent.extend(response["data"])
-                if reporthook is not None:
-                    reporthook(current_downloaded_size,filesize)
-            else:
-                get_zero_length_package_times = get_zero_length_package_times + 1
-                if filesize == 0:
-                    break
-                elif get_zero_length_package_times > 2:
-                    break
+        # 大小已知时各分块流水线发送, 写入预先分配好的缓冲区; 未知时只能顺序读到空块为止
+        if filesize > 0:
+            filecontent = download_chunks(lambda parsers: self.call_many(parsers, window),
+                                          lambda start, size: block.Report(filename, start, size), filesize, reporthook=reporthook)
+        else:
+            filecontent = download_stream(self.call, lambda start, size: block.Report(filename, start, size), reporthook=reporthook)
 
         return filecontent.decode("gbk")
     
-    def get_k_data(self, code, start_date, end_date):
+    def get_k_data(self, code, start_date, end_date, store: BarStore = None, adjust: ADJUST = None):
+        """
+        :param adjust: 复权方式, None 表示不复权
+        """
         # 具体详情参见 https://github.com/rainx/pytdx/issues/5
         # 具体详情参见 https://github.com/rainx/pytdx/issues/21
         def __select_market_code(code):
@@ -255,12 +392,23 @@ class TdxClient(BaseStockClient):
         # 0 - 深圳， 1 - 上海
         
 
-        data = pd.concat(
-            [
-                to_df(
-                    self.get_security_bars(__select_market_code(code), code, KLINE_TYPE.DAY_K, (9 - i) * 800, 800)
-                ) for i in range(10)
-            ], axis=0)
+ 
+        if store is not None:
+            # 本地已有的部分不再重新下载
+            bars = self.get_security_bars(__select_market_code(code), code, KLINE_TYPE.DAY_K, 0, 8000, store=store)
+        elif adjust is not None:
+            bars = join_pages(self.iter_security_bars(__select_market_code(code), code, KLINE_TYPE.DAY_K, 0, 8000, as_arrays=True))
+        else:
+            # 一次取回全部 10 页, 只转换一次 DataFrame
+            bars = self.get_security_bars(__select_market_code(code), code, KLINE_TYPE.DAY_K, 0, 8000, columnar=True)
+        if adjust is not None:
+            # 手里已经有全部日线, 直接用来计算新的除权因子, 不必再补取
+            factors = self.adjuster.update(__select_market_code(code), code, self.call(company_info.XDXR(__select_market_code(code), code)), bars)
+            bars = adjust_bars(bars, factors, adjust)
+        data = to_df(bars)
+        # 与逐条解析时一致: 只有指数才有涨跌家数, 全为 0 时不保留这两列
+        if not (data['upCount'].any() or data['downCount'].any()):
+            data = data.drop(['upCount', 'downCount'], axis=1)
  
         data = data.assign(date=data['datetime'].apply(lambda x: str(x)[0:10]))\
             .assign(code=str(code))\
@@ -269,7 +417,11 @@ class TdxClient(BaseStockClient):
         return data.assign(date=data['date'].apply(lambda x: str(x)[0:10]))
 
 def to_df(v):
-    if isinstance(v, list):
+    if isinstance(v, Columnar):
+        return v.to_df()
+    elif isinstance(v, np.ndarray):
+        return pd.DataFrame(v)
+    elif isinstance(v, list):
         return pd.DataFrame(data=v)
     elif isinstance(v, dict):
         return pd.DataFrame(data=[v, ])
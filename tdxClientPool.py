@@ -0,0 +1,283 @@
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable
+
+from const import KLINE_TYPE, MARKET
+from parser import server
+from parser.baseparser import BaseParser
+from serverSelector import ServerSelector, default_selector
+from tdxClient import TdxClient
+from utils.log import log
+from utils.response_cache import ResponseCache
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_HEALTH_CHECK_INTERVAL = 30.0
+# 借连接的最长等待时间(秒)
+DEFAULT_ACQUIRE_TIMEOUT = 60.0
+# 等待空闲连接时, 每隔这么久检查一次连接是否已经全部失效
+ACQUIRE_POLL_INTERVAL = 1.0
+# 传输层的错误: 连接本身坏了, 换连接重试; BaseStockClient 在 raise_exception=True 时把它们包装成下面这些消息
+TRANSPORT_ERRORS = (OSError, zlib.error)
+TRANSPORT_MESSAGES = ('send error', 'send data error', 'not connected', 'connection closed', 'unzip size mismatch',
+                      'connection timeout error', 'other errors', 'no response')
+
+
+def is_transport_error(e: BaseException) -> bool:
+    """
+    是否为传输层的错误(网络、超时、解压、无响应); 参数错误、解析错误等与连接无关, 返回 False
+
+    沿着 update_last_ack_time 的 original_exception 和异常链往下找, 包装过的错误也能认出来
+    """
+    while e is not None:
+        if isinstance(e, TRANSPORT_ERRORS):
+            return True
+        if type(e) is Exception and e.args and isinstance(e.args[0], str) and e.args[0] in TRANSPORT_MESSAGES:
+            return True
+        e = getattr(e, 'original_exception', None) or e.__cause__ or e.__context__
+    return False
+
+
+class TdxClientPool():
+    """
+    维护 N 条已登录的连接, 把请求分摊到各条连接上并行执行
+
+    每条连接都带心跳; 调用出错的连接会被替换掉并重试, 后台线程定期对空闲连接做健康检查
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, hosts=None, retries=1, health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, time_out=5,
+                 selector: ServerSelector = None, cache: ResponseCache = None, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        """
+        :param size: 连接数
+        :param hosts: [(name, ip, port), ...], 为 None 时按 selector 的评分挑选最好的 size 台
+        :param selector: 服务器选择器, 默认使用 default_selector(); 不指定 hosts 时, 新建连接总是按最新的排名挑选,
+                         健康检查时换掉评分明显变差的服务器上的连接. 请求的成败也会报给它
+        :param cache: 所有连接共享的响应缓存
+        :param retries: 单个请求失败后换连接重试的次数
+        :param health_check_interval: 健康检查的间隔(秒), 0 表示不检查
+        :param acquire_timeout: 借连接的最长等待时间(秒), 超时或连接全部失效时抛出异常
+        """
+        self.size = size
+        self.hosts = hosts
+        self.retries = retries
+        self.health_check_interval = health_check_interval
+        self.time_out = time_out
+        self.selector = selector
+        self.cache = cache
+        # 指定了 hosts 时只用这几台, 不跟随 selector 的排名
+        self.fixed_hosts = hosts is not None
+        self.acquire_timeout = acquire_timeout
+
+        self.idle = queue.Queue()
+        self.clients = []
+        self.lock = threading.Lock()
+        self.next_host = 0
+        self.stop_event = threading.Event()
+        self.health_thread = None
+        self.executor = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        if self.hosts is None:
+            if self.selector is None:
+                self.selector = default_selector()
+            self.hosts = self.selector.rank(self.size)
+        if not self.hosts:
+            raise Exception("no available server")
+
+        for _ in range(self.size):
+            client = self._new_client()
+            if client is None:
+                continue
+            self.clients.append(client)
+            self.idle.put(client)
+
+        if not self.clients:
+            raise Exception("no available server")
+
+        self.executor = ThreadPoolExecutor(max_workers=len(self.clients))
+        if self.health_check_interval > 0:
+            self.stop_event.clear()
+            self.health_thread = threading.Thread(target=self._health_check_loop, daemon=True)
+            self.health_thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            self._disconnect(client)
+        self.idle = queue.Queue()
+
+    def _new_client(self):
+        """
+        按顺序轮流尝试各台服务器, 返回一条已登录的连接, 全部失败返回 None
+        """
+        if self.selector is not None and not self.fixed_hosts:
+            # 按最新的排名挑选, 评分变差的服务器自然会被换掉
+            hosts = self.selector.rank(self.size)
+            if hosts:
+                self.hosts = hosts
+        for _ in range(len(self.hosts)):
+            with self.lock:
+                host = self.hosts[self.next_host % len(self.hosts)]
+                self.next_host += 1
+            client = TdxClient(heartbeat=True, raise_exception=True, cache=self.cache)
+            try:
+                client.connect(host[1], host[2], self.time_out)
+                if client.login():
+                    return client
+            except Exception as e:
+                log.debug("pool connect %s:%d failed: %s" % (host[1], host[2], e))
+            self._disconnect(client)
+        return None
+
+    def _disconnect(self, client):
+        try:
+            client.disconnect()
+        except Exception as e:
+            log.debug(str(e))
+
+    def _replace(self, client):
+        """
+        用一条新连接替换坏掉的连接
+        """
+        self._disconnect(client)
+        new_client = self._new_client()
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+            if new_client is not None:
+                self.clients.append(new_client)
+        if new_client is None:
+            log.error("replace broken connection failed")
+        return new_client
+
+    def _acquire(self):
+        """
+        取出一条空闲连接; 等待期间连接全部失效(替换失败)或等待超时时抛出异常, 不会一直阻塞
+        """
+        deadline = time.time() + self.acquire_timeout
+        while True:
+            if not self.clients:
+                raise Exception("no available connection")
+            try:
+                return self.idle.get(timeout=max(min(ACQUIRE_POLL_INTERVAL, deadline - time.time()), 0))
+            except queue.Empty:
+                if time.time() >= deadline:
+                    raise Exception("no available connection")
+
+    @contextmanager
+    def connection(self):
+        """
+        借出一条空闲连接, 用完后自动归还; 传输层出错的连接会被替换, 其余的错误原样抛出, 连接照常归还
+        """
+        client = self._acquire()
+        try:
+            yield client
+        except Exception as e:
+            if is_transport_error(e):
+                if self.selector is not None:
+                    self.selector.record(client.ip, client.port, None)
+                client = self._replace(client)
+            raise
+        finally:
+            if client is not None:
+                self.idle.put(client)
+
+    def _health_check_loop(self):
+        while not self.stop_event.wait(self.health_check_interval):
+            self.health_check()
+
+    def health_check(self):
+        """
+        对当前空闲的连接发送心跳包, 失败的连接会被替换; 指定了 selector 时, 评分明显变差的服务器上的连接也会被替换
+        """
+        checked = []
+        while True:
+            try:
+                checked.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for client in checked:
+            try:
+                start_time = time.time()
+                if client.call(server.HeartBeat()) is None:
+                    raise Exception("heartbeat no response")
+                if self.selector is not None:
+                    self.selector.record(client.ip, client.port, time.time() - start_time)
+                    if not self.fixed_hosts and self.selector.is_degraded(client.ip, client.port):
+                        raise Exception("server %s:%d degraded" % (client.ip, client.port))
+            except Exception as e:
+                log.debug("health check failed: %s" % e)
+                client = self._replace(client)
+            if client is not None:
+                self.idle.put(client)
+
+    def run(self, func):
+        """
+        在一条连接上执行 func(client), 传输层出错时换一条连接重试, 其余的错误直接抛出
+        """
+        error = None
+        for _ in range(self.retries + 1):
+            try:
+                with self.connection() as client:
+                    return func(client)
+            except Exception as e:
+                if not is_transport_error(e):
+                    raise
+                error = e
+                log.debug("pool call failed: %s" % e)
+        raise error
+
+    def call(self, parser: BaseParser):
+        return self.run(lambda client: client.call(parser))
+
+    def map(self, parser_factory, items):
+        """
+        对每个 item 调用 parser_factory(item) 生成请求, 分摊到各条连接上并行执行
+
+        :return: 与 items 顺序一致的结果列表
+        """
+        return self._fan_out([lambda client, item=item: client.call(parser_factory(item)) for item in items])
+
+    def _fan_out(self, tasks):
+        if self.executor is None:
+            raise Exception("pool not opened")
+        futures = [self.executor.submit(self.run, task) for task in tasks]
+        return [future.result() for future in futures]
+
+    def get_security_bars(self, stocks: Iterable[tuple[MARKET, str]], kline_type: KLINE_TYPE, start, count, columnar=False):
+        """
+        :param stocks: [(market, code), ...]
+        :return: 与 stocks 顺序一致的 k 线列表
+        """
+        return self._fan_out([
+            lambda client, market=market, code=code: client.get_security_bars(market, code, kline_type, start, count, columnar=columnar)
+            for (market, code) in stocks
+        ])
+
+    def get_transaction(self, stocks: Iterable[tuple[MARKET, str]], columnar=False, as_arrays=False):
+        return self._fan_out([
+            lambda client, market=market, code=code: client.get_transaction(market, code, columnar=columnar, as_arrays=as_arrays)
+            for (market, code) in stocks
+        ])
+
+    def get_company_info(self, stocks: Iterable[tuple[MARKET, str]]):
+        return self._fan_out([
+            lambda client, market=market, code=code: client.get_company_info(market, code)
+            for (market, code) in stocks
+        ])
@@ -0,0 +1,327 @@
+import json
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+from typing import Iterable
+
+import numpy as np
+
+from const import KLINE_TYPE, MARKET
+from tdxClientPool import TdxClientPool
+from utils.fast_decode import HISTORY_TRANSACTION_DTYPE
+from utils.log import log
+from utils.paging import join_pages
+
+# 交易日历取自上证指数的日线
+CALENDAR_INDEX = (MARKET.SH, '999999')
+MANIFEST_FILE = 'manifest.jsonl'
+PARTITION_EXT = '.npz'
+DEFAULT_PROGRESS_INTERVAL = 10.0
+
+
+def trading_days(pool: TdxClientPool, start: date, end: date, index=CALENDAR_INDEX) -> list[date]:
+    """
+    用指数日线推出交易日历: 指数有 K 线的日子就是交易日
+    :return: [start, end] 内的交易日, 从早到晚
+    """
+    first = np.datetime64(start, 'm')
+    market, code = index
+
+    def fetch(client):
+        # 从最新往前翻页, 翻到 start 之前为止
+        return join_pages(client.iter_security_bars(market, code, KLINE_TYPE.DAY_K, 0, None, as_arrays=True,
+                                                    stop=lambda part: part['datetime'][0] <= first))
+
+    bars = pool.run(fetch)
+    if len(bars) == 0:
+        return []
+    days = np.unique(bars['datetime'].astype('datetime64[D]'))
+    days = days[(days >= np.datetime64(start, 'D')) & (days <= np.datetime64(end, 'D'))]
+    return days.astype(object).tolist()
+
+
+def _day_key(day: date) -> str:
+    return day.strftime('%Y%m%d')
+
+
+def _member(market: MARKET, code: str) -> str:
+    return '%s.%s' % (market.name, code)
+
+
+class _PartitionWriter():
+    """
+    往一天的分区里追加成员
+
+    不在原文件上追加: zip 的目录在文件末尾, 追加时原来的目录先被覆盖, 中途退出会丢掉已经完成的成员.
+    这里先把原有的成员复制到临时文件, 新成员也写进临时文件, close 时再整体替换原文件;
+    中途退出只留下一个临时文件, 原分区不受影响.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old = None
+        if os.path.exists(path):
+            try:
+                old = zipfile.ZipFile(path, 'r')
+            except zipfile.BadZipFile:
+                # 分区被外部损坏, 原文件留作备查; 清单里的任务已经在 _reconcile 里改为重新拉取
+                log.warning("partition %s is broken, moved aside" % path)
+                os.replace(path, path + '.broken')
+
+        # 上次中途退出留下的临时文件直接覆盖
+        self.zip = zipfile.ZipFile(self.tmp_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # 已有的成员名(不带 .npy)
+        self.members = set()
+        if old is not None:
+            with old:
+                for info in old.infolist():
+                    self.zip.writestr(info, old.read(info))
+                    self.members.add(info.filename[:-len('.npy')])
+
+    def write(self, name: str, ticks: np.ndarray):
+        with self.zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, ticks, allow_pickle=False)
+        self.members.add(name)
+
+    def close(self):
+        self.zip.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class TickBackfill():
+    """
+    多日历史分笔回补
+
+    把 [start, end] 内的交易日(见 trading_days, 非交易日直接跳过)和证券列表展开成 (证券, 日期) 任务,
+    分摊到连接池的各条连接上并行拉取, 每个任务内部仍按 2000 条一页往前翻. 每个交易日一个分区文件:
+
+        root/<年>/<YYYYMMDD>.npz
+
+    分区是标准的 npz(zip 压缩), 每只证券一个成员, 键为 "SH.600000", 内容是
+    fast_decode.HISTORY_TRANSACTION_DTYPE 结构化数组, np.load 直接可读. 分区不在原地追加, 而是写好新文件后
+    整体替换(见 _PartitionWriter). 一天的任务全部结束并替换分区后, 才把这一天完成的任务写入清单(manifest),
+    重新运行时跳过清单里的任务, 所以扩大日期范围或者证券列表都只补缺的部分; 清单里有、分区里却没有的任务会重新拉取:
+
+        with TdxClientPool(8) as pool:
+            stats = TickBackfill(pool, 'ticks', date(2024, 1, 1), date(2024, 6, 30), stocks).run()
+
+    当天的分笔要收盘后才完整, 只回补到昨天.
+    """
+
+    def __init__(self, pool: TdxClientPool, root, start: date, end: date, stocks: Iterable[tuple[MARKET, str]],
+                 calendar: list[date] = None, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+        """
+        :param stocks: [(market, code), ...]
+        :param calendar: 交易日列表, 为 None 时用 trading_days 从指数日线推出
+        :param progress_interval: 输出进度的间隔(秒)
+        """
+        self.pool = pool
+        self.root = root
+        self.start = start
+        self.end = min(end, date.fromordinal(date.today().toordinal() - 1))
+        self.stocks = list(stocks)
+        self.calendar = calendar
+        self.progress_interval = progress_interval
+
+        self.failed = []
+        self.units_done = 0
+        self.units_total = 0
+        self.ticks_done = 0
+        self.start_time = None
+
+    def partition_path(self, day: date):
+        key = _day_key(day)
+        return os.path.join(self.root, key[:4], key + PARTITION_EXT)
+
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def load_manifest(self):
+        """
+        :return: {(日期, market, code): 分笔条数}
+        """
+        done = {}
+        if not os.path.exists(self._manifest_path()):
+            return done
+        with open(self._manifest_path(), 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 最后一行可能在写入时被中断
+                    continue
+                done[(entry['date'], MARKET[entry['market']], entry['code'])] = entry['count']
+        return done
+
+    def read(self, market: MARKET, code: str, day: date) -> np.ndarray:
+        """
+        读取本地保存的一天的分笔, 没有时返回空数组
+        """
+        path = self.partition_path(day)
+        if os.path.exists(path):
+            with np.load(path) as partition:
+                name = _member(market, code)
+                if name in partition.files:
+                    return partition[name]
+        return np.empty(0, dtype=HISTORY_TRANSACTION_DTYPE)
+
+    def read_day(self, day: date) -> dict:
+        """
+        :return: {(market, code): 分笔}
+        """
+        path = self.partition_path(day)
+        if not os.path.exists(path):
+            return {}
+        with np.load(path) as partition:
+            return {(MARKET[name.split('.')[0]], name.split('.')[1]): partition[name] for name in partition.files}
+
+    def partition_members(self, day: date) -> set:
+        """
+        分区里已有的成员名(不带 .npy), 分区不存在或已损坏时返回空集合
+        """
+        path = self.partition_path(day)
+        if not os.path.exists(path):
+            return set()
+        try:
+            with zipfile.ZipFile(path, 'r') as partition:
+                return {name[:-len('.npy')] for name in partition.namelist()}
+        except zipfile.BadZipFile:
+            return set()
+
+    def _open_partition(self, day: date) -> _PartitionWriter:
+        return _PartitionWriter(self.partition_path(day))
+
+    def _reconcile(self, done: dict, days: list[date]):
+        """
+        清单里有分笔、分区里却没有的任务(分区被删除或损坏)从 done 里去掉, 重新拉取
+        """
+        for day in days:
+            key = _day_key(day)
+            expected = [(market, code) for market, code in self.stocks if done.get((key, market, code))]
+            if not expected:
+                continue
+            members = self.partition_members(day)
+            for market, code in expected:
+                if _member(market, code) not in members:
+                    log.warning("backfill %s %s %s missing from partition, refetching" % (market.name, code, key))
+                    del done[(key, market, code)]
+
+    def _fetch(self, market: MARKET, code: str, day: date):
+        return self.pool.run(lambda client: client.get_history_transaction(market, code, day, as_arrays=True))
+
+    def run(self):
+        """
+        :return: stats()
+        """
+        os.makedirs(self.root, exist_ok=True)
+        calendar = self.calendar
+        if calendar is None:
+            calendar = trading_days(self.pool, self.start, self.end)
+        days = [day for day in calendar if self.start <= day <= self.end]
+
+        done = self.load_manifest()
+        self._reconcile(done, days)
+        todo = deque()
+        pending = {}
+        for day in days:
+            units = [(day, market, code) for market, code in self.stocks if (_day_key(day), market, code) not in done]
+            if units:
+                todo.extend(units)
+                pending[day] = len(units)
+
+        self.failed = []
+        self.units_done = 0
+        self.units_total = len(todo)
+        self.ticks_done = 0
+        self.start_time = time.time()
+        last_report = self.start_time
+
+        # 任务按日期排序, 同一时刻最多有相邻的两三天的分区处于打开状态
+        partitions = {}
+        # {日期: 分区里已有的成员}
+        members = {}
+        # {日期: [已完成任务的清单条目]}, 分区关闭后一起写入清单
+        entries = {}
+        inflight = {}
+        with open(self._manifest_path(), 'a') as manifest, ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            def finish_unit(day, market, code, count=None, failed=False):
+                if not failed:
+                    entries.setdefault(day, []).append({'date': _day_key(day), 'market': market.name, 'code': code, 'count': count})
+                self.units_done += 1
+                pending[day] -= 1
+                if pending[day] > 0:
+                    return
+                # 失败的任务不记入清单, 下次运行时重新拉取
+                partitions.pop(day).close()
+                members.pop(day)
+                for entry in entries.pop(day, []):
+                    manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+
+            try:
+                while todo or inflight:
+                    while todo and len(inflight) < self.pool.size * 2:
+                        day, market, code = todo.popleft()
+                        if day not in partitions:
+                            partitions[day] = self._open_partition(day)
+                            members[day] = partitions[day].members
+                        if _member(market, code) in members[day]:
+                            # 上次运行写完了分区但没来得及写清单
+                            finish_unit(day, market, code)
+                            continue
+                        inflight[executor.submit(self._fetch, market, code, day)] = (day, market, code)
+
+                    if not inflight:
+                        continue
+                    finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        day, market, code = inflight.pop(future)
+                        try:
+                            ticks = future.result()
+                        except Exception as e:
+                            log.error("backfill %s %s %s failed: %s" % (market.name, code, _day_key(day), e))
+                            self.failed.append((market, code, day))
+                            finish_unit(day, market, code, failed=True)
+                            continue
+
+                        count = 0 if ticks is None else len(ticks)
+                        if count > 0:
+                            partitions[day].write(_member(market, code), ticks)
+                            self.ticks_done += count
+                        # 停牌的日子没有分笔, 也记入清单, 下次不再请求
+                        finish_unit(day, market, code, count)
+
+                    if time.time() - last_report >= self.progress_interval:
+                        last_report = time.time()
+                        self.report()
+            finally:
+                # 中途出错时也把已写完的成员换入分区, 下次运行时直接记入清单
+                for partition in partitions.values():
+                    partition.close()
+
+        stats = self.stats()
+        self.report()
+        return stats
+
+    def stats(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return {
+            'units': self.units_done,
+            'units_total': self.units_total,
+            'ticks': self.ticks_done,
+            'failed': len(self.failed),
+            'elapsed': elapsed,
+            'units_per_sec': self.units_done / elapsed if elapsed > 0 else 0,
+            'ticks_per_sec': self.ticks_done / elapsed if elapsed > 0 else 0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        log.info("tick backfill %d/%d units, %d ticks, %d failed, %.1f units/s, %.0f ticks/s" % (
+            stats['units'], stats['units_total'], stats['ticks'], stats['failed'],
+            stats['units_per_sec'], stats['ticks_per_sec']))
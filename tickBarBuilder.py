@@ -0,0 +1,302 @@
+import threading
+import time
+from datetime import date
+from typing import Iterable
+
+import numpy as np
+
+from const import MARKET
+from parser import stock
+from tdxClient import MAX_TRANSACTION_COUNT
+from tdxClientPool import TdxClientPool
+from utils.fast_decode import BAR_DTYPE, TRANSACTION_DTYPE
+from utils.log import log
+from utils.resample import AFTERNOON_OPEN, MORNING_CLOSE, MORNING_OPEN, SESSION_MINUTES, reduce_segments, session_time
+
+DEFAULT_BUILDER_INTERVAL = 1.0
+# 每轮只拉最新的这么多笔, 1 秒一轮时足够覆盖两轮之间的成交
+DEFAULT_TAIL_SIZE = 200
+# 用已处理的最后几笔在新拉取的一页里定位, 几笔连续相同的概率可以忽略
+MATCH_SIZE = 8
+# 价格单位是厘, 成交量单位是手, 成交额按每手 100 股估算
+PRICE_SCALE = 1000
+LOT_SIZE = 100
+
+
+def tick_session_minutes(minutes: np.ndarray) -> np.ndarray:
+    """
+    分笔的时间(当天的分钟数) -> 所属的 1 分钟线在交易时段里的序号(1 ~ 240)
+
+    09:30 的成交属于 09:31 那根 K 线; 集合竞价并入第一根, 11:30 和 15:00 的成交并入上午、下午的最后一根
+    """
+    minutes = minutes.astype(np.int64)
+    morning = MORNING_CLOSE - MORNING_OPEN
+    return np.where(minutes < AFTERNOON_OPEN,
+                    np.clip(minutes - MORNING_OPEN + 1, 1, morning),
+                    np.clip(minutes - AFTERNOON_OPEN + morning + 1, morning + 1, SESSION_MINUTES))
+
+
+def ticks_to_bars(ticks: np.ndarray, day: date) -> np.ndarray:
+    """
+    把一批分笔(TRANSACTION_DTYPE, 按时间升序)合成 1 分钟线, 时间为 K 线的结束时间
+    """
+    offsets = tick_session_minutes(ticks['minute'])
+    single = np.empty(len(ticks), dtype=BAR_DTYPE)
+    single['datetime'] = np.datetime64(day, 'm') + session_time(offsets).astype('timedelta64[m]')
+    for name in ('open', 'close', 'high', 'low'):
+        single[name] = ticks['price']
+    single['vol'] = ticks['vol']
+    single['amount'] = ticks['price'].astype(np.float64) / PRICE_SCALE * ticks['vol'] * LOT_SIZE
+    single['upCount'] = 0
+    single['downCount'] = 0
+    return reduce_segments(single, offsets)
+
+
+class MinuteRing():
+    """
+    定长的 1 分钟线环形缓冲区, 满了以后覆盖最早的 K 线
+    """
+
+    def __init__(self, capacity=SESSION_MINUTES):
+        self.bars = np.zeros(capacity, dtype=BAR_DTYPE)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def last(self):
+        return self.bars[self._slot(self.size - 1)].copy() if self.size else None
+
+    def push(self, bars: np.ndarray):
+        """
+        合并一批按时间升序的 1 分钟线; 与最后一根时间相同的 K 线并入最后一根
+        """
+        if len(bars) == 0:
+            return
+        if self.size and bars['datetime'][0] == self.bars['datetime'][self._slot(self.size - 1)]:
+            last = self.bars[self._slot(self.size - 1)]
+            first = bars[0]
+            last['close'] = first['close']
+            last['high'] = max(last['high'], first['high'])
+            last['low'] = min(last['low'], first['low'])
+            last['vol'] += first['vol']
+            last['amount'] += first['amount']
+            bars = bars[1:]
+
+        bars = bars[-self.capacity:]
+        slots = self._slot(self.size + np.arange(len(bars)))
+        self.bars[slots] = bars
+        overflow = max(self.size + len(bars) - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + len(bars), self.capacity)
+
+    def to_array(self) -> np.ndarray:
+        """
+        :return: 按时间升序的副本
+        """
+        return self.tail(self.size)
+
+    def tail(self, count: int) -> np.ndarray:
+        """
+        :return: 最后 count 根 K 线的副本
+        """
+        count = min(count, self.size)
+        return self.bars[self._slot(np.arange(self.size - count, self.size))]
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+
+class _SymbolState():
+
+    def __init__(self, capacity):
+        self.seen = 0
+        self.tail = np.empty(0, dtype=TRANSACTION_DTYPE)
+        self.ring = MinuteRing(capacity)
+
+
+class TickBarBuilder():
+    """
+    用当日分笔实时合成 1 分钟线
+
+    每只股票记下已经处理过的分笔数, 每轮只拉最新的一页(stock.Transaction(start=0, count=tail_size)),
+    用已处理的最后几笔在这一页里定位, 之后的就是新成交, 合成 1 分钟线后并入这只股票的环形缓冲区.
+    第一次拉取、以及两轮之间的新成交超过一页而定位不到时, 分页拉取当天的全部分笔, 跳过已处理的部分.
+
+        builder = TickBarBuilder(pool, [(MARKET.SH, '600519')]).start()
+        builder.bars(MARKET.SH, '600519')
+
+    不必再另外轮询 1 分钟线. 不传 pool 时可以自己拉取分笔, 再交给 feed().
+    """
+
+    def __init__(self, pool: TdxClientPool = None, stocks: Iterable[tuple[MARKET, str]] = (), interval=DEFAULT_BUILDER_INTERVAL,
+                 tail_size=DEFAULT_TAIL_SIZE, capacity=SESSION_MINUTES, day: date = None):
+        """
+        :param stocks: [(market, code), ...]
+        :param interval: 拉取周期(秒)
+        :param tail_size: 每轮拉取的分笔数, 不能超过服务器的上限 MAX_TRANSACTION_COUNT
+        :param capacity: 每只股票保留的 1 分钟线数
+        :param day: K 线的日期, 默认为今天; poll() 拉取的是当天的分笔, 日期不是今天时会先换日
+        """
+        self.pool = pool
+        self.stocks = list(stocks)
+        self.interval = interval
+        self.tail_size = min(tail_size, MAX_TRANSACTION_COUNT)
+        self.capacity = capacity
+        self.day = day or date.today()
+
+        self.states = {}
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.full_fetches = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            start_time = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                log.error("tick bar poll failed: %s", e)
+            self.stop_event.wait(max(self.interval - (time.time() - start_time), 0))
+
+    def _state(self, market: MARKET, code: str) -> _SymbolState:
+        key = (market, code)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = _SymbolState(self.capacity)
+        return state
+
+    def reset(self, day: date = None):
+        """
+        换日: 清空全部股票的分笔进度和 K 线
+        """
+        with self.lock:
+            self.day = day or date.today()
+            self.states = {}
+
+    def _roll_day(self):
+        """
+        日期变了就换日, 之后的 K 线用新的日期
+        :return: 是否换了日
+        """
+        today = date.today()
+        if today == self.day:
+            return False
+        log.info("tick bar day rolled from %s to %s" % (self.day, today))
+        self.reset(today)
+        return True
+
+    def new_ticks(self, market: MARKET, code: str, page: np.ndarray, complete: bool):
+        """
+        :param page: 最新的一页分笔
+        :param complete: 这一页是否就是当天的全部分笔
+        :return: 还没处理过的分笔, 无法定位时返回 None, 需要拉取全部分笔
+        """
+        state = self._state(market, code)
+        if complete:
+            # 比已处理的还少, 说明已经换日
+            return page[state.seen:] if len(page) >= state.seen else None
+        if state.seen == 0:
+            return None
+
+        tail = state.tail
+        for j in np.flatnonzero(page == tail[0])[::-1]:
+            if j + len(tail) <= len(page) and (page[j: j + len(tail)] == tail).all():
+                return page[j + len(tail):]
+        return None
+
+    def feed(self, market: MARKET, code: str, ticks: np.ndarray):
+        """
+        处理一批新的分笔(TRANSACTION_DTYPE, 紧接在已处理的分笔之后)
+        :return: 有更新的 1 分钟线, 第一根可能是并入了新成交的上一根
+        """
+        state = self._state(market, code)
+        if len(ticks) == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        minute_bars = ticks_to_bars(ticks, self.day)
+        with self.lock:
+            state.ring.push(minute_bars)
+            state.seen += len(ticks)
+            state.tail = np.concatenate([state.tail, ticks])[-MATCH_SIZE:]
+            bars = state.ring.tail(len(minute_bars))
+        for listener in self.listeners:
+            try:
+                listener(market, code, bars)
+            except Exception as e:
+                log.error("tick bar listener failed: %s", e)
+        return bars
+
+    def _fetch_all(self, market: MARKET, code: str):
+        self.full_fetches += 1
+        return self.pool.run(lambda client: client.get_transaction(market, code, as_arrays=True))
+
+    def poll(self):
+        """
+        每只股票拉取一页最新分笔并更新 K 线
+        :return: {(market, code): 有更新的 1 分钟线}
+        """
+        # 拉取的总是当天的分笔, 跨日运行时先换日, 不必等调用方 reset()
+        self._roll_day()
+        pages = self.pool.map(lambda key: stock.Transaction(key[0], key[1], 0, self.tail_size, as_arrays=True), self.stocks)
+        updated = {}
+        for (market, code), page in zip(self.stocks, pages):
+            if page is None:
+                continue
+            ticks = self.new_ticks(market, code, page, len(page) < self.tail_size)
+            if ticks is None:
+                full = self._fetch_all(market, code)
+                state = self._state(market, code)
+                if len(full) < state.seen:
+                    log.info("transaction of %s %s restarted, rebuilding bars" % (market.name, code))
+                    # 分笔变少多半是已经换日; 日期没变(例如换了台服务器)时只重建这只股票
+                    if not self._roll_day():
+                        with self.lock:
+                            self.states[(market, code)] = _SymbolState(self.capacity)
+                    state = self._state(market, code)
+                ticks = full[state.seen:]
+            bars = self.feed(market, code, ticks)
+            if len(bars):
+                updated[(market, code)] = bars
+        return updated
+
+    def on_bar(self, callback):
+        """
+        注册回调, 每次有新成交时以 (market, code, 有更新的 1 分钟线) 调用
+        """
+        self.listeners.append(callback)
+        return callback
+
+    def bars(self, market: MARKET, code: str) -> np.ndarray:
+        """
+        :return: 这只股票的 1 分钟线, BAR_DTYPE, 按时间升序
+        """
+        with self.lock:
+            state = self.states.get((market, code))
+            if state is None:
+                return np.empty(0, dtype=BAR_DTYPE)
+            return state.ring.to_array()
+
+    def last_bar(self, market: MARKET, code: str):
+        with self.lock:
+            state = self.states.get((market, code))
+            return None if state is None else state.ring.last()
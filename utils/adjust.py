@@ -0,0 +1,235 @@
+# coding=utf-8
+
+"""
+复权
+
+company_info.XDXR 里 category 为 1 (除权除息) 的记录给出每 10 股的分红(fenhong)、送转股(songzhuangu)、
+配股(peigu)和配股价(peigujia). 除权日的前收盘价按
+
+    除权前收 = (前收 * 10 - 分红 + 配股 * 配股价) / (10 + 配股 + 送转股)
+
+算出, 这一次除权的比例 ratio = 除权前收 / 前收. 把全部除权的 ratio 按日期累乘, 一根 K 线的复权因子就是:
+
+    前复权: 在它之后的全部 ratio 的乘积
+    后复权: 在它之前(含当天)的全部 ratio 的乘积的倒数
+
+AdjustFactors 保存除权日期、ratio 和累乘结果, 新的除权记录只在末尾追加, 不需要重算已有的部分;
+对 K 线复权只是一次 searchsorted 加一次乘法. 价格单位与 BAR_DTYPE 相同(厘), 复权后为浮点数.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from const import ADJUST, KLINE_TYPE, MARKET
+from parser import company_info
+from utils.fast_decode import BAR_DTYPE
+from utils.paging import join_pages
+
+# 价格的单位是厘
+PRICE_SCALE = 1000
+PRICE_FIELDS = ('open', 'close', 'high', 'low')
+ADJUSTED_BAR_DTYPE = np.dtype([(name, 'f8' if name in PRICE_FIELDS else BAR_DTYPE[name]) for name in BAR_DTYPE.names])
+FACTOR_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('ratio', 'f8'),
+])
+FACTOR_FILE_EXT = '.factors'
+# XDXR 里的除权除息
+XDXR_DIVIDEND = 1
+
+
+def dividend_events(xdxrs: list) -> np.ndarray:
+    """
+    从 company_info.XDXR 的结果里取出除权除息记录, 同一天的多条记录合并
+    :return: 按日期升序的结构化数组, 字段为 date, fenhong, peigujia, songzhuangu, peigu
+    """
+    merged = {}
+    for item in xdxrs or []:
+        if item['name'] != company_info.XDXR_CATEGORY_MAPPING[XDXR_DIVIDEND]:
+            continue
+        day = np.datetime64(item['date'].date(), 'D')
+        fenhong, peigujia, songzhuangu, peigu = merged.get(day, (0.0, 0.0, 0.0, 0.0))
+        merged[day] = (
+            fenhong + (item['fenhong'] or 0),
+            max(peigujia, item['peigujia'] or 0),
+            songzhuangu + (item['songzhuangu'] or 0),
+            peigu + (item['peigu'] or 0),
+        )
+    events = np.empty(len(merged), dtype=[('date', 'datetime64[D]'), ('fenhong', 'f8'), ('peigujia', 'f8'),
+                                          ('songzhuangu', 'f8'), ('peigu', 'f8')])
+    for i, day in enumerate(sorted(merged)):
+        events[i] = (day, *merged[day])
+    return events
+
+
+def event_ratios(events: np.ndarray, bars: np.ndarray) -> np.ndarray:
+    """
+    用除权日前最后一根 K 线的收盘价算出每次除权的 ratio; K 线里没有前收的除权(上市前的记录)ratio 为 1
+    """
+    dates = bars['datetime'].astype('datetime64[D]')
+    prev = np.searchsorted(dates, events['date'], side='left') - 1
+    close = bars['close'][np.maximum(prev, 0)].astype(np.float64) / PRICE_SCALE
+    pre_close = (close * 10 - events['fenhong'] + events['peigu'] * events['peigujia']) / \
+        (10 + events['peigu'] + events['songzhuangu'])
+    valid = (prev >= 0) & (close > 0) & (pre_close > 0)
+    return np.where(valid, pre_close / np.where(valid, close, 1), 1.0)
+
+
+class AdjustFactors():
+
+    def __init__(self, factors: np.ndarray = None):
+        """
+        :param factors: FACTOR_DTYPE, 按日期升序
+        """
+        self.factors = np.empty(0, dtype=FACTOR_DTYPE) if factors is None else factors
+        # cumulative[i] 为前 i 次除权的 ratio 之积
+        self.cumulative = np.concatenate([[1.0], np.cumprod(self.factors['ratio'])])
+
+    def __len__(self):
+        return len(self.factors)
+
+    @property
+    def last_date(self):
+        """
+        最后一次除权的日期, 没有时返回 None
+        """
+        return self.factors['date'][-1] if len(self.factors) > 0 else None
+
+    def append(self, factors: np.ndarray):
+        """
+        追加更晚的除权, 已有的累乘结果不变
+        """
+        if len(factors) == 0:
+            return
+        if len(self.factors) > 0 and factors['date'][0] <= self.factors['date'][-1]:
+            raise Exception("factors must be appended in date order")
+        self.factors = np.concatenate([self.factors, factors])
+        self.cumulative = np.concatenate([self.cumulative, self.cumulative[-1] * np.cumprod(factors['ratio'])])
+
+    def factor(self, datetimes: np.ndarray, adjust: ADJUST) -> np.ndarray:
+        """
+        :param datetimes: K 线的时间
+        :return: 每根 K 线的复权因子
+        """
+        # 除权日当天的 K 线已经是除权后的价格
+        prefix = self.cumulative[np.searchsorted(self.factors['date'], datetimes.astype('datetime64[D]'), side='right')]
+        if adjust is ADJUST.QFQ:
+            return self.cumulative[-1] / prefix
+        return 1.0 / prefix
+
+
+def adjust_bars(bars: np.ndarray, factors: AdjustFactors, adjust: ADJUST) -> np.ndarray:
+    """
+    :param bars: BAR_DTYPE, 按时间升序
+    :return: ADJUSTED_BAR_DTYPE, 价格字段乘上复权因子, 其余字段不变
+    """
+    adjusted = np.empty(len(bars), dtype=ADJUSTED_BAR_DTYPE)
+    factor = factors.factor(bars['datetime'], adjust)
+    for name in ADJUSTED_BAR_DTYPE.names:
+        adjusted[name] = bars[name] * factor if name in PRICE_FIELDS else bars[name]
+    return adjusted
+
+
+class AdjustEngine():
+    """
+    按证券缓存复权因子
+
+    因子在内存里按 (market, code) 缓存, 指定 root 时同时保存为 root/<market>/<code>.factors
+    (FACTOR_DTYPE 的原始字节, 与 BarStore 一样只在末尾追加). 每次 update 只计算比已有的最后一次除权更晚的记录;
+    除权日还没有 K 线的记录(已公告、未实施)先不计入, 等 K 线覆盖到除权日后再追加.
+
+        engine = AdjustEngine(client, 'factors')
+        bars = engine.adjust(MARKET.SH, '600000', bars, ADJUST.QFQ)
+    """
+
+    def __init__(self, client=None, root=None):
+        """
+        :param client: TdxClient 或 TdxClientPool, 用来查询 XDXR 和补取 K 线
+        :param root: 因子的保存目录, None 表示只缓存在内存里
+        """
+        self.client = client
+        self.root = root
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def path(self, market: MARKET, code: str):
+        return os.path.join(self.root, market.name, code + FACTOR_FILE_EXT)
+
+    def get_factors(self, market: MARKET, code: str) -> AdjustFactors:
+        """
+        已缓存的因子, 没有时返回空的 AdjustFactors
+        """
+        key = (market, code)
+        with self.lock:
+            factors = self.cache.get(key)
+            if factors is None:
+                factors = AdjustFactors()
+                if self.root is not None and os.path.exists(self.path(market, code)):
+                    factors = AdjustFactors(np.fromfile(self.path(market, code), dtype=FACTOR_DTYPE))
+                self.cache[key] = factors
+            return factors
+
+    def pending_events(self, market: MARKET, code: str, xdxrs: list) -> np.ndarray:
+        """
+        比已有的最后一次除权更晚的除权除息记录
+        """
+        events = dividend_events(xdxrs)
+        last = self.get_factors(market, code).last_date
+        return events if last is None else events[events['date'] > last]
+
+    def update(self, market: MARKET, code: str, xdxrs: list, bars: np.ndarray) -> AdjustFactors:
+        """
+        :param xdxrs: company_info.XDXR 的结果
+        :param bars: 日线, BAR_DTYPE, 需要包含最早的新除权日前的最后一根 K 线
+        """
+        factors = self.get_factors(market, code)
+        if len(bars) == 0:
+            return factors
+        events = self.pending_events(market, code, xdxrs)
+        events = events[events['date'] <= bars['datetime'][-1].astype('datetime64[D]')]
+        if len(events) == 0:
+            return factors
+
+        new_factors = np.empty(len(events), dtype=FACTOR_DTYPE)
+        new_factors['date'] = events['date']
+        new_factors['ratio'] = event_ratios(events, bars)
+        with self.lock:
+            factors.append(new_factors)
+            if self.root is not None:
+                path = self.path(market, code)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'ab') as f:
+                    f.write(new_factors.tobytes())
+        return factors
+
+    def _daily_bars(self, market: MARKET, code: str, since):
+        """
+        从最新往前翻日线, 翻到 since 之前的一根为止
+        """
+        fetch = lambda client: join_pages(client.iter_security_bars(
+            market, code, KLINE_TYPE.DAY_K, 0, None, as_arrays=True,
+            stop=lambda part: part['datetime'][0].astype('datetime64[D]') < since))
+        # TdxClientPool 借一条连接执行, TdxClient 直接执行
+        return self.client.run(fetch) if hasattr(self.client, 'run') else fetch(self.client)
+
+    def refresh(self, market: MARKET, code: str) -> AdjustFactors:
+        """
+        查询最新的 XDXR, 有新的除权时补取所需的日线并更新因子
+        """
+        xdxrs = self.client.call(company_info.XDXR(market, code))
+        events = self.pending_events(market, code, xdxrs)
+        # 已公告、还没到除权日的记录不需要补取 K 线
+        events = events[events['date'] <= np.datetime64('today', 'D')]
+        if len(events) == 0:
+            return self.get_factors(market, code)
+        return self.update(market, code, xdxrs, self._daily_bars(market, code, events['date'][0]))
+
+    def adjust(self, market: MARKET, code: str, bars: np.ndarray, adjust: ADJUST = ADJUST.QFQ, refresh=True) -> np.ndarray:
+        """
+        :param bars: BAR_DTYPE, 任意周期, 按时间升序
+        :param refresh: 为 False 时只用已缓存的因子, 不访问服务器
+        """
+        factors = self.refresh(market, code) if refresh and self.client is not None else self.get_factors(market, code)
+        return adjust_bars(bars, factors, adjust)
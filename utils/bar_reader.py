@@ -0,0 +1,171 @@
+#coding: utf-8
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.base_reader import BaseReader, TdxFileNotFoundException, TdxNotAssignVipdocPathException
+from utils.fast_decode import to_datetime64
+
+"""
+读取本地通达信 vipdoc 目录下的日线(.day)和分钟线(.lc1/.lc5)文件
+
+文件都是 32 字节定长记录, 读单个文件时用 np.memmap 把文件直接视作结构化数组, 不复制数据;
+读整个目录时逐个读入内存, 每个内存映射都占一个文件描述符, 几千个文件会超出进程的上限
+
+日线: vipdoc/sh/lday/sh600000.day
+    date(YYYYMMDD) open high low close(价格*100, 整数) amount(float) vol reserved
+分钟线: vipdoc/sh/minline/sh600000.lc1, vipdoc/sh/fzline/sh600000.lc5
+    date((year-2004)*2048 + month*100 + day) minutes(当日分钟数) open high low close amount(float) vol reserved
+"""
+
+
+class VipdocBarReader(BaseReader):
+
+    DTYPE = None
+    SUBDIR = None
+    EXT = None
+
+    def __init__(self, vipdoc_path=None):
+        self.vipdoc_path = vipdoc_path
+
+    def find_path(self, code, exchange):
+        """
+        :param code: 股票代码, 如 600000
+        :param exchange: 交易所, sh/sz/bj
+        """
+        if self.vipdoc_path is None:
+            raise TdxNotAssignVipdocPathException("please assign vipdoc path")
+        fname = os.path.join(self.vipdoc_path, exchange, self.SUBDIR, exchange + code + self.EXT)
+        if not os.path.exists(fname):
+            raise TdxFileNotFoundException("no tdx file found: " + fname)
+        return fname
+
+    def _resolve(self, code_or_file, exchange=None):
+        if exchange is None:
+            if not os.path.exists(code_or_file):
+                raise TdxFileNotFoundException("no tdx file found: " + code_or_file)
+            return code_or_file
+        return self.find_path(code_or_file, exchange)
+
+    def get_data(self, code_or_file, exchange=None) -> np.ndarray:
+        """
+        返回原始记录的结构化数组, 是文件的只读内存映射
+        :param code_or_file: 文件路径, 或者配合 exchange 使用的股票代码
+        """
+        fname = self._resolve(code_or_file, exchange)
+        count = os.path.getsize(fname) // self.DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=self.DTYPE)
+        return np.memmap(fname, dtype=self.DTYPE, mode='r', shape=(count,))
+
+    def get_df(self, code_or_file, exchange=None, coefficient=0.01):
+        """
+        :param coefficient: 整数价格的换算系数, 股票为 0.01, 基金/债券一般为 0.001
+        """
+        return self.to_df(self.get_data(code_or_file, exchange), coefficient)
+
+    def to_df(self, data, coefficient=0.01):
+        raise NotImplementedError('not yet')
+
+    def read_file(self, code_or_file, exchange=None) -> np.ndarray:
+        """
+        与 get_data 相同, 但把数据读入内存, 不占用文件描述符
+        """
+        return np.fromfile(self._resolve(code_or_file, exchange), dtype=self.DTYPE)
+
+    def read_dir(self, directory=None, max_workers=8):
+        """
+        并行读取整个目录, 如 vipdoc/sh/lday; 数据都读入内存, 文件读完即关闭
+
+        :param directory: 目录, 为 None 时读取 vipdoc 下所有市场对应的子目录
+        :return: {文件名(不含扩展名, 如 sh600000): 结构化数组}
+        """
+        if directory is None:
+            if self.vipdoc_path is None:
+                raise TdxNotAssignVipdocPathException("please assign vipdoc path")
+            directories = [os.path.join(self.vipdoc_path, exchange, self.SUBDIR) for exchange in os.listdir(self.vipdoc_path)]
+        else:
+            directories = [directory]
+
+        files = []
+        for d in directories:
+            if not os.path.isdir(d):
+                continue
+            files.extend(os.path.join(d, name) for name in os.listdir(d) if name.endswith(self.EXT))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            datas = executor.map(self.read_file, files)
+            return {os.path.basename(fname)[:-len(self.EXT)]: data for fname, data in zip(files, datas)}
+
+
+class DailyBarReader(VipdocBarReader):
+
+    DTYPE = np.dtype([
+        ('date', '<u4'),
+        ('open', '<u4'),
+        ('high', '<u4'),
+        ('low', '<u4'),
+        ('close', '<u4'),
+        ('amount', '<f4'),
+        ('vol', '<u4'),
+        ('reserved', '<u4'),
+    ])
+    SUBDIR = 'lday'
+    EXT = '.day'
+
+    def to_df(self, data, coefficient=0.01):
+        return pd.DataFrame({
+            'datetime': to_datetime64(data['date']),
+            'open': data['open'] * coefficient,
+            'high': data['high'] * coefficient,
+            'low': data['low'] * coefficient,
+            'close': data['close'] * coefficient,
+            'amount': data['amount'],
+            'vol': data['vol'],
+        })
+
+
+class MinBarReader(VipdocBarReader):
+
+    DTYPE = np.dtype([
+        ('date', '<u2'),
+        ('minutes', '<u2'),
+        ('open', '<f4'),
+        ('high', '<f4'),
+        ('low', '<f4'),
+        ('close', '<f4'),
+        ('amount', '<f4'),
+        ('vol', '<u4'),
+        ('reserved', '<u4'),
+    ])
+    SUBDIR = 'minline'
+    EXT = '.lc1'
+
+    def __init__(self, vipdoc_path=None, ext='.lc1'):
+        """
+        :param ext: .lc1 为 1 分钟线(minline 目录), .lc5 为 5 分钟线(fzline 目录)
+        """
+        super().__init__(vipdoc_path)
+        self.EXT = ext
+        self.SUBDIR = 'fzline' if ext == '.lc5' else 'minline'
+
+    def get_df(self, code_or_file, exchange=None):
+        """
+        分钟线文件里的价格已经是 float32 的实际价格, 不需要换算系数
+        """
+        return self.to_df(self.get_data(code_or_file, exchange))
+
+    def to_df(self, data):
+        # 与服务器分钟 K 线的日期编码相同: 低 16 位日期, 高 16 位分钟数
+        nums = data['date'].astype(np.int64) | (data['minutes'].astype(np.int64) << 16)
+        return pd.DataFrame({
+            'datetime': to_datetime64(nums, with_time=True),
+            'open': data['open'],
+            'high': data['high'],
+            'low': data['low'],
+            'close': data['close'],
+            'amount': data['amount'],
+            'vol': data['vol'],
+        })
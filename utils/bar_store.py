@@ -0,0 +1,99 @@
+# coding=utf-8
+
+"""
+本地 K 线存储
+
+每个 (market, code, kline_type) 一个文件, 文件内容就是 fast_decode.BAR_DTYPE 记录的原始字节,
+没有文件头, 所以可以直接 np.memmap 读取, 追加时也只需要写到文件末尾.
+
+目录结构: root/<kline_type>/<market>/<code>.bars
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from const import KLINE_TYPE, MARKET
+from utils.fast_decode import BAR_DTYPE
+from utils.resample import resample
+
+BAR_FILE_EXT = '.bars'
+
+
+class BarStore(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def path(self, market: MARKET, code: str, kline_type: KLINE_TYPE):
+        return os.path.join(self.root, kline_type.name, market.name, code + BAR_FILE_EXT)
+
+    def count(self, market: MARKET, code: str, kline_type: KLINE_TYPE) -> int:
+        path = self.path(market, code, kline_type)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // BAR_DTYPE.itemsize
+
+    def read(self, market: MARKET, code: str, kline_type: KLINE_TYPE, mmap=True) -> np.ndarray:
+        """
+        读取全部 K 线, 按时间从早到晚; mmap=True 时返回只读的内存映射, 不复制
+        """
+        count = self.count(market, code, kline_type)
+        if count == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        path = self.path(market, code, kline_type)
+        if mmap:
+            return np.memmap(path, dtype=BAR_DTYPE, mode='r', shape=(count,))
+        return np.fromfile(path, dtype=BAR_DTYPE, count=count)
+
+    def read_resampled(self, market: MARKET, code: str, source: KLINE_TYPE, target: KLINE_TYPE) -> np.ndarray:
+        """
+        用本地已存的 source 周期 K 线合成 target 周期, 不必单独下载 target 周期
+        """
+        return resample(self.read(market, code, source), source, target)
+
+    def last_datetime(self, market: MARKET, code: str, kline_type: KLINE_TYPE):
+        """
+        最后一根 K 线的时间, 没有数据时返回 None
+        """
+        count = self.count(market, code, kline_type)
+        if count == 0:
+            return None
+        with open(self.path(market, code, kline_type), 'rb') as f:
+            f.seek((count - 1) * BAR_DTYPE.itemsize)
+            last = np.frombuffer(f.read(BAR_DTYPE.itemsize), dtype=BAR_DTYPE)
+        return last['datetime'][0]
+
+    def append(self, market: MARKET, code: str, kline_type: KLINE_TYPE, bars: np.ndarray) -> int:
+        """
+        追加 K 线, 只写入不早于已存最后一根的部分
+
+        最后一根可能是盘中未走完的 K 线, 所以与它时间相同的那根会覆盖它
+        :return: 新增的 K 线数量
+        """
+        bars = np.asarray(bars, dtype=BAR_DTYPE)
+        path = self.path(market, code, kline_type)
+        with self.lock:
+            count = self.count(market, code, kline_type)
+            last = self.last_datetime(market, code, kline_type)
+            if last is not None:
+                bars = bars[bars['datetime'] >= last]
+            if len(bars) == 0:
+                return 0
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'r+b' if count else 'wb') as f:
+                replace_last = last is not None and bars['datetime'][0] == last
+                if replace_last:
+                    count -= 1
+                f.seek(count * BAR_DTYPE.itemsize)
+                f.write(bars.tobytes())
+                f.truncate()
+            return len(bars) - (1 if replace_last else 0)
+
+    def remove(self, market: MARKET, code: str, kline_type: KLINE_TYPE):
+        path = self.path(market, code, kline_type)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,187 @@
+# coding=utf-8
+
+"""
+板块成分的内存索引
+
+BlockReader 返回的是每个 (板块, 股票) 一条的平铺列表, "600519 属于哪些概念板块" 这类问题只能整表扫描.
+BlockIndex 把各个板块文件读进两张哈希表: 板块 -> 成分股, 股票 -> 所属板块, 成员、交集、并集查询
+都只是集合运算:
+
+    index = BlockIndex.from_source(FileSync('blocks', pool))
+    index.blocks_of('600519', BLOCK_FILE_TYPE.GN)
+    index.intersection('白酒', '沪深300')
+
+板块文件用 decode_blocks 解成 numpy 列, 每个不同的代码只 intern 一次, 再把 (板块, 股票) 直接写进两张表,
+不经过 "逗号拼接再拆开" 的字符串. 同一个代码在所有板块里共用一个字符串对象. save/load 用 pickle 保存
+整个索引(pickle 会保留对象共享), 重新加载时不用再解析板块文件.
+"""
+
+import os
+import pickle
+import sys
+
+import numpy as np
+
+from const import BLOCK_FILE_TYPE
+from utils.block_reader import _decode_codes, _read_bytes, decode_blocks
+
+# 板块格式的文件, tdxhy.cfg 是文本格式的行业对照表, 不在其中
+BLOCK_KINDS = (BLOCK_FILE_TYPE.DEFAULT, BLOCK_FILE_TYPE.ZS, BLOCK_FILE_TYPE.FG, BLOCK_FILE_TYPE.GN)
+INDEX_VERSION = 1
+
+_EMPTY = frozenset()
+_BLANK = frozenset(('', ))
+
+
+class BlockIndex():
+
+    def __init__(self):
+        # {板块名: frozenset(股票代码)}
+        self.blocks = {}
+        # {板块名: BLOCK_FILE_TYPE}
+        self.block_kinds = {}
+        # {板块名: 板块文件里的 block_type}
+        self.block_types = {}
+        # {股票代码: frozenset(板块名)}
+        self.code_blocks = {}
+        # add 之后、rebuild 之前的 {股票代码: [板块名]}
+        self._code_names = {}
+
+    @classmethod
+    def from_contents(cls, contents: dict):
+        """
+        :param contents: {BLOCK_FILE_TYPE: 板块文件内容}
+        """
+        index = cls()
+        for kind, content in contents.items():
+            if content is not None:
+                index.add(kind, content)
+        index.rebuild()
+        return index
+
+    @classmethod
+    def from_source(cls, source, kinds=BLOCK_KINDS):
+        """
+        :param source: FileSync(只在服务器上的文件变化时下载) 或者已连接的 TdxClient
+        """
+        if hasattr(source, 'sync_block_file'):
+            contents = {kind: source.sync_block_file(kind) for kind in kinds}
+        else:
+            contents = {kind: source.download_block_file(kind) for kind in kinds}
+        return cls.from_contents(contents)
+
+    def add(self, kind: BLOCK_FILE_TYPE, content):
+        """
+        加入一个板块文件, 之后需要调用 rebuild 更新 股票 -> 板块 的索引
+        """
+        blocknames, block_types, stock_counts, codes = decode_blocks(_read_bytes(content))
+        names = [sys.intern(name) for name in blocknames.tolist()]
+        # S7 代码补成 8 字节当作整数去重, 比按 str 排序快; 每个不同的代码只解码、intern 一次,
+        # 之后 (板块, 股票) 都用下标表示
+        keys, inverse, counts = np.unique(codes.astype('S8').view('<u8'), return_inverse=True, return_counts=True)
+        interned = [sys.intern(code) for code in _decode_codes(keys.view('S8')).tolist()]
+
+        # 板块 -> 股票: 代码本来就按板块顺序排列
+        codes = list(map(interned.__getitem__, inverse.tolist()))
+        end = 0
+        for name, block_type, count in zip(names, block_types.tolist(), stock_counts.tolist()):
+            start, end = end, end + count
+            members = frozenset(codes[start:end])
+            if '' in members:
+                members = members - _BLANK
+            # 不同文件里的同名板块合并成分股
+            old = self.blocks.get(name)
+            self.blocks[name] = members if old is None else old | members
+            self.block_kinds.setdefault(name, kind)
+            self.block_types.setdefault(name, block_type)
+
+        # 股票 -> 板块: 按代码的下标把所属板块排在一起, 每个代码只处理一次
+        owners = np.repeat(np.arange(len(names)), stock_counts)[np.argsort(inverse, kind='stable')]
+        owners = list(map(names.__getitem__, owners.tolist()))
+        code_names = self._code_names
+        end = 0
+        for code, count in zip(interned, counts.tolist()):
+            start, end = end, end + count
+            if code:
+                code_names.setdefault(code, []).extend(owners[start:end])
+
+    def rebuild(self):
+        code_blocks = self.code_blocks
+        for code, names in self._code_names.items():
+            old = code_blocks.get(code)
+            code_blocks[code] = frozenset(names) if old is None else old.union(names)
+        self._code_names = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, name):
+        return name in self.blocks
+
+    def codes_of(self, name: str) -> frozenset:
+        return self.blocks.get(name, _EMPTY)
+
+    def blocks_of(self, code: str, kind: BLOCK_FILE_TYPE = None) -> frozenset:
+        """
+        :param kind: 只返回这个板块文件里的板块, None 表示全部
+        """
+        names = self.code_blocks.get(code, _EMPTY)
+        if kind is None:
+            return names
+        return frozenset(name for name in names if self.block_kinds[name] is kind)
+
+    def contains(self, name: str, code: str) -> bool:
+        return code in self.blocks.get(name, _EMPTY)
+
+    def intersection(self, *names) -> frozenset:
+        """
+        同时属于全部给定板块的股票
+        """
+        if not names:
+            return _EMPTY
+        # 从最小的板块开始求交集
+        sets = sorted((self.codes_of(name) for name in names), key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def union(self, *names) -> frozenset:
+        """
+        属于任一给定板块的股票
+        """
+        return _EMPTY.union(*(self.codes_of(name) for name in names))
+
+    def common_blocks(self, *codes, kind: BLOCK_FILE_TYPE = None) -> frozenset:
+        """
+        全部给定股票都属于的板块
+        """
+        if not codes:
+            return _EMPTY
+        sets = sorted((self.blocks_of(code, kind) for code in codes), key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        state = {
+            'version': INDEX_VERSION,
+            'blocks': self.blocks,
+            'block_kinds': {name: kind.value for name, kind in self.block_kinds.items()},
+            'block_types': self.block_types,
+            'code_blocks': self.code_blocks,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != INDEX_VERSION:
+            raise Exception("unsupported block index version: %s" % state.get('version'))
+
+        index = cls()
+        index.blocks = state['blocks']
+        index.block_kinds = {name: BLOCK_FILE_TYPE(value) for name, value in state['block_kinds'].items()}
+        index.block_types = state['block_types']
+        index.code_blocks = state['code_blocks']
+        return index
@@ -1,10 +1,10 @@
 #coding: utf-8
 import struct
 from utils.base_reader import BaseReader
-from collections import OrderedDict
-import pandas as pd
+from utils.columnar import Columnar
+from utils.record_layout import decode_strings
+import numpy as np
 import os
-from io import BytesIO
 
 """
 参考这个 http://blog.csdn.net/Metal1/article/details/44352639
@@ -14,62 +14,115 @@ from io import BytesIO
 BlockReader_TYPE_FLAT = 0
 BlockReader_TYPE_GROUP = 1
 
+BLOCK_HEADER_SIZE = 384
+# 每个板块固定 400 个 7 字节的代码位, 实际个数由 stock_count 给出
+BLOCK_CODE_SLOTS = 400
+BLOCK_RECORD = np.dtype([
+    ('blockname', 'S9'),
+    ('stock_count', '<u2'),
+    ('block_type', '<u2'),
+    ('codes', 'S7', (BLOCK_CODE_SLOTS,)),
+])
+# blocknew.cfg 里每个自定义板块 120 字节: 板块名, 板块文件名
+CUSTOMER_BLOCK_RECORD = np.dtype([('blockname', 'S50'), ('block_type', 'S70')])
+
+
+def _read_bytes(fname):
+    if isinstance(fname, (bytes, bytearray, memoryview)):
+        return fname
+    with open(fname, "rb") as f:
+        return f.read()
+
+
+def _decode_codes(codes: np.ndarray, encoding='utf-8') -> np.ndarray:
+    """
+    S7 代码列整体转为 str; 代码都是 ASCII, 只有遇到异常数据时才逐个解码
+    """
+    try:
+        return codes.astype('U7')
+    except UnicodeDecodeError:
+        return decode_strings(codes, encoding)
+
+
+def _group_columns(blocknames, block_types, code_lists):
+    return Columnar.from_arrays({
+        'blockname': blocknames,
+        'block_type': block_types,
+        'stock_count': np.array([len(codes) for codes in code_lists], dtype='<u2'),
+        'code_list': np.array([",".join(codes) for codes in code_lists], dtype=object),
+    })
+
+
+def _to_records(columns: Columnar) -> list:
+    """
+    列转为逐行的 dict, 键的顺序与列的顺序相同
+    """
+    names = list(columns.keys())
+    return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
+
+
+def _flat_records(columns: Columnar) -> list:
+    """
+    平铺结果转为逐行的 dict; 行数是全部板块的代码数(十万级), 逐行构造 OrderedDict 比解析本身慢一个数量级,
+    这里固定四个键, 直接用 dict 字面量构造, 键的顺序不变
+    """
+    return [{'blockname': blockname, 'block_type': block_type, 'code_index': code_index, 'code': code}
+            for blockname, block_type, code_index, code in zip(
+                columns['blockname'].tolist(), columns['block_type'].tolist(),
+                columns['code_index'].tolist(), columns['code'].tolist())]
+
+
+def _records(columns: Columnar, result_type) -> list:
+    return _flat_records(columns) if result_type == BlockReader_TYPE_FLAT else _to_records(columns)
+
+
+def decode_blocks(data):
+    """
+    每个板块的 400 个代码位整体看成一个 S7 数组, 按 stock_count 取出有效的部分, 不再逐个切片
+    :param data: 板块文件内容
+    :return: (板块名, block_type, 每个板块的股票数, 全部板块的 S7 股票代码按板块顺序首尾相接, 尚未解码);
+        没有成分股的板块也在其中
+    """
+    (num, ) = struct.unpack_from("<H", data, BLOCK_HEADER_SIZE)
+    offset = BLOCK_HEADER_SIZE + 2
+    size = offset + num * BLOCK_RECORD.itemsize
+    if len(data) < size:
+        # 最后一个板块的代码位可能没有写满
+        padded = bytearray(size)
+        padded[:len(data)] = data
+        data = padded
+    records = np.frombuffer(data, dtype=BLOCK_RECORD, count=num, offset=offset)
+
+    stock_counts = np.minimum(records['stock_count'], BLOCK_CODE_SLOTS)
+    valid = np.arange(BLOCK_CODE_SLOTS) < stock_counts[:, None]
+    return decode_strings(records['blockname']), records['block_type'].copy(), stock_counts, records['codes'][valid]
+
+
 class BlockReader(BaseReader):
 
     def get_df(self, fname, result_type=BlockReader_TYPE_FLAT):
-        result = self.get_data(fname, result_type)
-        return pd.DataFrame(result)
+        return self.get_columnar(fname, result_type).to_df()
 
     def get_data(self, fname, result_type=BlockReader_TYPE_FLAT):
-
-        result = []
-
-        if type(fname) is not bytearray:
-            with open(fname, "rb") as f:
-                data = f.read()
-        else:
-            data = fname
-
-        pos = 384
-        (num, ) = struct.unpack("<H", data[pos: pos+2])
-        pos += 2
-        for i in range(num):
-            blockname_raw = data[pos: pos+9]
-            pos += 9
-            blockname = blockname_raw.decode("gbk", 'ignore').rstrip("\x00")
-            stock_count, block_type = struct.unpack("<HH", data[pos: pos+4])
-            pos += 4
-            block_stock_begin = pos
-            codes = []
-            for code_index in range(stock_count):
-                one_code = data[pos: pos+7].decode("utf-8", 'ignore').rstrip("\x00")
-                pos += 7
-
-                if result_type == BlockReader_TYPE_FLAT:
-                    result.append(
-                        OrderedDict([
-                            ("blockname", blockname),
-                            ("block_type", block_type),
-                            ("code_index", code_index),
-                            ("code", one_code),
-                        ])
-                    )
-                elif result_type == BlockReader_TYPE_GROUP:
-                    codes.append(one_code)
-
-            if result_type == BlockReader_TYPE_GROUP:
-                result.append(
-                    OrderedDict([
-                        ("blockname", blockname),
-                        ("block_type", block_type),
-                        ("stock_count", stock_count),
-                        ("code_list", ",".join(codes))
-                    ])
-                )
-
-            pos = block_stock_begin + 2800
-
-        return result
+        return _records(self.get_columnar(fname, result_type), result_type)
+
+    def get_columnar(self, fname, result_type=BlockReader_TYPE_FLAT) -> Columnar:
+        """
+        :param fname: 板块文件路径, 或者已经下载好的文件内容
+        """
+        blocknames, block_types, stock_counts, codes = decode_blocks(_read_bytes(fname))
+        codes = _decode_codes(codes)
+        if result_type == BlockReader_TYPE_GROUP:
+            bounds = np.cumsum(stock_counts)[:-1]
+            return _group_columns(blocknames, block_types, [part.tolist() for part in np.split(codes, bounds)])
+
+        block_index = np.repeat(np.arange(len(blocknames)), stock_counts)
+        return Columnar.from_arrays({
+            'blockname': blocknames[block_index],
+            'block_type': block_types[block_index],
+            'code_index': (np.arange(len(codes)) - np.repeat(np.cumsum(stock_counts) - stock_counts, stock_counts)).astype('<u2'),
+            'code': codes,
+        })
 
 
 """
@@ -80,62 +133,51 @@ class BlockReader(BaseReader):
 class CustomerBlockReader(BaseReader):
 
     def get_df(self, fname, result_type=BlockReader_TYPE_FLAT):
-        result = self.get_data(fname, result_type)
-        return pd.DataFrame(result)
+        return self.get_columnar(fname, result_type).to_df()
 
     def get_data(self, fname, result_type=BlockReader_TYPE_FLAT):
+        return _records(self.get_columnar(fname, result_type), result_type)
 
-        result = []
+    def get_columnar(self, fname, result_type=BlockReader_TYPE_FLAT) -> Columnar:
 
         if not os.path.isdir(fname):
             raise Exception('not a directory')
 
-        block_file = '/'.join([fname,'blocknew.cfg'])
+        block_file = os.path.join(fname, 'blocknew.cfg')
 
         if not os.path.exists(block_file):
             raise Exception('file not exists')
 
-        block_data = open(block_file,'rb').read()
-
-        pos = 0
-        result = []
-        # print(block_data.decode('gbk','ignore'))
-        while pos < len(block_data):
-            n1 = block_data[pos:pos + 50].decode('gbk', 'ignore').rstrip("\x00")
-            n2 = block_data[pos + 50:pos + 120].decode('gbk', 'ignore').rstrip("\x00")
-            pos = pos + 120
-            
-            n1 = n1.split('\x00')[0]
-            n2 = n2.split('\x00')[0]
-            bf = '/'.join([fname,n2 + '.blk'])
+        block_data = _read_bytes(block_file)
+        count = len(block_data) // CUSTOMER_BLOCK_RECORD.itemsize
+        records = np.frombuffer(block_data, dtype=CUSTOMER_BLOCK_RECORD, count=count)
+        # 名字里的 \x00 之后是残留数据
+        blocknames = [name.split(b'\x00')[0].decode('gbk', 'ignore') for name in records['blockname'].tolist()]
+        block_types = [name.split(b'\x00')[0].decode('gbk', 'ignore') for name in records['block_type'].tolist()]
+
+        code_lists = []
+        code_indexes = []
+        for block_type in block_types:
+            bf = os.path.join(fname, block_type + '.blk')
             if not os.path.exists(bf):
                 raise Exception('file not exists')
-
-            codes = open(bf).read().splitlines()
-            if result_type == BlockReader_TYPE_FLAT:
-                for index,code in enumerate(codes):
-                    if code is not '':
-                        result.append(
-                            OrderedDict([
-                                ("blockname",n1),
-                                ("block_type",n2),
-                                ('code_index',index),
-                                ('code',code[1:])
-                            ])
-                        )
-
-            if result_type == BlockReader_TYPE_GROUP:
-                cc = [c[1:] for c in codes if c is not '']
-                result.append(
-                    OrderedDict([
-                        ("blockname",n1),
-                        ("block_type",n2),
-                        ("stock_count",len(cc)),
-                        ("code_list",",".join(cc))
-                    ])
-                )
-
-        return result
+            # 每行是市场加代码; 空行跳过, 但 code_index 仍是行号, 与逐行读取时一致
+            lines = [(index, line) for index, line in enumerate(_read_bytes(bf).splitlines()) if line]
+            code_indexes.extend(index for index, _ in lines)
+            code_lists.append([line[1:].decode('utf-8', 'ignore') for _, line in lines])
+
+        blocknames = np.array(blocknames, dtype=object)
+        block_types = np.array(block_types, dtype=object)
+        if result_type == BlockReader_TYPE_GROUP:
+            return _group_columns(blocknames, block_types, code_lists)
+
+        block_index = np.repeat(np.arange(len(code_lists)), [len(codes) for codes in code_lists])
+        return Columnar.from_arrays({
+            'blockname': blocknames[block_index],
+            'block_type': block_types[block_index],
+            'code_index': np.array(code_indexes, dtype='<u2'),
+            'code': np.array([code for codes in code_lists for code in codes], dtype=object),
+        })
 
 
 if __name__ == '__main__':
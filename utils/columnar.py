@@ -0,0 +1,93 @@
+# coding=utf-8
+
+"""
+按列存储的解析结果
+
+解析器默认返回 dict 列表, 转成 DataFrame 时每个字段要再分配一遍. 打开 columnar 选项后,
+解析器按响应头里的记录数预先分配好每一列, 解码时直接写入, 转 DataFrame 时不再复制.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Columnar:
+
+    def __init__(self, schema, size: int = 0):
+        """
+        :param schema: [(字段名, dtype), ...], 字符串等不定长字段用 object
+        :param size: 预分配的行数
+        """
+        self.size = size
+        self.columns = {name: np.empty(size, dtype=dtype) for name, dtype in schema}
+        self._arrays = list(self.columns.values())
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        """
+        直接使用已经解码好的列, 不复制
+        """
+        result = cls([])
+        result.columns = dict(arrays)
+        result._arrays = list(result.columns.values())
+        result.size = len(result._arrays[0]) if result._arrays else 0
+        return result
+
+    @classmethod
+    def concat(cls, parts):
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            return cls([])
+        if len(parts) == 1:
+            return parts[0]
+        names = parts[0].columns.keys()
+        return cls.from_arrays({name: np.concatenate([part.columns[name] for part in parts]) for name in names})
+
+    def put(self, index: int, *values):
+        """
+        按 schema 的顺序写入一行
+        """
+        for array, value in zip(self._arrays, values):
+            array[index] = value
+
+    def truncate(self, size: int):
+        """
+        实际解出的行数少于预分配的行数时截断
+        """
+        if size < self.size:
+            self.columns = {name: array[:size] for name, array in self.columns.items()}
+            self._arrays = list(self.columns.values())
+            self.size = size
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def keys(self):
+        return self.columns.keys()
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays)
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns, copy=False)
+
+    def to_list(self) -> list:
+        """
+        转回与默认解析结果一致的 dict 列表
+        """
+        names = list(self.columns.keys())
+        return [dict(zip(names, row)) for row in zip(*(array.tolist() for array in self._arrays))]
+
+    def __repr__(self):
+        return "Columnar(size=%d, columns=%s)" % (self.size, list(self.columns.keys()))
@@ -0,0 +1,387 @@
+# coding=utf-8
+
+"""
+批量解码: 把整个解压后的响应体一次性解析成 NumPy 数组
+
+通达信的价格字段是变长有符号整数(见 utils.help.get_price),每条记录的长度
+取决于其中变长整数的字节数, 所以记录边界只能顺序扫描得到. 这里先用 NumPy 一次
+算出"从任意位置开始的变长整数在哪里结束", 扫描时每个字段只需一次数组查表,
+字段本身的解码(日期、价格、浮点数)再全部向量化完成.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+BAR_DTYPE = np.dtype([
+    ('datetime', 'datetime64[m]'),
+    ('open', 'i8'),
+    ('close', 'i8'),
+    ('high', 'i8'),
+    ('low', 'i8'),
+    ('vol', 'f4'),
+    ('amount', 'f4'),
+    ('upCount', 'u2'),
+    ('downCount', 'u2'),
+])
+
+# 一个价格最多占用的字节数: 6 + 7 * 4 = 34 位已经足够
+MAX_VARINT_LEN = 5
+
+
+def as_uint8(data) -> np.ndarray:
+    """
+    把 bytes/bytearray/memoryview 视作 uint8 数组, 不复制
+    """
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def varint_ends(buf: np.ndarray) -> np.ndarray:
+    """
+    ends[p] 为从 p 开始的变长整数结束后的位置(即下一个字段的起点)
+
+    变长整数在第一个最高位为 0 的字节处结束, 所以 ends[p] 等于 p 之后(含 p)
+    第一个终止字节的下标加一. 末尾额外补一个位置, 越界访问时返回 len(buf) + 1
+    """
+    size = len(buf)
+    ends = np.full(size + 1, size, dtype=np.int64)
+    terminal = (buf & 0x80) == 0
+    ends[:size][terminal] = np.flatnonzero(terminal)
+    ends = np.minimum.accumulate(ends[::-1])[::-1]
+    return ends + 1
+
+
+def decode_varints(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    向量化版本的 get_price, starts 为各个变长整数的起始位置
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    if starts.size == 0:
+        return np.zeros(starts.shape, dtype=np.int64)
+
+    padded = np.concatenate([buf, np.zeros(MAX_VARINT_LEN, dtype=np.uint8)])
+    lengths = ends[starts] - starts
+
+    first = padded[starts].astype(np.int64)
+    value = first & 0x3f
+    for k in range(1, MAX_VARINT_LEN):
+        part = (padded[starts + k].astype(np.int64) & 0x7f) << (6 + 7 * (k - 1))
+        value += np.where(lengths > k, part, 0)
+
+    return np.where(first & 0x40, -value, value)
+
+
+def gather_uint(buf: np.ndarray, starts: np.ndarray, size: int) -> np.ndarray:
+    """
+    从各个起始位置取出 size 字节的小端无符号整数
+    """
+    value = np.zeros(len(starts), dtype=np.uint64)
+    for k in range(size):
+        value |= buf[starts + k].astype(np.uint64) << np.uint64(8 * k)
+    return value
+
+
+def gather_float32(buf: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    return gather_uint(buf, starts, 4).astype(np.uint32).view(np.float32)
+
+
+def to_datetime64(nums: np.ndarray, with_time=False) -> np.ndarray:
+    """
+    向量化版本的 utils.help.to_datetime, 返回 datetime64[m]
+    """
+    nums = nums.astype(np.int64)
+    if with_time:
+        zip_data = nums & 0xFFFF
+        year = (zip_data >> 11) + 2004
+        month = (zip_data & 0x7FF) // 100
+        day = (zip_data & 0x7FF) % 100
+        minutes = nums >> 16
+    else:
+        year = nums // 10000
+        month = (nums % 10000) // 100
+        day = nums % 100
+        minutes = np.full(len(nums), 15 * 60, dtype=np.int64)
+
+    months = (year - 1970) * 12 + (month - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    return days.astype('datetime64[m]') + minutes.astype('timedelta64[m]')
+
+
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _date_year(num, with_time, max_year):
+    """
+    与 to_datetime 相同的合法性判断, 返回年份, 非法时返回 -1
+    """
+    if with_time:
+        zip_data = num & 0xFFFF
+        year = (zip_data >> 11) + 2004
+        month, day = divmod(zip_data & 0x7FF, 100)
+        if (num >> 16) >= 24 * 60:
+            return -1
+    else:
+        year, month_day = divmod(num, 10000)
+        month, day = divmod(month_day, 100)
+    if year < 1 or year > max_year or month < 1 or month > 12 or day < 1 or day > _DAYS_IN_MONTH[month]:
+        return -1
+    if month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        return -1
+    return year
+
+
+def scan_bars(data, ends: np.ndarray, count: int, with_time: bool):
+    """
+    顺序扫描记录边界, 返回每条记录的起点和涨跌家数字段的位置(没有则为 -1)
+
+    涨跌家数的判定与 stock.Bars.deserialize 保持一致: 若紧跟的 4 字节不是合法日期,
+    或者年份比上一条记录小, 则认为这 4 字节是 upCount/downCount
+    """
+    max_year = datetime.now().year
+    from_bytes = int.from_bytes
+    ends = ends.tolist()
+    record_starts = [0] * count
+    updown_starts = [-1] * count
+
+    # 下一条记录的日期在判断涨跌家数时已经解析过, 直接沿用
+    pos = 2
+    prev_year = -1
+    year = _date_year(from_bytes(data[pos: pos + 4], 'little'), with_time, max_year)
+    for i in range(count):
+        record_starts[i] = pos
+        if year < 0:
+            raise ValueError("bad bar date")
+        pos = ends[ends[ends[ends[pos + 4]]]] + 8
+
+        if i < count - 1:
+            next_year = _date_year(from_bytes(data[pos: pos + 4], 'little'), with_time, max_year)
+            if next_year < 0 or (i > 0 and next_year < prev_year):
+                updown_starts[i] = pos
+                pos += 4
+                next_year = _date_year(from_bytes(data[pos: pos + 4], 'little'), with_time, max_year)
+            prev_year, year = year, next_year
+
+    return np.array(record_starts, dtype=np.int64), np.array(updown_starts, dtype=np.int64)
+
+
+def decode_bars(data, with_time=False) -> np.ndarray:
+    """
+    把 stock.Bars 的响应体解码为 BAR_DTYPE 结构化数组
+    """
+    columns = decode_bar_columns(data, with_time)
+    bars = np.empty(len(columns['datetime']), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        bars[name] = columns[name]
+    return bars
+
+
+def decode_bar_columns(data, with_time=False) -> dict:
+    """
+    把 stock.Bars 的响应体解码为按字段分列的数组
+    """
+    buf = as_uint8(data)
+    count = int.from_bytes(data[:2], 'little')
+    if count == 0:
+        return {name: np.empty(0, dtype=BAR_DTYPE[name]) for name in BAR_DTYPE.names}
+
+    ends = varint_ends(buf)
+    record_starts, updown_starts = scan_bars(data, ends, count, with_time)
+
+    open_starts = record_starts + 4
+    close_starts = ends[open_starts]
+    high_starts = ends[close_starts]
+    low_starts = ends[high_starts]
+    vol_starts = ends[low_starts]
+
+    open_raw = decode_varints(buf, open_starts, ends)
+    close_raw = decode_varints(buf, close_starts, ends)
+    high_raw = decode_varints(buf, high_starts, ends)
+    low_raw = decode_varints(buf, low_starts, ends)
+
+    # 差分还原: open 相对上一根的 close, 其余相对本根的 open
+    close = np.cumsum(open_raw + close_raw)
+    open = open_raw + np.concatenate([[0], close[:-1]])
+
+    has_updown = updown_starts >= 0
+    updown = gather_uint(buf, np.where(has_updown, updown_starts, 0), 4)
+
+    return {
+        'datetime': to_datetime64(gather_uint(buf, record_starts, 4), with_time),
+        'open': open,
+        'close': close,
+        'high': open + high_raw,
+        'low': open + low_raw,
+        'vol': gather_float32(buf, vol_starts),
+        'amount': gather_float32(buf, vol_starts + 4),
+        'upCount': np.where(has_updown, updown & 0xFFFF, 0).astype(np.uint16),
+        'downCount': np.where(has_updown, updown >> np.uint64(16), 0).astype(np.uint16),
+    }
+
+
+# 分笔: minute 为当天的分钟数, price 为还原后的价格(厘), side 为原始的买卖方向(1 为卖, 其余按买处理;
+# 超出 int8 范围的值截断到边界)
+TRANSACTION_DTYPE = np.dtype([
+    ('minute', 'u2'),
+    ('price', 'i8'),
+    ('vol', 'i8'),
+    ('trans', 'i8'),
+    ('side', 'i1'),
+    ('unknown', 'i8'),
+])
+HISTORY_TRANSACTION_DTYPE = np.dtype([
+    ('minute', 'u2'),
+    ('price', 'i8'),
+    ('vol', 'i8'),
+    ('side', 'i1'),
+    ('unknown', 'i8'),
+])
+SIDE_SELL = 1
+
+# "%02d:%02d" 的查表, 覆盖一天内的分钟数
+_MINUTE_STRINGS = np.array(["%02d:%02d" % divmod(minute, 60) for minute in range(24 * 60)], dtype=object)
+
+
+def _orbit(jump: np.ndarray, start: int, count: int) -> np.ndarray:
+    """
+    start, jump[start], jump[jump[start]], ... 的前 count 项
+
+    倍增: 已知前 n 项时, 用 jump 的 n 次幂一次算出后 n 项, 只需 log2(count) 轮数组运算
+    """
+    out = np.empty(max(count, 1) * 2, dtype=np.int64)
+    out[0] = start
+    n = 1
+    while n < count:
+        np.take(jump, out[:n], out=out[n: 2 * n])
+        n *= 2
+        if n < count:
+            jump = jump[jump]
+    return out[:count]
+
+
+def scan_varint_records(buf: np.ndarray, offset: int, count: int, fixed: int, varints: int):
+    """
+    找出 count 条连续记录的边界, 每条记录为 fixed 字节的定长部分加 varints 个变长整数
+
+    每个变长整数恰好以一个终止字节(最高位为 0)结束, 所以在"终止字节的序号"上, 一条记录占 varints 个,
+    加上下一条记录定长部分里碰巧是终止字节的个数. 这个跳转对所有序号一次算出, 再用倍增求出各条记录,
+    不需要逐条扫描
+    :return: (记录起点, 各字段起点, 各字段长度), 后两个的形状为 (count, varints)
+    """
+    size = len(buf)
+    terminal = np.zeros(size + fixed + 1, dtype=np.int8)
+    terminal[:size] = buf < 0x80
+    positions = np.flatnonzero(terminal[:size])
+    total = len(positions)
+
+    # jump[k]: 第一个变长整数的终止字节序号为 k 的记录, 下一条记录的这个序号; total 表示越界
+    following = np.zeros(total, dtype=np.int64)
+    for j in range(1, fixed + 1):
+        following += terminal[positions + j]
+    jump = np.full(total + 1, total, dtype=np.int64)
+    jump[:total - varints + 1] = np.arange(varints, total + 1) + following[varints - 1:]
+    np.minimum(jump, total, out=jump)
+
+    first = int(np.searchsorted(positions, offset + fixed))
+    record_keys = _orbit(jump, first, count)
+    if record_keys[-1] + varints > total:
+        raise ValueError("truncated records")
+
+    field_ends = positions[record_keys[:, None] + np.arange(varints)]
+    record_starts = np.empty(count, dtype=np.int64)
+    record_starts[0] = offset
+    record_starts[1:] = field_ends[:-1, -1] + 1
+    field_starts = np.empty_like(field_ends)
+    field_starts[:, 0] = record_starts + fixed
+    field_starts[:, 1:] = field_ends[:, :-1] + 1
+    return record_starts, field_starts, field_ends - field_starts + 1
+
+
+def decode_sized_varints(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    已知各自长度的 decode_varints; 大多数变长整数只有一两个字节, 每一轮只处理还没结束的那些
+    """
+    first = buf[starts].astype(np.int64)
+    value = first & 0x3f
+    index = np.flatnonzero(lengths > 1)
+    k = 1
+    while index.size:
+        value[index] += (buf[starts[index] + k].astype(np.int64) & 0x7f) << (6 + 7 * (k - 1))
+        k += 1
+        index = index[lengths[index] > k]
+    negative = (first & 0x40) != 0
+    value[negative] = -value[negative]
+    return value
+
+
+def decode_transaction_columns(data, history=False) -> dict:
+    """
+    把 stock.Transaction(history=True 时为 stock.HistoryTransaction) 的响应体解码为按字段分列的数组,
+    字段见 TRANSACTION_DTYPE/HISTORY_TRANSACTION_DTYPE
+    """
+    dtype = HISTORY_TRANSACTION_DTYPE if history else TRANSACTION_DTYPE
+    count = int.from_bytes(data[:2], 'little')
+    if count == 0:
+        return {name: np.empty(0, dtype=dtype[name]) for name in dtype.names}
+
+    buf = as_uint8(data)
+    # 历史分笔的记录数后面还有 4 个字节
+    offset = 6 if history else 2
+    names = [name for name in dtype.names if name != 'minute']
+    record_starts, field_starts, field_lengths = scan_varint_records(buf, offset, count, 2, len(names))
+    values = decode_sized_varints(buf, field_starts.ravel(), field_lengths.ravel()).reshape(count, len(names))
+
+    columns = {'minute': buf[record_starts].astype(np.uint16) | (buf[record_starts + 1].astype(np.uint16) << 8)}
+    for i, name in enumerate(names):
+        columns[name] = values[:, i]
+    # 价格是相对上一笔的差值
+    columns['price'] = np.cumsum(columns['price'])
+    # 先截断到 int8 的范围再转换, 超出范围的异常值不会回绕成 1 (卖)
+    columns['side'] = np.clip(columns['side'], np.iinfo(np.int8).min, np.iinfo(np.int8).max).astype(np.int8)
+    return columns
+
+
+def decode_transactions(data, history=False) -> np.ndarray:
+    columns = decode_transaction_columns(data, history)
+    dtype = HISTORY_TRANSACTION_DTYPE if history else TRANSACTION_DTYPE
+    ticks = np.empty(len(columns['minute']), dtype=dtype)
+    for name in dtype.names:
+        ticks[name] = columns[name]
+    return ticks
+
+
+def decode_order_columns(data, offset=2) -> dict:
+    """
+    把 stock.Orders 的响应体解码为按字段分列的数组: price(还原后的价格), vol, unknown
+
+    每条记录是三个变长整数(价格差, unknown, vol), 没有定长部分
+    """
+    count = int.from_bytes(data[:2], 'little')
+    if count == 0:
+        return {name: np.empty(0, dtype=np.int64) for name in ('price', 'vol', 'unknown')}
+
+    buf = as_uint8(data)
+    _, field_starts, field_lengths = scan_varint_records(buf, offset, count, 0, 3)
+    values = decode_sized_varints(buf, field_starts.ravel(), field_lengths.ravel()).reshape(count, 3)
+    return {
+        # 价格是相对上一条的差值
+        'price': np.cumsum(values[:, 0]),
+        'vol': values[:, 2],
+        'unknown': values[:, 1],
+    }
+
+
+def format_minutes(minutes: np.ndarray) -> np.ndarray:
+    """
+    分钟数转为 "HH:MM" 字符串的 object 数组
+    """
+    minutes = np.asarray(minutes)
+    if minutes.size == 0 or minutes.max() < len(_MINUTE_STRINGS):
+        return _MINUTE_STRINGS[minutes]
+    return np.array(["%02d:%02d" % divmod(minute, 60) for minute in minutes.tolist()], dtype=object)
+
+
+def format_sides(sides: np.ndarray) -> np.ndarray:
+    """
+    买卖方向转为 'BUY'/'SELL' 字符串的 object 数组
+    """
+    return np.where(np.asarray(sides) == SIDE_SELL, 'SELL', 'BUY').astype(object)
@@ -0,0 +1,78 @@
+# coding=utf-8
+
+"""
+分块下载服务器上的文件(板块文件、研报等)
+
+block.Info/block.Report 一次最多返回 0x7530 字节. 文件大小已知时, 全部分块的起点都是已知的,
+一次把请求全部排出去交给 fetch 并发(连接池)或者流水线(单连接)执行, 各块直接写进预先按文件大小
+分配好的缓冲区; 大小未知时只能一块一块往后读, 直到服务器返回空块.
+"""
+
+from utils.log import log
+
+CHUNK_SIZE = 0x7530
+# 分块返回的数据比请求的少时, 补下缺失部分的最多轮数
+MAX_REFETCH_ROUNDS = 3
+
+
+def download_chunks(fetch, make_parser, size: int, chunk_size: int = CHUNK_SIZE, reporthook=None) -> bytearray:
+    """
+    :param fetch: fetch(parsers) -> 与 parsers 顺序一致的结果列表, 出错时返回 None
+    :param make_parser: make_parser(start, size) -> block.Info/block.Report 请求
+    :param size: 文件大小
+    :param reporthook: reporthook(已下载字节数, 文件大小)
+    :return: 文件内容; 实际文件比 size 小时, 截断到服务器返回的最后一个字节
+    """
+    content = bytearray(size)
+    missing = [(start, min(chunk_size, size - start)) for start in range(0, size, chunk_size)]
+    downloaded = 0
+    end = 0
+    for _ in range(MAX_REFETCH_ROUNDS + 1):
+        if not missing:
+            break
+        results = fetch([make_parser(start, length) for start, length in missing])
+        if results is None:
+            raise Exception("download chunks failed")
+
+        remain = []
+        received_round = 0
+        for (start, length), result in zip(missing, results):
+            data = result['data'][:min(result['size'], length)] if result else b''
+            received = len(data)
+            content[start: start + received] = data
+            downloaded += received
+            received_round += received
+            if received > 0:
+                end = max(end, start + received)
+            if received < length:
+                remain.append((start + received, length - received))
+        missing = remain
+        if reporthook is not None:
+            reporthook(downloaded, size)
+        if received_round == 0:
+            # 服务器已经没有更多数据了
+            break
+
+    if missing and min(start for start, _ in missing) >= end:
+        log.debug("file is shorter than expected: %d < %d" % (end, size))
+        return content[:end]
+    if missing:
+        raise Exception("download chunks incomplete: %d bytes missing" % sum(length for _, length in missing))
+    return content
+
+
+def download_stream(call, make_parser, chunk_size: int = CHUNK_SIZE, reporthook=None) -> bytearray:
+    """
+    大小未知时顺序下载, 直到服务器返回空块
+    :param call: call(parser) -> 结果
+    """
+    content = bytearray()
+    while True:
+        result = call(make_parser(len(content), chunk_size))
+        if not result or result['size'] <= 0:
+            break
+        content.extend(result['data'][:result['size']])
+        if reporthook is not None:
+            reporthook(len(content), 0)
+    log.debug("downloaded %d bytes" % len(content))
+    return content
@@ -0,0 +1,88 @@
+# coding=utf-8
+
+"""
+分页拉取
+
+K 线、分笔等接口单次请求有条数上限(800/1800/2000), 要从最新往前一页一页地翻. iter_pages 按到达顺序
+逐页产出, 调用方可以边拉边处理; 需要完整结果时用 join_pages 倒序后一次拼接, 不再每页重建一遍列表.
+"""
+
+import numpy as np
+
+from utils.columnar import Columnar
+
+
+def _next_window(make_parser, page_size, start, count, window, fetched):
+    """
+    分页的起点都是已知的, 一次排出一个窗口的请求
+    :return: (请求列表, 每页的条数)
+    """
+    parsers = []
+    sizes = []
+    offset = fetched
+    while len(parsers) < window and (count is None or offset < count):
+        size = page_size if count is None else min(page_size, count - offset)
+        parsers.append(make_parser(start + offset, size))
+        sizes.append(size)
+        offset += size
+    return parsers, sizes
+
+
+def iter_pages(fetch, make_parser, page_size: int, start: int = 0, count: int = None, window: int = 1, stop=None):
+    """
+    :param fetch: fetch(parsers) -> 与 parsers 顺序一致的结果列表, 出错时返回 None
+    :param make_parser: make_parser(start, size) -> 一页的请求
+    :param page_size: 单页上限
+    :param count: 最多拉取的条数, None 表示直到取完
+    :param window: 一次发出的分页请求数, 大于 1 时配合流水线使用
+    :param stop: stop(part) 返回 True 时在这一页之后停止
+    :return: 分页结果的生成器, 越往后的分页越早
+    """
+    fetched = 0
+    while count is None or fetched < count:
+        parsers, sizes = _next_window(make_parser, page_size, start, count, window, fetched)
+        results = fetch(parsers)
+        if results is None:
+            return
+        for part, size in zip(results, sizes):
+            if part is None or len(part) == 0:
+                return
+            yield part
+            fetched += len(part)
+            if len(part) < size or (stop is not None and stop(part)):
+                return
+
+
+async def aiter_pages(fetch, make_parser, page_size: int, start: int = 0, count: int = None, window: int = 1, stop=None):
+    """
+    iter_pages 的 asyncio 版本, fetch 为协程函数
+    """
+    fetched = 0
+    while count is None or fetched < count:
+        parsers, sizes = _next_window(make_parser, page_size, start, count, window, fetched)
+        results = await fetch(parsers)
+        if results is None:
+            return
+        for part, size in zip(results, sizes):
+            if part is None or len(part) == 0:
+                return
+            yield part
+            fetched += len(part)
+            if len(part) < size or (stop is not None and stop(part)):
+                return
+
+
+def join_pages(parts, columnar: bool = False):
+    """
+    把 iter_pages 的分页倒序后一次拼接成按时间从早到晚的完整结果
+    """
+    parts = list(parts)
+    parts.reverse()
+    if parts and isinstance(parts[0], np.ndarray):
+        return np.concatenate(parts)
+    if columnar:
+        return Columnar.concat(parts)
+    result = []
+    for part in parts:
+        result.extend(part)
+    return result
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+"""
+定长记录的布局声明
+
+解析器用 [(字段名, struct 格式), ...] 声明一次记录布局, 这里把它编译成 struct.Struct 和
+等价的 NumPy dtype:
+
+    RECORD = RecordLayout([('code', '6s'), ('vol', 'H'), ('_', '8s')])
+    for code, vol, _ in RECORD.iter_unpack(data, 2, count): ...     # 逐条解码, 不切片
+    array = RECORD.to_array(data, 2, count)                         # 整体解码为结构化数组
+    body = RECORD.pack(b'600000', 100, b'')                         # 同一份声明用于序列化
+
+字段名以 '_' 开头的是保留或未知字段, 在 dtype 里会被重命名为 '_<序号>'.
+"""
+
+import struct
+
+import numpy as np
+
+# struct 格式字符对应的 NumPy 类型, 都按小端、不对齐处理
+NUMPY_FORMATS = {
+    'b': 'i1', 'B': 'u1',
+    'h': '<i2', 'H': '<u2',
+    'i': '<i4', 'I': '<u4',
+    'q': '<i8', 'Q': '<u8',
+    'f': '<f4', 'd': '<f8',
+}
+
+
+def to_numpy_format(fmt: str) -> str:
+    if fmt.endswith('s'):
+        return 'S' + (fmt[:-1] or '1')
+    if fmt in NUMPY_FORMATS:
+        return NUMPY_FORMATS[fmt]
+    raise Exception("unsupported record format: " + fmt)
+
+
+def decode_strings(array: np.ndarray, encoding='gbk') -> np.ndarray:
+    """
+    定长字符串列(S 类型)解码为 str 的 object 数组; 末尾的 \\x00 在 NumPy 里本来就会被去掉
+    """
+    return np.array([value.decode(encoding, errors='ignore') for value in array.tolist()], dtype=object)
+
+
+class RecordLayout:
+
+    def __init__(self, fields):
+        """
+        :param fields: [(字段名, struct 格式), ...], 格式为单个数值类型或 'Ns'
+        """
+        self.fields = fields
+        self.names = [name if not name.startswith('_') else '_%d' % i for i, (name, _) in enumerate(fields)]
+        self.struct = struct.Struct('<' + ''.join(fmt for _, fmt in fields))
+        self.dtype = np.dtype([(name, to_numpy_format(fmt)) for name, (_, fmt) in zip(self.names, fields)])
+        self.size = self.struct.size
+        if self.dtype.itemsize != self.size:
+            raise Exception("record layout size mismatch")
+
+    def unpack(self, data, offset: int = 0) -> tuple:
+        return self.struct.unpack_from(data, offset)
+
+    def iter_unpack(self, data, offset: int, count: int):
+        """
+        逐条解码 count 条连续的记录, 返回元组的迭代器
+        """
+        return self.struct.iter_unpack(memoryview(data)[offset: offset + count * self.size])
+
+    def to_array(self, data, offset: int, count: int) -> np.ndarray:
+        """
+        把 count 条连续的记录解码为结构化数组
+
+        返回的是副本: data 可能是连接复用的接收缓冲区
+        """
+        return np.frombuffer(data, dtype=self.dtype, count=count, offset=offset).copy()
+
+    def pack(self, *values) -> bytes:
+        return self.struct.pack(*values)
+
+    def pack_records(self, records) -> bytes:
+        """
+        :param records: 元组的列表, 或者 dtype 相同的结构化数组
+        """
+        if isinstance(records, np.ndarray):
+            return records.astype(self.dtype, copy=False).tobytes()
+        return b''.join(self.struct.pack(*record) for record in records)
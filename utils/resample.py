@@ -0,0 +1,154 @@
+# coding=utf-8
+
+"""
+K 线周期合成
+
+服务器按周期分别返回 K 线, 每个周期都要单独下载一遍. 这里用已有的 1 分钟/5 分钟线合成更长的分钟线和日线,
+用日线合成周线、月线、季线和年线, 一次下载就能得到全部周期:
+
+    bars = resample(minute_bars, KLINE_TYPE.ONE_MIN, KLINE_TYPE.THIRTY_MIN)
+    periods = resample_many(minute_bars, KLINE_TYPE.ONE_MIN, [KLINE_TYPE.ONE_HOUR, KLINE_TYPE.DAY_K, KLINE_TYPE.WEEKLY])
+
+分钟线的时间是这根 K 线的结束时间(09:31 ~ 11:30, 13:01 ~ 15:00). 分钟线按交易时段切分: 上午 09:30 ~ 11:30、
+下午 13:00 ~ 15:00 各 120 分钟, 午休不计, 所以 60 分钟线是 10:30、11:30、14:00、15:00 四根, 与服务器一致.
+日线及以上的 K 线时间取这一段里最后一根的时间.
+
+输入输出都是按时间升序的 BAR_DTYPE 数组. K 线先按所属的段算出分组键, 同一段在排好序的数组里是连续的,
+开收盘取段首段尾, 最高最低和成交量用 ufunc.reduceat 一次算完.
+"""
+
+import numpy as np
+
+from const import KLINE_TYPE
+from utils.fast_decode import BAR_DTYPE
+
+# 交易时段, 一天里的分钟数
+MORNING_OPEN = 9 * 60 + 30
+MORNING_CLOSE = 11 * 60 + 30
+AFTERNOON_OPEN = 13 * 60
+AFTERNOON_CLOSE = 15 * 60
+SESSION_MINUTES = 240
+
+# 分钟线的周期(分钟)
+MINUTE_PERIODS = {
+    KLINE_TYPE.ONE_MIN: 1,
+    KLINE_TYPE.EXHQ_1_MIN: 1,
+    KLINE_TYPE.FIVE_MIN: 5,
+    KLINE_TYPE.FIFTEEN_MIN: 15,
+    KLINE_TYPE.THIRTY_MIN: 30,
+    KLINE_TYPE.ONE_HOUR: 60,
+}
+DAY_TYPES = (KLINE_TYPE.DAY_K, KLINE_TYPE.DAILY)
+# 日线以上的周期, 值为日期的分组函数
+_LONG_PERIODS = {
+    # datetime64[W] 以周四为界, 这里按周一到周日分组; 1970-01-01 是周四
+    KLINE_TYPE.WEEKLY: lambda days: (days.astype(np.int64) + 3) // 7,
+    KLINE_TYPE.MONTHLY: lambda days: days.astype('datetime64[M]').astype(np.int64),
+    KLINE_TYPE.THREE_MONTH: lambda days: days.astype('datetime64[M]').astype(np.int64) // 3,
+    KLINE_TYPE.YEARLY: lambda days: days.astype('datetime64[Y]').astype(np.int64),
+}
+
+
+def session_minutes(datetimes: np.ndarray) -> np.ndarray:
+    """
+    :return: 每根分钟线结束于当天交易时段的第几分钟(1 ~ 240), 集合竞价和盘后的 K 线并入首尾
+    """
+    minutes = (datetimes - datetimes.astype('datetime64[D]')).astype('timedelta64[m]').astype(np.int64)
+    offset = np.where(minutes <= MORNING_CLOSE, minutes - MORNING_OPEN, minutes - AFTERNOON_OPEN + (MORNING_CLOSE - MORNING_OPEN))
+    return np.clip(offset, 1, SESSION_MINUTES)
+
+
+def session_time(offset: np.ndarray) -> np.ndarray:
+    """
+    session_minutes 的逆过程: 交易时段里的第几分钟 -> 当天的分钟数
+    """
+    morning = MORNING_CLOSE - MORNING_OPEN
+    return np.where(offset <= morning, MORNING_OPEN + offset, AFTERNOON_OPEN + offset - morning)
+
+
+def reduce_segments(bars: np.ndarray, keys: np.ndarray, datetimes: np.ndarray = None) -> np.ndarray:
+    """
+    把分组键相同的相邻 K 线合并为一根
+    :param keys: 与 bars 等长的分组键
+    :param datetimes: 每根 K 线所在的段的时间, None 表示取段内最后一根的时间
+    """
+    if len(bars) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    ends = np.concatenate([starts[1:], [len(bars)]]) - 1
+
+    merged = np.empty(len(starts), dtype=BAR_DTYPE)
+    merged['datetime'] = bars['datetime'][ends] if datetimes is None else datetimes[starts]
+    merged['open'] = bars['open'][starts]
+    merged['close'] = bars['close'][ends]
+    merged['high'] = np.maximum.reduceat(bars['high'], starts)
+    merged['low'] = np.minimum.reduceat(bars['low'], starts)
+    # 在 float64 上累加, 避免 float32 的累积误差
+    merged['vol'] = np.add.reduceat(bars['vol'].astype(np.float64), starts)
+    merged['amount'] = np.add.reduceat(bars['amount'].astype(np.float64), starts)
+    # 指数的涨跌家数是时点值, 取段尾
+    merged['upCount'] = bars['upCount'][ends]
+    merged['downCount'] = bars['downCount'][ends]
+    return merged
+
+
+def _check(source: KLINE_TYPE, target: KLINE_TYPE):
+    if source in MINUTE_PERIODS:
+        if target in MINUTE_PERIODS:
+            if MINUTE_PERIODS[target] % MINUTE_PERIODS[source] != 0:
+                raise Exception("cannot resample %s to %s" % (source.name, target.name))
+            return
+        if target in DAY_TYPES or target in _LONG_PERIODS:
+            return
+    elif source in DAY_TYPES and (target in DAY_TYPES or target in _LONG_PERIODS):
+        return
+    raise Exception("cannot resample %s to %s" % (source.name, target.name))
+
+
+def resample(bars: np.ndarray, source: KLINE_TYPE, target: KLINE_TYPE) -> np.ndarray:
+    """
+    :param bars: source 周期的 K 线, BAR_DTYPE, 按时间升序
+    :return: target 周期的 K 线, BAR_DTYPE
+    """
+    _check(source, target)
+    if source == target or (source in DAY_TYPES and target in DAY_TYPES) or \
+            (target in MINUTE_PERIODS and MINUTE_PERIODS[source] == MINUTE_PERIODS[target]):
+        return bars
+
+    datetimes = bars['datetime']
+    days = datetimes.astype('datetime64[D]')
+    if target in MINUTE_PERIODS:
+        period = MINUTE_PERIODS[target]
+        # 段的结束分钟, 不足一段的(例如 11:30 之前的零头)也以整段的结束时间为准
+        ends = np.minimum(-(-session_minutes(datetimes) // period) * period, SESSION_MINUTES)
+        keys = days.astype(np.int64) * (SESSION_MINUTES + 1) + ends
+        return reduce_segments(bars, keys, days.astype('datetime64[m]') + session_time(ends).astype('timedelta64[m]'))
+
+    if target in DAY_TYPES:
+        # 日线的时间与服务器一致, 为当天 15:00
+        close_time = np.timedelta64(AFTERNOON_CLOSE, 'm')
+        return reduce_segments(bars, days.astype(np.int64), days.astype('datetime64[m]') + close_time)
+
+    if source in MINUTE_PERIODS:
+        bars = resample(bars, source, KLINE_TYPE.DAY_K)
+        days = bars['datetime'].astype('datetime64[D]')
+    return reduce_segments(bars, _LONG_PERIODS[target](days))
+
+
+def resample_many(bars: np.ndarray, source: KLINE_TYPE, targets: list[KLINE_TYPE]) -> dict:
+    """
+    一份 K 线合成多个周期; 日线以上的周期都从合成一次的日线出发
+    :return: {KLINE_TYPE: BAR_DTYPE 数组}
+    """
+    for target in targets:
+        _check(source, target)
+    daily = None
+    result = {}
+    for target in targets:
+        if source in MINUTE_PERIODS and target in _LONG_PERIODS:
+            if daily is None:
+                daily = resample(bars, source, KLINE_TYPE.DAY_K)
+            result[target] = resample(daily, KLINE_TYPE.DAY_K, target)
+        else:
+            result[target] = resample(bars, source, target)
+    return result
@@ -0,0 +1,168 @@
+# coding=utf-8
+
+"""
+响应缓存
+
+公司资料、除权除息、财报、板块文件、证券列表这些参考数据一天最多变一次, 没必要每次都向服务器请求.
+ResponseCache 按 (msg_id, 请求体) 缓存服务器返回的原始响应体, 命中时只需要重新解析:
+
+    cache = ResponseCache(max_bytes=64 << 20, disk_dir='cache')
+    client = TdxClient(cache=cache)
+
+哪些请求可以缓存、缓存多久由解析器的 CACHE_TTL(秒) 决定, 默认 0 表示不缓存; 也可以用 ttls 按解析器覆盖.
+内存里是一个按字节数限制大小的 LRU, 指定 disk_dir 后还有一层磁盘缓存, 进程重启后仍然有效.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from parser.baseparser import BaseParser
+from utils.log import log
+
+DEFAULT_CACHE_BYTES = 64 << 20
+# 磁盘缓存文件头: 过期时间
+DISK_HEADER = struct.Struct('<d')
+
+
+class ResponseCache:
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, disk_dir=None, ttls: dict = None):
+        """
+        :param max_bytes: 内存中缓存的响应体总大小上限
+        :param disk_dir: 磁盘缓存目录, 为 None 时只缓存在内存里
+        :param ttls: {解析器类: 秒}, 覆盖解析器自己的 CACHE_TTL, 0 表示不缓存
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.ttls = ttls or {}
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl(self, parser: BaseParser) -> float:
+        for cls in type(parser).__mro__:
+            if cls in self.ttls:
+                return self.ttls[cls]
+        return getattr(parser, 'CACHE_TTL', 0)
+
+    @staticmethod
+    def key(parser: BaseParser):
+        return parser.msg_id, bytes(parser.body)
+
+    def _disk_path(self, key):
+        msg_id, body = key
+        return os.path.join(self.disk_dir, '%04x' % msg_id, hashlib.sha1(body).hexdigest())
+
+    def get(self, key):
+        """
+        :return: 缓存的响应体, 没有或者已过期时返回 None
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, data = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                self._remove(key)
+
+        data = self._disk_get(key, now)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        return data
+
+    def _disk_get(self, key, now):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug("read cache failed: %s" % e)
+            return None
+
+        # 写到一半被中断的文件连时间头都不完整, 和过期的一样删掉
+        (expires,) = DISK_HEADER.unpack_from(content) if len(content) >= DISK_HEADER.size else (0, )
+        if expires <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        data = content[DISK_HEADER.size:]
+        self._memory_put(key, data, expires)
+        return data
+
+    def put(self, key, data: bytes, ttl: float):
+        expires = time.time() + ttl
+        self._memory_put(key, data, expires)
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(DISK_HEADER.pack(expires))
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.debug("write cache failed: %s" % e)
+
+    def _memory_put(self, key, data: bytes, expires: float):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (expires, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.disk_dir is None:
+            return
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0,
+            }